@@ -0,0 +1,69 @@
+'''Micro benchmarks for the hot paths of the server.
+
+Run a benchmark from the repository root, e.g.
+
+	python -m bench.broadcast
+
+or the whole suite in bench.suite with python -m bench.
+'''
+import socket
+import time
+
+import curio
+
+
+def measure(func, min_time=0.2, repeat=5):
+	'''Call func repeatedly and return the best observed time per call in seconds.'''
+	number = 1
+	while True:
+		start = time.perf_counter()
+		for i in range(number):
+			func()
+		elapsed = time.perf_counter() - start
+		if elapsed >= min_time / repeat:
+			break
+		number *= 2
+	best = elapsed / number
+	for r in range(repeat - 1):
+		start = time.perf_counter()
+		for i in range(number):
+			func()
+		best = min(best, (time.perf_counter() - start) / number)
+	return best
+
+
+def measure_async(corofunc, number=1000, repeat=5):
+	'''Like measure, but for a coroutine function. All calls share one curio kernel.'''
+	async def loop():
+		start = time.perf_counter()
+		for i in range(number):
+			await corofunc()
+		return time.perf_counter() - start
+	return min(curio.run(loop) for r in range(repeat)) / number
+
+
+def report(name, seconds, unit="op"):
+	print(f"{name:<48} {seconds * 1e6:10.2f} us/{unit} {1 / seconds:12.0f} {unit}/s")
+
+
+class CountingSocket(socket.socket):
+	'''A socket that counts its send and receive calls, i.e. the syscalls curio makes.'''
+	sends = 0
+	recvs = 0
+
+	@classmethod
+	def pair(cls):
+		a, b = socket.socketpair()
+		return cls(a.family, a.type, a.proto, a.detach()), cls(b.family, b.type, b.proto, b.detach())
+
+	def send(self, *args):
+		CountingSocket.sends += 1
+		return super(CountingSocket, self).send(*args)
+
+	def recv(self, *args):
+		CountingSocket.recvs += 1
+		return super(CountingSocket, self).recv(*args)
+
+	def recv_into(self, *args):
+		CountingSocket.recvs += 1
+		return super(CountingSocket, self).recv_into(*args)
@@ -0,0 +1,108 @@
+'''Run the benchmark suite, optionally saving the results or comparing them
+with saved ones, e.g. before and after a change:
+
+	git stash && python -m bench --save /tmp/before.json && git stash pop
+	python -m bench --compare /tmp/before.json
+
+Compared runs exit with status 1 if a benchmark got slower by more than
+--threshold.'''
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+
+from . import report
+from .suite import CASES
+
+
+def git_commit():
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def run_once(pattern):
+	'''Run the cases whose function name contains pattern and return their results.'''
+	results = {}
+	for case in CASES:
+		if pattern not in case.__name__:
+			continue
+		gc.collect()
+		gc.disable()  # collections would be charged to whatever runs at the time
+		try:
+			for name, seconds, unit in case():
+				results[name] = {'seconds': seconds, 'unit': unit}
+		finally:
+			gc.enable()
+	return results
+
+
+def run(pattern, runs):
+	'''Run the suite runs times, each in a new process, print and return the
+	best time of each benchmark. Timings differ between processes (memory
+	layout, hash seeds) and other processes slow down some benchmarks of a
+	run, but rarely the same ones in every run.'''
+	results = {}
+	for r in range(runs):
+		worker = subprocess.run([sys.executable, "-m", "bench", "--worker", "--pattern", pattern], stdout=subprocess.PIPE, check=True)
+		for name, result in json.loads(worker.stdout).items():
+			if name not in results or result['seconds'] < results[name]['seconds']:
+				results[name] = result
+	for name, result in results.items():
+		report(name, result['seconds'], result['unit'])
+	return results
+
+
+def compare(results, baseline, threshold):
+	'''Print how much faster or slower each benchmark got. Return the names of those that got slower by more than threshold.'''
+	print(f"\nCompared with {baseline.get('commit') or 'unknown commit'} (python {baseline.get('python')}):")
+	slower = []
+	for name, result in results.items():
+		old = baseline['results'].get(name)
+		if old is None:
+			print(f"{name:<48} new")
+			continue
+		change = result['seconds'] / old['seconds'] - 1
+		mark = ""
+		if change > threshold:
+			mark = "  SLOWER"
+			slower.append(name)
+		elif change < -threshold:
+			mark = "  faster"
+		print(f"{name:<48} {old['seconds'] * 1e6:10.2f} -> {result['seconds'] * 1e6:10.2f} us/{result['unit']} {change:+7.1%}{mark}")
+	for name in baseline['results'].keys() - results.keys():
+		print(f"{name:<48} not run")
+	return slower
+
+
+def main():
+	ap = argparse.ArgumentParser(prog="python -m bench")
+	ap.add_argument("-k", "--pattern", default="", help="only run the cases in bench.suite whose function name contains this, e.g. pathfinder")
+	ap.add_argument("--runs", type=int, default=5, help="run the suite this often, each time in a new process, and keep the best time of each benchmark")
+	ap.add_argument("--save", metavar="FILE", help="write the results to this file")
+	ap.add_argument("--compare", metavar="FILE", help="compare the results with the ones saved in this file")
+	ap.add_argument("--threshold", type=float, default=0.1, help="relative change below which a benchmark counts as unchanged")
+	ap.add_argument("--worker", action='store_true', help=argparse.SUPPRESS)  # run once and write the results to stdout
+	args = ap.parse_args()
+
+	if args.worker:
+		json.dump(run_once(args.pattern), sys.stdout)
+		return
+
+	baseline = None
+	if args.compare is not None:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+	results = run(args.pattern, args.runs)
+	if args.save is not None:
+		with open(args.save, 'w') as f:
+			json.dump({'commit': git_commit(), 'python': platform.python_version(), 'results': results}, f, indent='\t')
+	if baseline is not None and compare(results, baseline, args.threshold):
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
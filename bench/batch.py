@@ -0,0 +1,77 @@
+'''Per-event cost of single envelopes and EventBatch envelopes.
+
+Takes a burst of map cells (as sent during map generation) and unit moves
+(as sent during a battle), in groups of the TCP client's max_batch. For
+each group it measures the bytes on the wire and the time the server
+needs to build the frames (and WebSocket frames) and the client needs
+to decode them. The
+packets are encoded beforehand, as a broadcast already did that.'''
+from reset.proto import events_pb2 as events, events_envelope
+from reset.server.ws_server import SUBPROTOCOL_PROTOBUF, SUBPROTOCOL_JSON
+
+from . import measure, report
+from .ws_formats import ws_server_connection
+
+
+def map_cell(i):
+	message = events.EventMapGenerateCell(terrain_type_id=i % 3 + 1)
+	message.position.x, message.position.y = i % 128, i // 128
+	return message
+
+
+def unit_move(i):
+	message = events.EventUnitMove(unit_id=i % 200 + 1)
+	message.position.x, message.position.y = i % 97, i % 89
+	return message
+
+
+def groups(messages, size):
+	packets = [events_envelope.packet(message) for message in messages]
+	for packet in packets:
+		packet.frame()
+		packet.json()
+	return [packets[i:i + size] for i in range(0, len(packets), size)]
+
+
+def decode(frames):
+	count = 0
+	for frame in frames:
+		wrapper = events.ServerToClient()
+		wrapper.ParseFromString(frame[4:])
+		count += len(events_envelope.unwrap_all(wrapper))
+	return count
+
+
+def tcp_frames(groups, batch):
+	if batch:
+		return [events_envelope.batch(group).frame() for group in groups]
+	return [packet.frame() for group in groups for packet in group]
+
+
+def ws_bytes(groups, subprotocol, batch):
+	server, _ = ws_server_connection(subprotocol)
+	total = 0
+	for group in groups:
+		for packet in [events_envelope.batch(group)] if batch else group:
+			server.send_data(packet.protobuf() if subprotocol == SUBPROTOCOL_PROTOBUF else packet.json())
+		total += len(server.bytes_to_send())
+	return total
+
+
+def main():
+	count = 16384
+	for name, make in (("map cells", map_cell), ("unit moves", unit_move)):
+		gs = groups([make(i) for i in range(count)], 64)
+		for batch in (False, True):
+			kind = "batch" if batch else "single"
+			frames = tcp_frames(gs, batch)
+			print(f"{name}, {kind}: TCP {sum(map(len, frames)) / count:5.1f} bytes/event, "
+				f"WS protobuf {ws_bytes(gs, SUBPROTOCOL_PROTOBUF, batch) / count:5.1f} bytes/event, "
+				f"WS JSON {ws_bytes(gs, SUBPROTOCOL_JSON, batch) / count:5.1f} bytes/event")
+			report(f"{name}, {kind}: build TCP frames", measure(lambda: tcp_frames(gs, batch)) / count, "event")
+			report(f"{name}, {kind}: client decode", measure(lambda: decode(frames)) / count, "event")
+			report(f"{name}, {kind}: WS protobuf framing", measure(lambda: ws_bytes(gs, SUBPROTOCOL_PROTOBUF, batch)) / count, "event")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,50 @@
+'''Broadcast throughput depending on the number of connected clients.
+
+Compares encoding every event once per client (how the transports used to
+do it) with encoding it once per wire format and sharing the buffers.
+Half of the clients are TCP clients (protobuf), the other half WebSocket
+clients (JSON).'''
+from reset.proto import events_pb2 as events, events_envelope, Packet
+from reset.server import Client, Server
+
+from . import measure_async, report
+
+
+class FakeClient(Client):
+	def __init__(self, json):
+		super(FakeClient, self).__init__()
+		self.json = json
+		self.sent = 0
+
+	async def send(self, message):
+		packet = events_envelope.packet(message)
+		self.sent += len(packet.json() if self.json else packet.frame())
+
+
+class PerClientEncodingClient(FakeClient):
+	async def send(self, message):
+		packet = Packet(events_envelope, message.message if isinstance(message, Packet) else message)
+		self.sent += len(packet.json() if self.json else packet.frame())
+
+
+def event():
+	message = events.EventUnitMove(unit_id=1234)
+	message.position.x, message.position.y = 17, 42
+	return message
+
+
+def run(client_type, count):
+	server = Server(None)
+	server.clients = {client_type(json=i % 2 == 1) for i in range(count)}
+	message = event()
+	return measure_async(lambda: server.broadcast(message))
+
+
+def main():
+	for count in (1, 2, 4, 8, 16, 32, 64):
+		report(f"broadcast to {count} clients, encode per client", run(PerClientEncodingClient, count), "event")
+		report(f"broadcast to {count} clients, encode once", run(FakeClient, count), "event")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,86 @@
+'''Cost of the client's logging: the log screens and the log file.
+
+Logs RECORDS debug records like the ones for map generation, with an
+info record every 100, through the root logger at DEBUG, and reports time
+per record on the logging thread and memory held afterwards:
+
+- the log screens: formatting every record into an ever growing list of
+  lines like it used to, and the ring buffers of ScreenLog.
+- the log file: logging.FileHandler, which writes and flushes every
+  record, and reset.log.BatchFileHandler.'''
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+from reset.client.ui import ScreenLog, UiLoggingHandler
+from reset.log import BatchFileHandler
+
+RECORDS = 200000
+
+
+class ListScreenLog:
+	'''The old log screen: formats every record and keeps all lines.'''
+	def __init__(self):
+		self.lines = []
+
+	def append_message(self, message):
+		self.lines.extend(message.split('\n'))
+
+
+class ListHandler(logging.Handler):
+	def __init__(self, screen):
+		super(ListHandler, self).__init__()
+		self.screen = screen
+
+	def emit(self, record):
+		self.screen.append_message(self.format(record))
+
+
+def flood(logger):
+	for i in range(RECORDS):
+		if i % 100 == 0:
+			logger.info("The game is starting!")
+		else:
+			logger.debug("Map (%d, %d) is terrain type %d", i % 256, i // 256, i % 3 + 1)
+
+
+def run(make_handler):
+	'''Return seconds per record on the logging thread and the bytes still allocated afterwards.'''
+	root = logging.getLogger()
+	root.setLevel(logging.DEBUG)
+	logger = logging.getLogger("protocol")
+	results = []
+	for traced in (False, True):  # tracing the memory slows everything down, time without it
+		handler = make_handler()
+		root.addHandler(handler)
+		if traced:
+			tracemalloc.start()
+		start = time.perf_counter()
+		flood(logger)
+		results.append((time.perf_counter() - start) / (RECORDS * 1.01))
+		if traced:
+			results.append(tracemalloc.get_traced_memory()[0])
+			tracemalloc.stop()
+		root.removeHandler(handler)
+		handler.close()
+	return results[0], results[2]
+
+
+def main():
+	directory = tempfile.mkdtemp()
+	cases = [
+		("no handler, just the records", logging.NullHandler),
+		("screen: list of all lines", lambda: ListHandler(ListScreenLog())),
+		("screen: ScreenLog ring buffers", lambda: UiLoggingHandler([ScreenLog(logging.INFO), ScreenLog(logging.DEBUG)], lambda: None)),
+		("file: logging.FileHandler", lambda: logging.FileHandler(os.path.join(directory, "plain.log"), mode='w')),
+		("file: BatchFileHandler", lambda: BatchFileHandler(os.path.join(directory, "batch.log"), mode='w')),
+	]
+	for name, handler in cases:
+		seconds, memory = run(handler)
+		print(f"{name:<32} {seconds * 1e6:6.2f} us/record {memory / 2**20:8.1f} MiB held")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,155 @@
+'''Client CPU for drawing the map screen, idle and with many units moving.
+
+Drives reset.client.ui.Ui against a terminal that only counts the cells it
+is given, with a 200x60 map and 500 units, and reports
+
+- the CPU time per frame: redrawing everything every frame like it used
+  to, and drawing only the cells changed since the last frame.
+- the CPU time of a full redraw for growing maps, which should only
+  depend on the size of the terminal.
+- the output loop running for a while: polling at 30 Hz like it used to,
+  and TerminalClient._run_output waiting for redraw requests, with the CPU used
+  and how long a change took to reach the terminal.'''
+import logging
+import time
+import types
+
+import curio
+
+from reset.client import GameState, Rules, Unit
+from reset.client.terminal import TerminalClient
+from reset.client.ui import Ui
+
+WIDTH, HEIGHT = 200, 60
+UNITS = 500
+FRAMES = 300
+
+
+class CountingTermbox:
+	def __init__(self):
+		self.cells = 0
+		self.presents = 0
+		self.changed = None  # when the first change not yet presented was made
+		self.latencies = []
+
+	def width(self):
+		return WIDTH
+
+	def height(self):
+		return HEIGHT + 1
+
+	def clear(self):
+		pass
+
+	def present(self):
+		self.presents += 1
+		if self.changed is not None:
+			self.latencies.append(time.monotonic() - self.changed)
+			self.changed = None
+
+	def change_cell(self, x, y, ch, fg, bg):
+		self.cells += 1
+
+	def write(self, x, y, text, **kwargs):
+		for i, c in enumerate(text):
+			self.change_cell(x + i, y, ord(c), 0, 0)
+
+
+def make_state(state, width=WIDTH, height=HEIGHT):
+	'''Fill in terrain and units for the top left WIDTH x HEIGHT cells of a map of the given size.'''
+	grass, water = types.SimpleNamespace(name="grass"), types.SimpleNamespace(name="water")
+	citizen = types.SimpleNamespace(name="citizen")
+	state.reset_map(width, height)
+	for y in range(HEIGHT):
+		for x in range(WIDTH):
+			state.map.set_terrain((x, y), water if (x * 7 + y * 3) % 11 == 0 else grass)
+	for i in range(UNITS):
+		state.add_unit(Unit(i + 1, citizen, i % 2 + 1, (i % WIDTH, i // WIDTH)))
+
+
+def make_client(width=WIDTH, height=HEIGHT):
+	client = types.SimpleNamespace(request_redraw=lambda: None, state=GameState())
+	make_state(client.state, width, height)
+	client.map = client.state.map
+	client.ui = Ui(client)
+	client.ui.screen_active = 1  # the map
+	return client
+
+
+def move_all(client, frame):
+	for unit in list(client.state.units.values()):
+		x, y = unit.position
+		client.state.move_unit(unit.id, ((x + 1) % WIDTH, y))
+
+
+async def frames(client, tb, moving, full):
+	'''Return the CPU time spent drawing FRAMES frames.'''
+	cpu = 0.0
+	for frame in range(FRAMES):
+		if moving:
+			move_all(client, frame)
+		start = time.process_time()
+		if full:
+			client.ui._drawn = None  # what the old loop did: clear and draw everything
+		if await client.ui.render(tb, 0, 0, tb.width(), tb.height()):
+			tb.present()
+		cpu += time.process_time() - start
+	return cpu
+
+
+async def polling(client):
+	while True:
+		if await client.ui.render(client.tb, 0, 0, client.tb.width(), client.tb.height()):
+			client.tb.present()
+		await curio.sleep(1/30.0)
+
+
+async def mover(client, rate):
+	'''Move all units rate times a second, like a busy game.'''
+	frame = 0
+	while True:
+		await curio.sleep(1 / rate)
+		move_all(client, frame)
+		frame += 1
+		if client.tb.changed is None:
+			client.tb.changed = time.monotonic()
+		client.request_redraw()
+
+
+async def output_loop(run_output, rate, seconds=3.0):
+	client = TerminalClient(logging.getLogger("bench"), "localhost", 0, Rules(), None)
+	client.tb = CountingTermbox()
+	make_state(client.state)
+	client.ui.screen_active = 1
+	start = time.process_time()
+	async with curio.TaskGroup() as g:
+		await g.spawn(run_output(client))
+		if rate:
+			await g.spawn(mover(client, rate))
+		await curio.sleep(seconds)
+		await g.cancel_remaining()
+	cpu = (time.process_time() - start) / seconds
+	latencies = sorted(client.tb.latencies) or [0]
+	return cpu, client.tb.presents / seconds, latencies[len(latencies) // 2], latencies[-1]
+
+
+def main():
+	for rate in (0, 4, 100):
+		for name, run_output in (("30 Hz polling", polling), ("redraw signal", TerminalClient._run_output)):
+			cpu, fps, p50, worst = curio.run(output_loop, run_output, rate)
+			print(f"{rate:3d} moves/s {name:<14} {cpu * 100:5.1f}% CPU {fps:5.1f} frames/s  change to screen p50 {p50 * 1e3:5.1f} ms max {worst * 1e3:5.1f} ms")
+	for moving in (False, True):
+		for full in (True, False):
+			client, tb = make_client(), CountingTermbox()
+			cpu = curio.run(frames, client, tb, moving, full) / FRAMES
+			print(f"{'moving' if moving else 'idle':<6} {'full redraw' if full else 'dirty cells':<12} {cpu * 1e6:9.1f} us CPU/frame "
+				f"({cpu * 30 * 100:5.1f}% of a core at 30 fps) {tb.cells / FRAMES:8.0f} cells/frame {tb.presents:4d} presents")
+
+	for size in (200, 4096, 100000):
+		client, tb = make_client(size, size), CountingTermbox()
+		cpu = curio.run(frames, client, tb, False, True) / FRAMES
+		print(f"{size}x{size} map full redraw {cpu * 1e6:9.1f} us CPU/frame {tb.cells / FRAMES:8.0f} cells/frame")
+
+
+if __name__ == '__main__':
+	main()
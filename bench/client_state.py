@@ -0,0 +1,64 @@
+'''Queries on the client's GameState vs. scanning the map, and the cost of
+a message the client has no handler for.
+
+A 256x256 map with 2000 units of 4 players, a quarter of them busy.'''
+import logging
+import random
+import types
+
+import google.protobuf.json_format
+
+from reset.client import GameState, ProtocolUser, Unit, Action
+from reset.proto import events_pb2 as events
+
+from . import measure, measure_async, report
+
+SIZE = 256
+UNITS = 2000
+
+
+def make_state(seed=1):
+	rng = random.Random(seed)
+	citizen, city = types.SimpleNamespace(name="citizen"), types.SimpleNamespace(name="city")
+	state = GameState()
+	state.player_id = 1
+	state.reset_map(SIZE, SIZE)
+	positions = rng.sample(range(SIZE * SIZE), UNITS)
+	for i, position in enumerate(positions):
+		state.add_unit(Unit(i + 1, citizen if i % 10 else city, i % 4 + 1, (position % SIZE, position // SIZE)))
+		if i % 4 == 0:
+			state.add_action(Action(i + 1, i + 1))
+	return state
+
+
+def scan_idle_citizens(state):
+	busy = {action.unit_id for action in state.actions.values()}
+	return [cell.unit for xy, cell in state.map if cell.unit is not None and cell.unit.player_id == state.player_id
+		and cell.unit.id not in busy and cell.unit.unit_type.name == "citizen"]
+
+
+def scan_near(state, xy, radius):
+	x, y = xy
+	return [cell.unit for (cx, cy), cell in state.map if cell.unit is not None and abs(cx - x) <= radius and abs(cy - y) <= radius]
+
+
+def main():
+	state = make_state()
+	assert {u.id for u in state.idle_units("citizen")} == {u.id for u in scan_idle_citizens(state)}
+	assert {u.id for u in state.units_near((100, 100), 5)} == {u.id for u in scan_near(state, (100, 100), 5)}
+	report("my idle citizens: scan the map", measure(lambda: scan_idle_citizens(state)), "query")
+	report("my idle citizens: GameState.idle_units", measure(lambda: state.idle_units("citizen")), "query")
+	report("units near (100, 100), r=5: scan the map", measure(lambda: scan_near(state, (100, 100), 5)), "query")
+	report("units near (100, 100), r=5: GameState.units_near", measure(lambda: state.units_near((100, 100), 5)), "query")
+	report("units near (100, 100), r=50: GameState.units_near", measure(lambda: state.units_near((100, 100), 50)), "query")
+
+	message = events.EventActionUpdate(action_id=1, state=events.WORKING, duration=100)
+	logger = logging.getLogger("bench")
+	logger.setLevel(logging.INFO)
+	protocol = ProtocolUser(logger)
+	report("unhandled message: JSON formatted", measure(lambda: google.protobuf.json_format.MessageToJson(message)), "msg")
+	report("unhandled message: debug off", measure_async(lambda: protocol.on_unhandled(None, None, message), 10000), "msg")
+
+
+if __name__ == '__main__':
+	main()
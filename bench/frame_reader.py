@@ -0,0 +1,77 @@
+'''Receiving a stream of small commands, like a bot firing many commands per second.
+
+Compares reading every frame with two exact reads (4 byte header, then the
+body, each into a new bytearray) with FrameReader, which receives big
+chunks and returns all frames in them.'''
+import time
+
+import curio
+import curio.io
+
+from reset.proto import commands_pb2 as commands, commands_envelope, FrameReader
+
+from . import CountingSocket
+
+
+async def recv_len(sock, length):
+	buf_back = bytearray(length)
+	buf = memoryview(buf_back)
+	have = 0
+	while have < length:
+		got = await sock.recv_into(buf[have:], length - have)
+		if got == 0:
+			raise ConnectionResetError("Client Disconnected")
+		have += got
+	return buf_back
+
+
+async def read_exact(sock, count):
+	for i in range(count):
+		length = int.from_bytes(await recv_len(sock, 4), 'big')
+		commands.ClientToServer().ParseFromString(await recv_len(sock, length))
+
+
+async def read_frames(sock, count):
+	reader = FrameReader(sock)
+	while count:
+		for frame in await reader.frames():
+			commands.ClientToServer().ParseFromString(frame)
+			count -= 1
+
+
+def action_queue(i):
+	message = commands.CmdActionQueue(action_type_id=1, unit_id=i % 40)
+	message.target_cell.x, message.target_cell.y = i % 31, i % 37
+	return message
+
+
+async def run(read, count):
+	a, b = CountingSocket.pair()
+	writer, reader = curio.io.Socket(a), curio.io.Socket(b)
+	frames = [commands_envelope.packet(action_queue(i)).frame() for i in range(count)]
+
+	async def write():
+		for i in range(0, count, 50):  # bursts of 50 commands
+			await writer.sendall(b''.join(frames[i:i + 50]))
+			await curio.sleep(0)
+
+	CountingSocket.recvs = 0
+	start = time.perf_counter()
+	sender = await curio.spawn(write())
+	await read(reader, count)
+	elapsed = time.perf_counter() - start
+	await sender.join()
+	await writer.close()
+	await reader.close()
+	return elapsed, CountingSocket.recvs
+
+
+def main():
+	count = 50000
+	for name, read in (("two exact reads per frame", read_exact), ("FrameReader", read_frames)):
+		elapsed, recvs = curio.run(run, read, count)
+		print(f"{name:<28} {recvs / count:7.3f} recv syscalls/cmd {count / elapsed:10.0f} cmd/s")
+
+
+if __name__ == '__main__':
+	main()
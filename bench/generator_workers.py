@@ -0,0 +1,48 @@
+'''How map generation scales with the number of worker processes.
+
+Generates the server's map for PLAYERS players (about 280x280 cells) with
+the noise passes computed in one process (no --chunk-size), and in tiles of
+CHUNK_SIZE with 1, 2, 4, ... worker processes up to the number of cores,
+and reports the time of the noise passes. With one worker, the difference
+to the single process run is the cost of pickling the tiles.'''
+import os
+import time
+
+import curio
+
+from reset import util
+from reset.server.__main__ import gen
+from reset.server.game import Player
+
+PLAYERS = 200
+CHUNK_SIZE = 64
+
+
+def noise_time(chunk_size, workers):
+	gen.seed = 1
+	gen.chunk_size = chunk_size
+	gen.workers = workers
+	players = util.IdList(Player)
+	for i in range(PLAYERS):
+		players.create(f"player{i}", None)
+	curio.run(gen.generate(players))
+	return sum(seconds for name, seconds in gen.timings.items() if name.endswith("NoisePass"))
+
+
+def main():
+	cores = os.cpu_count() or 1
+	baseline = min(noise_time(None, None) for r in range(3))
+	print(f"{'one process':<16} {baseline:6.2f} s")
+	workers = 1
+	while True:
+		seconds = min(noise_time(CHUNK_SIZE, workers) for r in range(3))
+		print(f"{workers:>2} workers       {seconds:6.2f} s  {baseline / seconds:4.1f}x")
+		if workers >= cores:
+			break
+		workers = min(workers * 2, cores)
+	if cores == 1:
+		print("only one core, there is nothing to scale to")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,51 @@
+'''Planning a group move: one A* search per unit vs. one shared flow field.
+
+A group of units in the corner of a 128x128 map with scattered mountains
+heads for a cell in the opposite corner, as with CmdActionQueueMany.'''
+import random
+
+from reset import util
+from reset.server.game import Map, Player
+from reset.server.pathfinder import PathFinder
+from reset.server.rules import Rules
+
+from . import measure, report
+
+
+def make_map(size=128, seed=1):
+	rules = Rules()
+	grass = rules.terrain_types.create("grass", "Grass", {"walk", "build"})
+	mountain = rules.terrain_types.create("mountain", "Mountains", set())
+	rng = random.Random(seed)
+	map = Map(util.IdList(Player), size, size)
+	for cell in map.cells:
+		cell.terrain_type = mountain if rng.random() < 0.2 else grass
+	return map, grass
+
+
+def group(map, grass, count):
+	starts = []
+	for y in range(map.height):
+		for x in range(map.width):
+			if len(starts) < count and map[x, y].terrain_type is grass:
+				starts.append((x, y))
+	return starts
+
+
+def main():
+	map, grass = make_map()
+	dest = next((x, y) for y in range(map.height - 1, 0, -1) for x in range(map.width - 1, 0, -1) if map[x, y].terrain_type is grass)
+	pathfinder = PathFinder(map)
+	for count in (1, 8, 40, 100):
+		starts = group(map, grass, count)
+		assert [len(pathfinder.plan(s, dest)) for s in starts] == [len(pathfinder.flow_field(dest, starts).path(s)) for s in starts]
+		report(f"{count} units: A* per unit", measure(lambda: [pathfinder.plan(s, dest) for s in starts], repeat=3), "group")
+
+		def shared():
+			flow_field = pathfinder.flow_field(dest, starts)
+			return [flow_field.path(s) for s in starts]
+		report(f"{count} units: shared flow field", measure(shared, repeat=3), "group")
+
+
+if __name__ == '__main__':
+	main()
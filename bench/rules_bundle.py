@@ -0,0 +1,41 @@
+'''Start-of-game rules traffic: one Info message per rule vs. the RulesBundle.
+
+For growing rule sets, reports the frames and bytes a TCP client gets and
+the time spent building and encoding them. The individual messages were
+built and encoded again at every game start; the bundle is built once
+when the server starts, and a client that has it already gets only its
+hash.'''
+from reset.proto import events_envelope
+from reset.server import RulesBundle, rules_events
+from reset.server.rules import Rules, ActionTargetType
+
+from . import measure, report
+
+
+def make_rules(count):
+	rules = Rules()
+	terrain = [rules.terrain_types.create(f"terrain{i}", f"Terrain {i}", {"walk", "build"}) for i in range(max(count // 4, 1))]
+	resources = [rules.resource_types.create(f"resource{i}", f"Resource {i}", 100) for i in range(max(count // 8, 1))]
+	for i in range(count):
+		unit_type = rules.unit_types.create(f"unit{i}", f"Unit {i}", {"building", f"tag{i}"})
+		rules.action_types.create(None, f"unit{i}_move", "Move somewhere", unit_type, {resources[i % len(resources)]: 10}, 0.5, target_type=ActionTargetType.CELL, target_tags={"walk"})
+	return rules
+
+
+def single_messages(rules):
+	return [events_envelope.packet(info).frame() for info in rules_events(rules)]
+
+
+def main():
+	for count in (4, 16, 64, 256):
+		rules = make_rules(count)
+		frames = single_messages(rules)
+		bundle = RulesBundle(rules)
+		print(f"{count:3d} unit types: single {len(frames):4d} frames {sum(map(len, frames)):7d} bytes, "
+			f"bundle 1 frame {len(bundle.full.frame()):7d} bytes, cached {len(bundle.unchanged.frame())} bytes")
+		report(f"{count} unit types: build single messages", measure(lambda: single_messages(rules)), "game")
+		report(f"{count} unit types: build bundle", measure(lambda: RulesBundle(rules).full.frame()), "server")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,111 @@
+'''Cost of the server's log output to the code that logs, when whatever reads
+it (a terminal, journald, a pipe to a log shipper) doesn't keep up.
+
+Writes RECORDS lines like "Player joined" to a pipe that a thread drains
+slowly, READ_SIZE bytes every READ_INTERVAL seconds, and reports the time per
+call on the logging thread, the longest call, and how long until the reader
+got everything:
+
+- print, like the server used to.
+- logging.StreamHandler, which writes and flushes every record.
+- reset.log.BatchStreamHandler, which queues records for a thread of its own.
+- BatchStreamHandler with a SampleFilter, as the server sets it up.'''
+import logging
+import os
+import threading
+import time
+
+from reset.log import BatchStreamHandler, SampleFilter, StructuredFormatter, fields
+
+RECORDS = 20000
+READ_SIZE = 4096
+READ_INTERVAL = 0.01
+
+
+def slow_reader(fd, done):
+	while True:
+		data = os.read(fd, READ_SIZE)
+		if not data:
+			done.set()
+			return
+		time.sleep(READ_INTERVAL)
+
+
+def run(log):
+	'''Call log(stream, i) RECORDS times writing to a slowly read pipe. Return
+	the mean and the longest call and the time until everything was read.'''
+	read_fd, write_fd = os.pipe()
+	done = threading.Event()
+	threading.Thread(target=slow_reader, args=(read_fd, done), daemon=True).start()
+	stream = open(write_fd, 'w')
+	close = log(stream, None)  # set up
+	longest = 0.0
+	start = time.perf_counter()
+	for i in range(RECORDS):
+		call = time.perf_counter()
+		log(stream, i)
+		longest = max(longest, time.perf_counter() - call)
+	elapsed = time.perf_counter() - start
+	close()
+	stream.close()
+	done.wait()
+	os.close(read_fd)
+	return elapsed / RECORDS, longest, time.perf_counter() - start
+
+
+def with_print(stream, i):
+	if i is None:
+		return lambda: None
+	print(f"Player joined: 'player{i % 100}'", file=stream)
+
+
+def with_handler(make_handler):
+	logger = logging.getLogger("bench")
+	logger.propagate = False
+	logger.setLevel(logging.INFO)
+
+	def log(stream, i):
+		if i is None:
+			handler = make_handler(stream)
+			logger.addHandler(handler)
+
+			def close():
+				logger.removeHandler(handler)
+				handler.close()
+			return close
+		logger.info("Player joined", extra=fields(player=f"player{i % 100}"))
+	return log
+
+
+def stream_handler(stream):
+	handler = logging.StreamHandler(stream)
+	handler.setFormatter(StructuredFormatter())
+	return handler
+
+
+def batch_handler(stream):
+	handler = BatchStreamHandler(stream)
+	handler.setFormatter(StructuredFormatter())
+	return handler
+
+
+def sampled_batch_handler(stream):
+	handler = batch_handler(stream)
+	handler.addFilter(SampleFilter())
+	return handler
+
+
+def main():
+	cases = [
+		("print", with_print),
+		("logging.StreamHandler", with_handler(stream_handler)),
+		("BatchStreamHandler", with_handler(batch_handler)),
+		("BatchStreamHandler + SampleFilter", with_handler(sampled_batch_handler)),
+	]
+	for name, log in cases:
+		mean, longest, total = run(log)
+		print(f"{name:<36} {mean * 1e6:8.2f} us/call, longest {longest * 1000:7.2f} ms, all read after {total:5.2f} s")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,59 @@
+'''Outbox growth and broadcast cost with a client that stopped reading.
+
+A TcpClient on a socket pair whose other end never reads gets a long
+stream of unit moves and resource updates, as in a running game. Once the
+socket buffers are full, everything piles up in the client's outbox.
+"unbounded" behaves like the plain curio.Queue the transports used to have.'''
+import time
+
+import curio
+import curio.io
+
+from reset.proto import events_pb2 as events
+from reset.server import Server
+from reset.server.outbox import Outbox, COALESCE, RESYNC, DISCONNECT
+from reset.server.tcp_server import TcpClient
+
+from . import CountingSocket
+
+
+def event(i):
+	if i % 10 == 0:
+		return events.EventPlayerResource(resource_type_id=i % 3 + 1, amount=i)
+	message = events.EventUnitMove(unit_id=i % 500)
+	message.position.x, message.position.y = i % 97, i % 89
+	return message
+
+
+async def stalled(outbox, count):
+	a, b = CountingSocket.pair()
+	server = Server(None)
+	client = TcpClient(curio.io.Socket(a), ('stalled', 0), outbox=outbox)
+	client.server = server
+	server.clients = {client}
+	sender = await curio.spawn(client._run_send())
+	start = time.perf_counter()
+	for i in range(count):
+		await server.broadcast(event(i))
+		if i % 100 == 0:
+			await curio.sleep(0)
+	elapsed = time.perf_counter() - start
+	await sender.cancel()
+	await client.sock.close()
+	b.close()
+	return elapsed, client.outbox_stats()
+
+
+def main():
+	count = 200000
+	for name, outbox in (
+			("unbounded", Outbox(count, RESYNC)),
+			("coalesce", Outbox(4096, COALESCE)),
+			("resync", Outbox(4096, RESYNC)),
+			("disconnect", Outbox(4096, DISCONNECT))):
+		elapsed, stats = curio.run(stalled, outbox, count)
+		print(f"{name:<10} {elapsed / count * 1e6:6.2f} us/event  " + "  ".join(f"{k}={v}" for k, v in stats.items()))
+
+
+if __name__ == '__main__':
+	main()
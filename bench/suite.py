@@ -0,0 +1,192 @@
+'''The benchmark suite run by python -m bench: the hot paths of the server,
+each reported as seconds per operation.
+
+Every case is a generator function decorated with @case that yields
+(name, seconds, unit). Names must stay the same between commits, they are
+what saved results are compared by.'''
+import random
+import time
+
+import curio
+
+from reset import util
+from reset.proto import commands_pb2 as commands, events_envelope, Protocol
+from reset.server import Server, trace
+from reset.server.game import Map, Player, Value
+from reset.server.metrics import Metrics
+from reset.server.pathfinder import PathFinder
+from reset.server.rules import Rules
+
+from . import measure, measure_async
+from .ws_formats import sample_events
+
+CASES = []
+
+
+def case(func):
+	CASES.append(func)
+	return func
+
+
+def make_rules():
+	rules = Rules()
+	grass = rules.terrain_types.create("grass", "Grass", {"walk", "build"})
+	mountain = rules.terrain_types.create("mountain", "Mountains", set())
+	citizen = rules.unit_types.create("citizen", "Citizen", set())
+	food = rules.resource_types.create("food", "Food", 100)
+	return rules, grass, mountain, citizen, food
+
+
+def obstacle_map(size, density, seed=1):
+	'''A size x size map where a random share density of the cells is blocked, apart from the corners.'''
+	rules, grass, mountain, citizen, food = make_rules()
+	rng = random.Random(seed)
+	map = Map(util.IdList(Player), size, size)
+	for cell in map.cells:
+		cell.terrain_type = mountain if rng.random() < density else grass
+	map[0, 0].terrain_type = map[size - 1, size - 1].terrain_type = grass
+	return map
+
+
+@case
+def pathfinder():
+	'''Corner to corner. With many obstacles there may be no path, then A* looks at everything it can reach.'''
+	for size in (32, 128, 512):
+		for density in (0.0, 0.2, 0.35):
+			finder = PathFinder(obstacle_map(size, density))
+			yield f"PathFinder.plan {size}x{size} {density:.0%} blocked", measure(lambda: finder.plan((0, 0), (size - 1, size - 1))), "plan"
+
+
+@case
+def generator():
+	'''The server's generator passes, on the map for some players. Each pass is timed by Generator itself.'''
+	from reset.server.__main__ import gen
+	gen.seed = 1
+	for player_count in (2, 8):
+		best = {}
+		for r in range(5):
+			players = util.IdList(Player)
+			for i in range(player_count):
+				players.create(f"player{i}", None)
+			curio.run(gen.generate(players))
+			for name, seconds in gen.timings.items():
+				best[name] = min(seconds, best.get(name, seconds))
+		for name, seconds in best.items():
+			yield f"Generator.generate {player_count} players {name}", seconds, "pass"
+
+
+@case
+def map_units():
+	'''A 128x128 map with 2000 units, one of them a city with a ring of units around it.'''
+	rules, grass, mountain, citizen, food = make_rules()
+	map = Map(util.IdList(Player), 128, 128)
+	for cell in map.cells:
+		cell.terrain_type = grass
+	player = map.players.create("player", None)
+	city = map.spawn_unit((64, 64), citizen, player)
+	for dx in (-1, 0, 1):
+		for dy in (-1, 0, 1):
+			if dx or dy:
+				map.spawn_unit((64 + dx, 64 + dy), citizen, player)
+	rng = random.Random(1)
+	while len(map.units) < 2000:
+		xy = (rng.randrange(128), rng.randrange(128))
+		if map[xy].unit is None and (abs(xy[0] - 64) > 2 or abs(xy[1] - 64) > 2):
+			map.spawn_unit(xy, citizen, player)
+	walker = map.spawn_unit((10, 64), citizen, player)
+	map[11, 64].unit = None
+	map.events = curio.Queue()  # drop what spawning queued, moving and creating queue events as in a game
+
+	yield "Map.get_location", measure(lambda: map.get_location(walker)), "call"
+
+	async def move():
+		await map.move_unit(walker, (11, 64))
+		await map.move_unit(walker, (10, 64))
+	yield "Map.move_unit", measure_async(move) / 2, "call"
+
+	async def create():
+		unit = await map.create_unit_near(city, citizen, player)
+		map[map.get_location(unit)].unit = None
+		del map._locations[unit]
+		map.units.destroy(unit)
+	yield "Map.create_unit_near, ring of 8 taken", measure_async(create), "call"
+
+
+@case
+def id_list():
+	items = util.IdList(Player)
+	for i in range(10000):
+		items.create(f"player{i}", None)
+	item = items.get(5000)
+
+	def create_destroy():
+		items.destroy(items.create("new", None))
+	yield "IdList.create + destroy", measure(create_destroy), "op"
+	yield "IdList.get", measure(lambda: items.get(5000)), "op"
+	yield "IdList.resolve item", measure(lambda: items.resolve(item)), "op"
+	yield "IdList iterate 10000 items", measure(lambda: sum(1 for i in items)), "loop"
+
+
+async def take_give(waiter_count, rounds=2000, repeat=5):
+	'''Seconds per Player.take + Player.give with waiter_count tasks waiting
+	for more resources than there are, including waking them up.'''
+	rules, grass, mountain, citizen, food = make_rules()
+	player = Player(1, "player", None)
+	player.resources[food] = Value(100)
+	waiters = [await curio.spawn(player.wait_resources({food: 1000})) for i in range(waiter_count)]
+	await curio.sleep(0)
+	best = None
+	for r in range(repeat):
+		start = time.perf_counter()
+		for i in range(rounds):
+			await player.take({food: 1})
+			await player.give({food: 1})
+			await curio.sleep(0)  # let the waiters see that it's still not enough
+		elapsed = (time.perf_counter() - start) / rounds
+		best = elapsed if best is None else min(best, elapsed)
+	for waiter in waiters:
+		await waiter.cancel()
+	return best
+
+
+@case
+def player_resources():
+	for waiter_count in (0, 10, 100):
+		yield f"Player.take + give, {waiter_count} waiters", curio.run(take_give(waiter_count)), "round"
+
+
+@case
+def encoding():
+	'''Encoding ServerToClient envelopes, with fresh packets as each is only encoded once per broadcast.'''
+	for message in sample_events():
+		name = message.DESCRIPTOR.name
+		yield f"protobuf {name}", measure(lambda: events_envelope.packet(message).protobuf()), "packet"
+		yield f"JSON {name}", measure(lambda: events_envelope.packet(message).json()), "packet"
+	messages = sample_events()[:3] * 22  # a batch of small events, about the TCP client's max_batch
+	yield "protobuf batch of 66", measure(lambda: events_envelope.batch([events_envelope.packet(m) for m in messages]).protobuf()), "batch"
+	yield "JSON batch of 66", measure(lambda: events_envelope.batch([events_envelope.packet(m) for m in messages]).json()), "batch"
+
+
+class ProtocolNop(Protocol):
+	@Protocol.handler(commands.CmdJoin)
+	async def on_command_join(self, server, client, message):
+		pass
+
+
+@case
+def metrics():
+	'''The cost of handling a command with a handler that does nothing, directly and through Server.handle without and with metrics.'''
+	server = Server(ProtocolNop())
+	message = commands.CmdJoin(name="player")
+	yield "Protocol.handle", measure_async(lambda: server.protocol.handle(server, None, message)), "call"
+	yield "Server.handle, no metrics", measure_async(lambda: server.handle(None, message)), "call"
+	server.metrics = Metrics()
+	yield "Server.handle, metrics", measure_async(lambda: server.handle(None, message)), "call"
+
+	def traced():
+		with trace.span('execute', "citizen_move_towards"):
+			pass
+	yield "trace.span, not tracing", measure(traced), "span"
+	trace.enable()
+	yield "trace.span, tracing", measure(traced), "span"
+	trace.spans = None
@@ -0,0 +1,61 @@
+'''Syscalls per message and throughput of TcpClient under a burst of unit moves.
+
+Every configuration sends the same burst of EventUnitMove packets over a
+socket pair while the other end reads as fast as it can. max_batch=1
+writes every packet on its own, as the server used to do.'''
+import time
+
+import curio
+import curio.io
+
+from reset.proto import events_pb2 as events, events_envelope
+from reset.server.outbox import Outbox, RESYNC
+from reset.server.tcp_server import TcpClient
+
+from . import CountingSocket
+
+
+def unit_move(i):
+	message = events.EventUnitMove(unit_id=i % 200)
+	message.position.x, message.position.y = i % 97, i % 89
+	return message
+
+
+async def burst(count, max_batch, max_latency):
+	a, b = CountingSocket.pair()
+	client = TcpClient(curio.io.Socket(a), ('burst', 0), max_batch, max_latency, Outbox(count, RESYNC), batch=False)  # large enough to never drop, and no coalescing
+	reader = curio.io.Socket(b)
+	packets = [events_envelope.packet(unit_move(i)) for i in range(count)]
+	total = sum(len(packet.frame()) for packet in packets)
+
+	async def read():
+		got = 0
+		while got < total:
+			got += len(await reader.recv(1 << 16))
+
+	CountingSocket.sends = 0
+	start = time.perf_counter()
+	sender = await curio.spawn(client._run_send())
+	receiver = await curio.spawn(read())
+	for i, packet in enumerate(packets):
+		await client.send(packet)
+		if i % 100 == 0:
+			await curio.sleep(0)  # the game produces events in small bursts
+	await receiver.join()
+	elapsed = time.perf_counter() - start
+	await sender.cancel()
+	await reader.close()
+	await client.sock.close()
+	return elapsed, CountingSocket.sends, client.sends
+
+
+def main():
+	count = 20000
+	for max_batch, max_latency in ((1, 0.0), (16, 0.0), (64, 0.0), (256, 0.0), (64, 0.002)):
+		elapsed, syscalls, writes = curio.run(burst, count, max_batch, max_latency)
+		print(f"max_batch={max_batch:<4} max_latency={max_latency:<6} {syscalls / count:6.3f} send syscalls/msg "
+			f"{writes / count:6.3f} writes/msg {count / elapsed:10.0f} msg/s")
+
+
+if __name__ == '__main__':
+	main()
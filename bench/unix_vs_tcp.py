@@ -0,0 +1,99 @@
+'''Latency and throughput of the stream transport over loopback TCP and a Unix domain socket.
+
+Runs a real Server with tcp_server and unix_server and a protocol that
+answers every CmdMapRequest with an EventUnitMove, and a CmdGameStart
+with a burst of events.
+
+- latency: one command and its answer at a time, round trip times.
+- throughput: how fast a burst of events arrives at the client.'''
+import os
+import statistics
+import tempfile
+import time
+
+import curio
+
+from reset.proto import commands_pb2 as commands, events_pb2 as events, Protocol, FrameReader, commands_envelope, events_envelope
+from reset.server import Server
+from reset.server.outbox import RESYNC
+from reset.server.tcp_server import tcp_server, unix_server
+
+PORT = 13380
+BURST = 100000
+
+
+def unit_move(i):
+	message = events.EventUnitMove(unit_id=i % 200 + 1)
+	message.position.x, message.position.y = i % 97, i % 89
+	return message
+
+
+class EchoProtocol(Protocol):
+	@Protocol.handler(commands.CmdMapRequest)
+	async def on_map_request(self, server, client, message):
+		await client.send(unit_move(message.x))
+
+	@Protocol.handler(commands.CmdGameStart)
+	async def on_game_start(self, server, client, message):
+		for i in range(BURST):
+			await client.send(unit_move(i))
+			if i % 1000 == 0:
+				await curio.sleep(0)
+
+
+def count_events(frames):
+	count = 0
+	for frame in frames:
+		wrapper = events.ServerToClient()
+		wrapper.ParseFromString(frame)
+		count += len(events_envelope.unwrap_all(wrapper))
+	return count
+
+
+async def latency(sock, count=5000):
+	reader = FrameReader(sock)
+	times = []
+	for i in range(count):
+		start = time.perf_counter()
+		await sock.sendall(commands_envelope.packet(commands.CmdMapRequest(x=i, y=0, width=1, height=1)).frame())
+		assert count_events(await reader.frames()) == 1
+		times.append(time.perf_counter() - start)
+	times.sort()
+	return statistics.mean(times), times[len(times) // 2], times[len(times) * 99 // 100]
+
+
+async def throughput(sock):
+	reader = FrameReader(sock)
+	start = time.perf_counter()
+	await sock.sendall(commands_envelope.packet(commands.CmdGameStart()).frame())
+	got = 0
+	while got < BURST:
+		got += count_events(await reader.frames())
+	return BURST / (time.perf_counter() - start)
+
+
+async def run(connect):
+	sock = await connect()
+	lat = await latency(sock)
+	rate = await throughput(sock)
+	await sock.close()
+	return lat, rate
+
+
+async def main():
+	path = os.path.join(tempfile.mkdtemp(), 'reset.sock')
+	for batch in (False, True):
+		server = Server(EchoProtocol(), BURST + 1, RESYNC)  # never drop anything
+		tcp = await curio.spawn(tcp_server(server, '127.0.0.1', PORT, batch=batch))
+		unix = await curio.spawn(unix_server(server, path, batch=batch))
+		await curio.sleep(0.1)
+		for name, connect in (("loopback TCP", lambda: curio.open_connection('127.0.0.1', PORT)), ("Unix socket", lambda: curio.open_unix_connection(path))):
+			(mean, p50, p99), rate = await run(connect)
+			print(f"{name:<12} batch={batch!s:<5} round trip mean {mean * 1e6:6.1f} us  p50 {p50 * 1e6:6.1f} us  p99 {p99 * 1e6:6.1f} us  burst {rate:9.0f} events/s")
+		await tcp.cancel()
+		await unix.cancel()
+		await curio.sleep(0.1)
+
+
+if __name__ == '__main__':
+	curio.run(main)
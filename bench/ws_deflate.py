@@ -0,0 +1,60 @@
+'''Bandwidth saved versus CPU spent by permessage-deflate.
+
+Streams what a spectator gets at the start of a game (one
+EventMapGenerateCell per cell of a 40x40 map, followed by unit moves)
+through a server side WSConnection and reports the bytes on the wire and
+the CPU time per message for several compression settings.'''
+import time
+
+from reset.proto import events_pb2 as events, events_envelope
+from reset.server.ws_server import Deflate, SUBPROTOCOL_JSON, SUBPROTOCOL_PROTOBUF
+
+from .ws_formats import ws_server_connection
+
+
+def stream():
+	for y in range(40):
+		for x in range(40):
+			cell = events.EventMapGenerateCell(terrain_type_id=1 + (x * 7 + y * 3) % 5 // 2)
+			cell.position.x, cell.position.y = x, y
+			yield cell
+	for i in range(2000):
+		move = events.EventUnitMove(unit_id=100 + i % 30)
+		move.position.x, move.position.y = (i * 3) % 40, (i * 5) % 40
+		yield move
+
+
+def run(subprotocol, deflate):
+	ws, client = ws_server_connection(subprotocol, [deflate] if deflate is not None else None)
+	payloads = []
+	for message in stream():
+		packet = events_envelope.packet(message)
+		payloads.append(packet.protobuf() if subprotocol == SUBPROTOCOL_PROTOBUF else packet.json())
+	wire = 0
+	start = time.process_time()
+	for payload in payloads:
+		ws.send_data(payload)
+		wire += len(ws.bytes_to_send())
+	return wire, (time.process_time() - start) / len(payloads), len(payloads)
+
+
+def main():
+	settings = [
+		("uncompressed", None),
+		("level 1", dict(level=1)),
+		("level 6", dict(level=6)),
+		("level 9", dict(level=9)),
+		("level 6, threshold 0", dict(level=6, threshold=0)),
+		("level 6, threshold 256", dict(level=6, threshold=256)),
+		("level 6, no context takeover", dict(level=6, context_takeover=False)),
+	]
+	for subprotocol in (SUBPROTOCOL_JSON, SUBPROTOCOL_PROTOBUF):
+		baseline = None
+		for name, options in settings:
+			wire, seconds, count = run(subprotocol, Deflate(**options) if options is not None else None)
+			baseline = baseline or wire
+			print(f"{subprotocol:<15} {name:<30} {wire / count:7.1f} bytes/msg ({100 * wire / baseline:5.1f}%) {seconds * 1e6:6.2f} us CPU/msg")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,62 @@
+'''Cost of the WebSocket wire formats: JSON text frames vs. binary protobuf frames.
+
+For a few typical events, reports the time to encode the envelope, the time
+to frame it with wsproto, and the bytes that end up on the wire.'''
+from wsproto.connection import ConnectionType, WSConnection
+from wsproto.events import ConnectionRequested
+
+from reset.proto import events_pb2 as events, types_pb2 as types, events_envelope, Packet
+from reset.server.ws_server import SUBPROTOCOL_JSON, SUBPROTOCOL_PROTOBUF
+
+from . import measure
+
+
+def ws_server_connection(subprotocol, extensions=None):
+	'''A server side WSConnection that went through the opening handshake with an in-memory client.'''
+	client = WSConnection(ConnectionType.CLIENT, host='localhost', resource='/', subprotocols=[subprotocol], extensions=extensions)
+	server = WSConnection(ConnectionType.SERVER, extensions=extensions)
+	server.receive_bytes(client.bytes_to_send())
+	for event in server.events():
+		if isinstance(event, ConnectionRequested):
+			server.accept(event, subprotocol)
+	client.receive_bytes(server.bytes_to_send())
+	list(client.events())
+	return server, client
+
+
+def sample_events():
+	move = events.EventUnitMove(unit_id=1234)
+	move.position.x, move.position.y = 17, 42
+	cell = events.EventMapGenerateCell(terrain_type_id=2)
+	cell.position.x, cell.position.y = 101, 7
+	create = events.EventUnitCreate(unit_id=1234, player_id=3, unit_type_id=4)
+	create.position.x, create.position.y = 17, 42
+	action_type = events.InfoActionType(action_type_id=2)
+	action_type.action_type.name = "citizen_farm_wood"
+	action_type.action_type.description = "Cut down trees"
+	action_type.action_type.unit_type_id = 4
+	action_type.action_type.duration = 2.0
+	action_type.action_type.default_mode = types.ONCE
+	action_type.action_type.target_type = types.UNIT
+	action_type.action_type.target_tags.append("resource_wood")
+	return [move, cell, create, action_type]
+
+
+def main():
+	for message in sample_events():
+		name = message.DESCRIPTOR.name
+		for subprotocol, encode in ((SUBPROTOCOL_JSON, Packet.json), (SUBPROTOCOL_PROTOBUF, Packet.protobuf)):
+			ws, _ = ws_server_connection(subprotocol)
+			encode_time = measure(lambda: encode(Packet(events_envelope, message)))
+			payload = encode(Packet(events_envelope, message))
+
+			def send():
+				ws.send_data(payload)
+				return ws.bytes_to_send()
+			frame_time = measure(send)
+			wire = len(send())
+			print(f"{name:<22} {subprotocol:<15} encode {encode_time * 1e6:7.2f} us  frame {frame_time * 1e6:6.2f} us  {wire:5d} bytes on the wire")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,179 @@
+'''Headless players for trying out and load testing a server.
+
+A Bot is a reset.client.Client without a terminal that is controlled from
+Python, e.g.
+
+	bot = Bot("Alice", "localhost", 1337)
+	await curio.spawn(bot.run())
+	await bot.join()
+	await bot.start()
+	await bot.wait_started()
+	await play_farm(bot)
+
+See __main__ for a load generator that runs many of them.'''
+import collections
+import logging
+import random
+import time
+
+import curio
+
+from ..client import Client, ProtocolUser, Rules
+from ..proto import commands_pb2 as commands, events_pb2 as events, types_pb2 as types
+
+
+class ProtocolBot(ProtocolUser):
+	'''Passes every message on to the bot after handling it, and doesn't exit the program when the connection is lost.'''
+	async def handle(self, server, client, message):
+		await super(ProtocolBot, self).handle(server, client, message)
+		await client.on_message(message)
+
+	async def on_disconnect(self, server, client):
+		self.logger.warning("Lost connection to the server")
+		client.disconnected = True
+
+	async def on_error(self, server, client, message):
+		self.logger.debug(f"Server: {message.error}")  # the bot counts them, see Bot.errors
+
+
+class Bot(Client):
+	def __init__(self, name, host, port=1337, logger=None):
+		logger = logger or logging.getLogger(f"bot.{name}")
+		super(Bot, self).__init__(logger, host, port, Rules(), ProtocolBot(logger))
+		self.name = name
+		self.disconnected = False
+		self.messages_received = 0
+		self.latencies = []  # seconds from queueing an action to the server's answer
+		self.errors = []  # the errors the server sent, to any command
+		self.unanswered = 0  # actions whose answer didn't come, see queue_action
+		self.answer_timeout = 10  # seconds queue_action waits for the answer
+		self._pending = collections.deque()  # [time sent, curio.Event, answer] of actions waiting for an answer
+		self._waiters = []  # [message types, predicate, curio.Event, message] of wait_for calls
+		self._joined = curio.Event()
+		self._started = curio.Event()
+
+	async def on_message(self, message):
+		self.messages_received += 1
+		if isinstance(message, events.EventReconnectToken):
+			await self._joined.set()
+		if isinstance(message, (events.EventGameStart, events.EventSnapshot)):
+			await self._started.set()
+		if isinstance(message, events.Error):
+			self.errors.append(message.error)
+		if isinstance(message, events.EventSnapshot) and self._pending:
+			# The server resynced us, the answers that were queued for us are gone.
+			self.unanswered += len(self._pending)
+			while self._pending:
+				await self._pending.popleft()[1].set()
+		# The server answers every CmdActionQueue with an EventActionQueued or an Error, in
+		# order. Errors name the command they answer, those to other commands are no answer.
+		answer = isinstance(message, events.EventActionQueued) or (isinstance(message, events.Error) and message.command == "CmdActionQueue")
+		if answer and self._pending:
+			pending = self._pending.popleft()
+			self.latencies.append(time.monotonic() - pending[0])
+			pending[2] = message
+			await pending[1].set()
+		for waiter in self._waiters:
+			if waiter[3] is None and isinstance(message, waiter[0]) and waiter[1](message):
+				waiter[3] = message
+				await waiter[2].set()
+
+	async def wait_for(self, message_types, predicate=lambda message: True):
+		'''Wait for the next message of one of the types that predicate accepts, and return it.'''
+		waiter = [message_types, predicate, curio.Event(), None]
+		self._waiters.append(waiter)
+		try:
+			await waiter[2].wait()
+		finally:
+			self._waiters.remove(waiter)
+		return waiter[3]
+
+	def action_type_id(self, name):
+		for action_type_id, action_type in self.rules.action_types.items():
+			if action_type.name == name:
+				return action_type_id
+		raise LookupError(f"The server has no action type {name!r}")
+
+	async def join(self):
+		'''Join the game and wait until the server accepted us.'''
+		await self.send(commands.CmdJoin(name=self.name))
+		await self._joined.wait()
+
+	async def start(self):
+		await self.send(commands.CmdGameStart())
+
+	async def wait_started(self):
+		await self._started.wait()
+
+	async def queue_action(self, action_type, unit, mode=types.ONCE, target_unit=None, target_cell=None):
+		'''Queue an action of the action type with that name. Return its id, or
+		None if the server refused it or its answer didn't come (it was dropped
+		with a resync, or took longer than answer_timeout).'''
+		cmd = commands.CmdActionQueue(action_type_id=self.action_type_id(action_type), unit_id=unit.id, mode=mode)
+		if target_unit is not None:
+			cmd.target_unit_id = target_unit.id
+		if target_cell is not None:
+			cmd.target_cell.x, cmd.target_cell.y = target_cell
+		pending = [time.monotonic(), curio.Event(), None]
+		self._pending.append(pending)
+		await self.send(cmd)
+		try:
+			await curio.timeout_after(self.answer_timeout, pending[1].wait())
+		except curio.TaskTimeout:
+			if pending in self._pending:
+				self._pending.remove(pending)
+				self.unanswered += 1
+			return None
+		if pending[2] is None or isinstance(pending[2], events.Error):
+			return None
+		return pending[2].action_id
+
+	def my_units(self, unit_type):
+		return [unit for unit in self.state.units_of() if unit.unit_type.name == unit_type]
+
+	def walkable_near(self, xy, radius, tries=10):
+		'''A random free cell we may walk on at most radius cells away from xy, or None.'''
+		map = self.state.map
+		for i in range(tries):
+			x, y = xy[0] + random.randint(-radius, radius), xy[1] + random.randint(-radius, radius)
+			if 0 <= x < map.width and 0 <= y < map.height:
+				cell = map[x, y]
+				if cell.unit is None and cell.terrain_type is not None and "walk" in cell.terrain_type.tags:
+					return (x, y)
+		return None
+
+	def nearest(self, xy, unit_type, max_radius=64):
+		'''The closest unit of the type with that name, or None.'''
+		radius = 4
+		while radius <= max_radius:
+			units = [unit for unit in self.state.units_near(xy, radius) if unit.unit_type.name == unit_type]
+			if units:
+				return min(units, key=lambda unit: abs(unit.position[0] - xy[0]) + abs(unit.position[1] - xy[1]))
+			radius *= 2
+		return None
+
+
+async def play_farm(bot, citizens=3, move_interval=1.0):
+	'''Build citizens in our city, send the first one to cut down the closest
+	forest over and over, and the others on short walks, a new one every
+	move_interval seconds as long as one of them is idle. Runs until
+	cancelled or disconnected.'''
+	while not bot.my_units("city"):  # units are created after the game started
+		await bot.wait_for(events.EventUnitCreate)
+	city = bot.my_units("city")[0]
+	for i in range(citizens):
+		await bot.queue_action("city_create_citizen", city)
+	while not bot.my_units("citizen"):
+		await bot.wait_for(events.EventUnitCreate)
+	farmer = bot.my_units("citizen")[0]
+	forest = bot.nearest(farmer.position, "forest")
+	if forest is not None:
+		await bot.queue_action("citizen_farm_wood", farmer, types.REPEAT, target_unit=forest)
+	while not bot.disconnected:
+		await curio.sleep(move_interval)
+		walkers = [unit for unit in bot.state.idle_units("citizen") if unit is not farmer]
+		if walkers:
+			walker = random.choice(walkers)
+			target = bot.walkable_near(walker.position, 5)
+			if target is not None:
+				await bot.queue_action("citizen_move_towards", walker, target_cell=target)
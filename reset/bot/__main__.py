@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+'''Load generator: many bots join a server, start the game and play
+play_farm for a while, then the latencies and throughput are reported.
+
+	python -m reset.bot --bots 100 --ws-share 0.5 --duration 30'''
+
+import argparse
+import logging
+import time
+
+import curio
+
+from . import Bot, play_farm
+
+
+def percentile(values, p):
+	if not values:
+		return float('nan')
+	values = sorted(values)
+	return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def report(transport, bots, seconds):
+	latencies = [latency for bot in bots for latency in bot.latencies]
+	errors = {}
+	for bot in bots:
+		for error in bot.errors:
+			errors[error] = errors.get(error, 0) + 1
+	messages = sum(bot.messages_received for bot in bots)
+	disconnected = sum(bot.disconnected for bot in bots)
+	unanswered = sum(bot.unanswered for bot in bots)
+	print(f"{transport}: {len(bots)} bots, {disconnected} disconnected, {messages / seconds:.0f} messages/s received")
+	print(f"  {len(latencies)} actions queued, latency ms p50 {percentile(latencies, 50) * 1e3:.1f}"
+		f" p90 {percentile(latencies, 90) * 1e3:.1f} p99 {percentile(latencies, 99) * 1e3:.1f}"
+		f" max {max(latencies, default=float('nan')) * 1e3:.1f}, {unanswered} unanswered")
+	for error, count in sorted(errors.items(), key=lambda item: -item[1]):
+		print(f"  {count} x {error}")
+
+
+async def main():
+	ap = argparse.ArgumentParser()
+	ap.add_argument("--host", default="localhost", help="the server's host name for the TCP bots, or unix:PATH")
+	ap.add_argument("--port", type=int, default=1337)
+	ap.add_argument("--ws-url", default="ws://localhost:8080/", help="the server's WebSocket URL for the WebSocket bots")
+	ap.add_argument("--bots", type=int, default=10)
+	ap.add_argument("--ws-share", type=float, default=0.0, help="fraction of the bots that connect by WebSocket")
+	ap.add_argument("--duration", type=float, default=30, help="seconds to play after the game started")
+	ap.add_argument("--citizens", type=int, default=3, help="citizens each bot builds")
+	ap.add_argument("--move-interval", type=float, default=1.0, help="seconds between the walks each bot orders")
+	args = ap.parse_args()
+
+	logging.basicConfig(level=logging.WARNING)
+
+	ws_bots = round(args.bots * args.ws_share)
+	bots = [Bot(f"bot{i}", args.ws_url, args.port) if i < ws_bots else Bot(f"bot{i}", args.host, args.port)
+		for i in range(args.bots)]
+	async with curio.TaskGroup() as tasks:
+		for bot in bots:
+			await tasks.spawn(bot.run())
+		start = time.monotonic()
+		for bot in bots:
+			await bot.join()
+		print(f"{len(bots)} bots joined in {time.monotonic() - start:.1f} s")
+		await bots[0].start()
+		for bot in bots:
+			await bot.wait_started()
+		for bot in bots:  # only count what happens while playing
+			bot.messages_received = 0
+
+		start = time.monotonic()
+		async with curio.TaskGroup() as players:
+			for bot in bots:
+				await players.spawn(play_farm(bot, args.citizens, args.move_interval))
+			await curio.ignore_after(args.duration, players.join())
+			await players.cancel_remaining()
+		seconds = time.monotonic() - start
+		await tasks.cancel_remaining()
+
+	report("TCP", bots[ws_bots:], seconds)
+	if ws_bots:
+		report("WebSocket", bots[:ws_bots], seconds)
+
+
+if __name__ == '__main__':
+	curio.run(main())
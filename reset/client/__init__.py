@@ -1,14 +1,15 @@
+import argparse
+import hashlib
 import logging
+import os
 
 import curio
-import curio.traps
-from curio import socket
 import google.protobuf.json_format
-import termbox
 
-from ..proto import commands_pb2 as commands, events_pb2 as events, Protocol, recv_len
+from ..proto import commands_pb2 as commands, events_pb2 as events, Protocol, events_envelope
 from .. import util
-from .ui import Ui, TermboxAsync
+from . import connection
+from .state import GameState, Map, Unit, Action, Player
 
 
 class Rules:
@@ -19,55 +20,65 @@ class Rules:
 		self.action_types = {}
 
 
-class Cell:
-	def __init__(self, terrain_type, unit=None):
-		self.terrain_type = terrain_type
-		self.unit = unit
+class RulesCache:
+	'''Keeps the rules bundles (serialized RulesBundles) the client got, so
+	the server doesn't need to send them again in the next game.'''
+	def __init__(self, directory):
+		self.directory = directory
 
-	def __str__(self):
-		return f"[{self.terrain_type}{self.unit if self.unit is not None else ''}]"
+	def _path(self, name):
+		return os.path.join(self.directory, name)
 
+	def latest(self):
+		'''The hash of the bundle stored last, or None.'''
+		try:
+			with open(self._path('latest')) as f:
+				return bytes.fromhex(f.read().strip())
+		except (OSError, ValueError):
+			return None
 
-class Map:
-	def __init__(self, width, height):
-		self.width = width
-		self.height = height
-		self.cells = [Cell(None) for i in range(width * height)]
-		self.units = {}
-		self.actions = {}
-
-	def __getitem__(self, xy):
-		x, y = xy
-		if not (0 <= x < self.width) or not (0 <= y < self.height):
-			raise LookupError("Coordinates are outside the map")
-		return self.cells[y * self.width + x]
+	def load(self, rules_hash):
+		try:
+			with open(self._path(rules_hash.hex()), 'rb') as f:
+				data = f.read()
+		except OSError:
+			return None
+		return data if hashlib.sha256(data).digest() == rules_hash else None
 
-	def __iter__(self):
-		for i, cell in enumerate(self.cells):
-			if cell is None:
-				continue
-			yield (i % self.width, i // self.width), cell
+	def store(self, rules_hash, data):
+		os.makedirs(self.directory, exist_ok=True)
+		with open(self._path(rules_hash.hex()), 'wb') as f:
+			f.write(data)
+		with open(self._path('latest'), 'w') as f:
+			f.write(rules_hash.hex())
 
 
 class Client:
-	def __init__(self, logger, host, port, rules, protocol):
+	'''The connection to a server and what we know about the game, without
+	a user interface. See reset.client.terminal for the interactive client
+	and reset.bot for scripted ones.'''
+	def __init__(self, logger, host, port, rules, protocol, rules_cache=None):
 		self.logger = logger
 		self.host = host
 		self.port = port
 		self.protocol = protocol
 		self.queue = curio.Queue()
 		self.rules = rules
-		self.tb = None
-		self.map = None
-		self.ui = Ui(self)
+		self.rules_cache = rules_cache
+		self.state = GameState()
+		self.reconnect_token = None  # (player_id, token) from the server, to get back into the game after losing the connection
+		self.reconnect_attempts = 10
 
 	async def command_join(self, args):
 		name = args[0] if args else "Player"
-		await self.send(commands.CmdJoin(name=name))
+		await self.send(commands.CmdJoin(name=name, rules_hash=self.rules_hash))
 
 	async def command_start(self, args):
 		await self.send(commands.CmdGameStart())
 
+	async def command_spectate(self, args):
+		await self.send(commands.CmdSpectate(rules_hash=self.rules_hash))
+
 	async def command_action(self, args):
 		ap = argparse.ArgumentParser()
 		ap.add_argument("action_type", type=int)
@@ -84,6 +95,31 @@ class Client:
 			cmd.target_cell.y = args.y
 		await self.send(cmd)
 
+	@property
+	def map(self):
+		return self.state.map
+
+	@property
+	def rules_hash(self):
+		return self.rules_cache.latest() if self.rules_cache is not None else None
+
+	async def command_actions(self, args):
+		'''Like action, for many units at once.'''
+		ap = argparse.ArgumentParser()
+		ap.add_argument("action_type", type=int)
+		ap.add_argument("units", type=int, nargs='+')
+		ap.add_argument("--target", "-t", type=int, default=None)
+		ap.add_argument("-x", type=int, default=None)
+		ap.add_argument("-y", type=int, default=None)
+		args = ap.parse_args(args)
+		cmd = commands.CmdActionQueueMany(action_type_id=args.action_type, unit_ids=args.units)
+		if args.target is not None:
+			cmd.target_unit_id = args.target
+		if args.x is not None and args.y is not None:
+			cmd.target_cell.x = args.x
+			cmd.target_cell.y = args.y
+		await self.send(cmd)
+
 	async def run_command(self, command, args):
 		handler = getattr(self, 'command_'+command, None)
 		if handler is not None:
@@ -92,66 +128,59 @@ class Client:
 			self.logger.warning(f"No such command {command!r}");
 
 	async def _run_net(self):
-		sock = await curio.open_connection(self.host, self.port)
-		try:
-			async with util.ScopeTask(self.queue_handler(sock)):
-				while True:
-					packet_length = int.from_bytes(await recv_len(sock, 4), 'big')
-					packet = await recv_len(sock, packet_length)
-					#print(">", packet)
-					try:
-						message = events.ServerToClient()
-						message.ParseFromString(packet)
-						payload = getattr(message, message.WhichOneof("payload"))
-						await self.protocol.handle(None, self, payload)
-					except:
-						self.logger.exception("Error handling network packet")
-		except ConnectionResetError:
-			await sock.close()
-			await self.protocol.on_disconnect(None, self)
-
-	async def _run_input(self):
-		async for event in self.tb:
-			etype, ch, key, mod, w, h, xx, yy = event
-			if etype == termbox.EVENT_KEY:
-				if key == termbox.KEY_CTRL_C:
-					raise KeyboardInterrupt()
-				else:
-					try:
-						await self.ui.on_key(self.tb, key, ch, mod)
-					except:
-						self.logger.exception(f"Error handling terminal event {event!r}")
-			elif etype == termbox.EVENT_RESIZE:
-				pass  # we use .width() and .height() anyway
-			else:
-				self.logger.warning(f"Unhandled event {event!r}")
-
-	async def _run_output(self):
+		conn = await connection.connect(self.host, self.port)
 		while True:
-			self.tb.clear()
-			await self.ui.render(self.tb, 0, 0, self.tb.width(), self.tb.height())
-			self.tb.present()
-			await curio.sleep(1/30.0)
+			try:
+				async with util.ScopeTask(self.queue_handler(conn)):
+					while True:
+						for packet in await conn.recv():
+							try:
+								message = events.ServerToClient()
+								message.ParseFromString(packet)
+								payloads = list(events_envelope.unwrap_all(message))
+							except Exception:
+								self.logger.exception("Error decoding network packet")
+								continue
+							for payload in payloads:
+								try:
+									await self.protocol.handle(None, self, payload)
+								except Exception:
+									self.logger.exception(f"Error handling {type(payload).__name__}")
+						self.request_redraw()
+			except ConnectionResetError:
+				await conn.close()
+				conn = await self._reconnect()
+				if conn is None:
+					await self.protocol.on_disconnect(None, self)
+					return
+
+	async def _reconnect(self):
+		'''Connect again and rejoin the game as our player. Returns the new connection, or None if that's not possible.'''
+		if self.reconnect_token is None:
+			return None
+		player_id, token = self.reconnect_token
+		for attempt in range(self.reconnect_attempts):
+			self.logger.warning(f"Lost connection to the server, reconnecting (attempt {attempt + 1})")
+			await curio.sleep(min(2 ** attempt * 0.5, 10))
+			try:
+				conn = await connection.connect(self.host, self.port)
+				await conn.send([commands.CmdReconnect(player_id=player_id, token=token, rules_hash=self.rules_hash)])
+				return conn
+			except OSError:
+				pass
+		return None
+
+	def request_redraw(self):
+		'''Called after the state changed, e.g. to update a user interface.'''
+		pass
 
 	async def run(self):
-		async with TermboxAsync() as tb:
-			self.tb = tb
-			async with curio.TaskGroup() as g:
-				await g.spawn(self._run_net())
-				await g.spawn(self._run_input())
-				await g.spawn(self._run_output())
-
-	async def queue_handler(self, sock):
+		await self._run_net()
+
+	async def queue_handler(self, conn):
 		while True:
-			payload = await self.queue.get()
-			message = commands.ClientToServer()
-			for fd in message.DESCRIPTOR.oneofs_by_name["payload"].fields:
-				if payload.DESCRIPTOR == fd.message_type:
-					getattr(message, fd.name).CopyFrom(payload)
-			packet = message.SerializeToString()
-			#print("<", packet)
-			await sock.sendall(len(packet).to_bytes(4, 'big'))
-			await sock.sendall(packet)
+			payloads = await util.get_batch(self.queue, 64)
+			await conn.send(payloads)
 
 	async def send(self, message):
 		await self.queue.put(message)
@@ -182,30 +211,142 @@ class ProtocolUser(Protocol):
 		client.rules.unit_types[message.unit_type_id] = message.unit_type
 		self.logger.debug(f"UnitType {message.unit_type_id} is {message.unit_type.name}")
 
+	@Protocol.handler(events.InfoRules)
+	async def on_info_rules(self, server, client, message):
+		if message.HasField('bundle'):
+			bundle = message.bundle
+			if client.rules_cache is not None:
+				client.rules_cache.store(message.hash, bundle.SerializeToString(deterministic=True))
+		else:
+			data = client.rules_cache.load(message.hash) if client.rules_cache is not None else None
+			if data is None:
+				self.logger.error("The server thinks we have its rules, but we don't")
+				return
+			bundle = events.RulesBundle()
+			bundle.ParseFromString(data)
+		for info in bundle.terrain_types:
+			await self.on_info_terrain_type(server, client, info)
+		for info in bundle.resource_types:
+			await self.on_info_resource_type(server, client, info)
+		for info in bundle.unit_types:
+			await self.on_info_unit_type(server, client, info)
+		for info in bundle.action_types:
+			await self.on_info_action_type(server, client, info)
+
+	@Protocol.handler(events.EventPlayerJoin)
+	async def on_player_join(self, server, client, message):
+		client.state.players[message.player_id] = Player(message.player_id, message.name)
+		self.logger.info(f"{message.name} joined")
+
+	@Protocol.handler(events.EventPlayerLeave)
+	async def on_player_leave(self, server, client, message):
+		player = client.state.players.pop(message.player_id, None)
+		self.logger.info(f"{player.name if player is not None else message.player_id} left")
+
 	@Protocol.handler(events.EventMapGenerate)
 	async def on_map_generate(self, server, client, message):
-		client.map = Map(message.width, message.height)
+		client.state.reset_map(message.width, message.height)
 		self.logger.debug(f"Map is {message.width}x{message.height}")
 
 	@Protocol.handler(events.EventMapGenerateCell)
 	async def on_map_generate_cell(self, server, client, message):
-		client.map[message.position.x, message.position.y].terrain_type = client.rules.terrain_types[message.terrain_type_id]
-		self.logger.debug(f"Map ({message.position.x}, {message.position.y}) is terrain type {message.terrain_type_id}")
+		client.map.set_terrain((message.position.x, message.position.y), client.rules.terrain_types[message.terrain_type_id])
+		self.logger.debug("Map (%d, %d) is terrain type %d", message.position.x, message.position.y, message.terrain_type_id)  # once per cell, formatted only if it is shown
 
 	@Protocol.handler(events.EventGameStart)
 	async def on_game_start(self, server, client, message):
+		client.state.started = True
 		self.logger.info("The game is starting!")
 
 	@Protocol.handler(events.EventPlayerResource)
 	async def on_player_resource(self, server, client, message):
+		client.state.resources[message.resource_type_id] = message.amount
 		self.logger.debug(f"You have resource {message.resource_type_id} x{message.amount}")
 
+	@Protocol.handler(events.EventReconnectToken)
+	async def on_reconnect_token(self, server, client, message):
+		client.reconnect_token = (message.player_id, message.token)
+		client.state.player_id = message.player_id
+
+	@Protocol.handler(events.EventSnapshot)
+	async def on_snapshot(self, server, client, message):
+		state = client.state
+		state.reset_map(message.width, message.height)
+		state.player_id = message.player_id if message.HasField('player_id') else None
+		state.players = {player.player_id: Player(player.player_id, player.name) for player in message.players}
+		state.resources = {}
+		for chunk in message.chunks:
+			self._apply_chunk(client, chunk)
+		for unit in message.units:
+			await self.on_unit_create(server, client, unit)
+		for action in message.actions:
+			state.add_action(Action(action.action_id, action.unit_id, action.action_type_id, action.state))
+		state.started = True
+		self.logger.info(f"Got a snapshot of the game: {len(message.units)} units, {len(message.actions)} of your actions queued")
+		for resource in message.resources:
+			await self.on_player_resource(server, client, resource)
+
+	@Protocol.handler(events.EventMapRegion)
+	async def on_map_region(self, server, client, message):
+		self._apply_chunk(client, message.chunk)
+		for unit in message.units:
+			await self.on_unit_create(server, client, unit)
+
+	def _apply_chunk(self, client, chunk):
+		for i, terrain_type_id in enumerate(chunk.terrain_type_ids):
+			if terrain_type_id:
+				xy = (chunk.position.x + i % chunk.width, chunk.position.y + i // chunk.width)
+				client.state.map.set_terrain(xy, client.rules.terrain_types[terrain_type_id])
+
 	@Protocol.handler(events.EventUnitCreate)
 	async def on_unit_create(self, server, client, message):
-		self.logger.debug(f"unit {message.unit_id} of type {message.unit_type_id} created for {message.player_id}")
+		client.state.add_unit(Unit(message.unit_id, client.rules.unit_types[message.unit_type_id], message.player_id, (message.position.x, message.position.y)))
+
+	@Protocol.handler(events.EventUnitUpdate)
+	async def on_unit_update(self, server, client, message):
+		unit = client.state.units.get(message.unit_id)
+		if unit is not None:
+			unit.tags = set(message.tags)
+
+	@Protocol.handler(events.EventUnitDestroy)
+	async def on_unit_destroy(self, server, client, message):
+		client.state.remove_unit(message.unit_id)
+
+	@Protocol.handler(events.EventActionQueued)
+	async def on_action_queued(self, server, client, message):
+		client.state.add_action(Action(message.action_id, message.unit_id))
+
+	@Protocol.handler(events.EventActionsQueued)
+	async def on_actions_queued(self, server, client, message):
+		for action_id, unit_id in zip(message.action_ids, message.unit_ids):
+			client.state.add_action(Action(action_id, unit_id))
+		self.logger.debug(f"Queued actions {list(message.action_ids)} for units {list(message.unit_ids)}")
+		if message.rejected_unit_ids:
+			self.logger.warning(f"Units {list(message.rejected_unit_ids)} can't do that: {message.error}")
+
+	@Protocol.handler(events.EventActionUpdate)
+	async def on_action_update(self, server, client, message):
+		action = client.state.actions.get(message.action_id)
+		if action is not None:
+			action.state = message.state
+		if message.HasField('message'):
+			self.logger.info(f"Action {message.action_id}: {message.message}")
+
+	@Protocol.handler(events.EventActionDequeued)
+	async def on_action_dequeued(self, server, client, message):
+		client.state.remove_action(message.action_id)
+
+	@Protocol.handler(events.EventUnitMove)
+	async def on_unit_move(self, server, client, message):
+		client.state.move_unit(message.unit_id, (message.position.x, message.position.y))
+
+	@Protocol.handler(events.Error)
+	async def on_error(self, server, client, message):
+		self.logger.warning(f"Server: {message.error}")
 
 	async def on_unhandled(self, server, client, message):
-		self.logger.debug(f"{message.DESCRIPTOR.name} {google.protobuf.json_format.MessageToJson(message)}")
+		if self.logger.isEnabledFor(logging.DEBUG):  # formatting as JSON is expensive, and the client logs at INFO unless --log-level says otherwise
+			self.logger.debug(f"{message.DESCRIPTOR.name} {google.protobuf.json_format.MessageToJson(message)}")
 
 	async def on_disconnect(self, server, client):
 		self.logger.debug("Lost connection to server.")
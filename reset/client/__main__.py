@@ -2,6 +2,7 @@
 
 import argparse
 import logging
+import os
 #import logging.handlers
 import sys
 import termios
@@ -9,22 +10,27 @@ import traceback
 
 import curio
 
-from . import ProtocolUser, Client, Rules
+from . import ProtocolUser, Rules, RulesCache
+from .terminal import TerminalClient
 from ..proto import commands_pb2 as commands, events_pb2 as events
 from .. import util
+from ..log import BatchFileHandler
 
 async def main():
 	ap = argparse.ArgumentParser()
-	ap.add_argument("host")
-	ap.add_argument("port", type=int)
+	ap.add_argument("host", help="the server's host name, unix:PATH for its Unix domain socket or ws://HOST:PORT/ for its WebSocket port")
+	ap.add_argument("port", type=int, nargs='?', default=1337)
+	ap.add_argument("--rules-cache", default=os.path.expanduser("~/.cache/reset/rules"), help="directory to keep the server's rules in")
+	ap.add_argument("--max-fps", type=float, default=30, help="redraw the screen at most this often per second")
+	ap.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO", help="DEBUG logs every map cell and unhandled message, which slows the client down")
 	args = ap.parse_args()
 
-	logging.getLogger().setLevel(logging.DEBUG)
-	logging.getLogger().addHandler(logging.FileHandler("reset.client.log", mode='w'))
+	logging.getLogger().setLevel(args.log_level)
+	logging.getLogger().addHandler(BatchFileHandler("reset.client.log", mode='w'))
 
 	rules = Rules()
 	protocol = ProtocolUser(logging.getLogger("protocol"))
-	client = Client(logging.getLogger("client"), args.host, args.port, rules, protocol)
+	client = TerminalClient(logging.getLogger("client"), args.host, args.port, rules, protocol, RulesCache(args.rules_cache), args.max_fps)
 
 	flags = termios.tcgetattr(1)
 	try:
@@ -0,0 +1,96 @@
+import urllib.parse
+
+from wsproto.connection import ConnectionType, WSConnection
+from wsproto.events import BytesReceived, ConnectionClosed, ConnectionEstablished, ConnectionFailed
+import curio
+
+from ..proto import FrameReader, commands_envelope
+
+SUBPROTOCOL_PROTOBUF = 'reset.protobuf'  # as in reset.server.ws_server
+
+
+async def connect(host, port):
+	'''Connect to a server. host is a host name for TCP, unix:PATH for a Unix
+	domain socket or a ws:// URL for the server's WebSocket port.'''
+	if host.startswith('unix:'):
+		return StreamConnection(await curio.open_unix_connection(host[len('unix:'):]))
+	if host.startswith('ws://'):
+		return await WebsocketConnection.connect(host)
+	return StreamConnection(await curio.open_connection(host, port))
+
+
+class StreamConnection:
+	'''Length-prefixed envelopes over a TCP or Unix domain socket.'''
+	def __init__(self, sock):
+		self.sock = sock
+		self._reader = FrameReader(sock, 1 << 26)  # the server may send big messages
+
+	async def recv(self):
+		'''Wait for packets from the server and return them, serialized ServerToClient envelopes.'''
+		return await self._reader.frames()
+
+	async def send(self, messages):
+		await self.sock.sendall(b''.join(commands_envelope.packet(message).frame() for message in messages))
+
+	async def close(self):
+		await self.sock.close()
+
+
+class WebsocketConnection:
+	'''Binary WebSocket messages of the reset.protobuf subprotocol, one envelope each.'''
+	def __init__(self, sock, ws):
+		self.sock = sock
+		self.ws = ws
+		self._lock = curio.Lock()  # recv writes too, e.g. to answer pings
+		self._message = []  # fragments of a message that is still being received
+		self._packets = []  # packets that came with the handshake
+		self._established = False
+
+	@classmethod
+	async def connect(cls, url):
+		parts = urllib.parse.urlsplit(url)
+		sock = await curio.open_connection(parts.hostname, parts.port or 80)
+		self = cls(sock, WSConnection(ConnectionType.CLIENT, host=parts.netloc, resource=parts.path or '/', subprotocols=[SUBPROTOCOL_PROTOBUF]))
+		await self._write()
+		while not self._established:
+			self._packets.extend(await self._read())
+		return self
+
+	async def _write(self):
+		async with self._lock:
+			data = self.ws.bytes_to_send()
+			if data:
+				await self.sock.sendall(data)
+
+	async def _read(self):
+		data = await self.sock.recv(1 << 16)
+		if not data:
+			raise ConnectionResetError("Server disconnected")
+		self.ws.receive_bytes(data)
+		packets = []
+		for event in self.ws.events():
+			if isinstance(event, ConnectionEstablished):
+				self._established = True
+			elif isinstance(event, BytesReceived):
+				self._message.append(event.data)
+				if event.message_finished:
+					packets.append(b''.join(self._message))
+					self._message = []
+			elif isinstance(event, (ConnectionClosed, ConnectionFailed)):
+				raise ConnectionResetError(f"WebSocket closed: {event!r}")
+		await self._write()  # pongs and the like
+		return packets
+
+	async def recv(self):
+		packets, self._packets = self._packets, []
+		while not packets:
+			packets = await self._read()
+		return packets
+
+	async def send(self, messages):
+		for message in messages:
+			self.ws.send_data(commands_envelope.packet(message).protobuf())
+		await self._write()
+
+	async def close(self):
+		await self.sock.close()
@@ -0,0 +1,227 @@
+class Cell:
+	def __init__(self, terrain_type, unit=None):
+		self.terrain_type = terrain_type
+		self.unit = unit
+
+	def __str__(self):
+		return f"[{self.terrain_type}{self.unit if self.unit is not None else ''}]"
+
+
+class Unit:
+	def __init__(self, id, unit_type, player_id, position):
+		self.id = id
+		self.unit_type = unit_type
+		self.player_id = player_id
+		self.position = position
+		self.tags = set()
+
+	def __str__(self):
+		return self.unit_type.name
+
+
+class Action:
+	def __init__(self, id, unit_id, action_type_id=None, state=0):
+		self.id = id
+		self.unit_id = unit_id
+		self.action_type_id = action_type_id  # None if the server didn't say, as for EventActionQueued
+		self.state = state  # an events.ActionState value
+
+
+class Player:
+	def __init__(self, id, name):
+		self.id = id
+		self.name = name
+
+
+class Map:
+	'''The cells of the map, which also serve as the index of the units by position.
+
+	Cells are kept in chunks of CHUNK_SIZE x CHUNK_SIZE, which are created
+	when the server first tells us about one of their cells. A huge map that
+	is explored bit by bit only takes memory for the explored part.'''
+	CHUNK_SIZE = 32
+	UNKNOWN = Cell(None)  # all cells of chunks we know nothing about, don't modify
+
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+		self._chunks = {}  # (cx, cy) -> [Cell], row by row
+		self.dirty = set()  # cells changed since the screen last drew them
+
+	def __getitem__(self, xy):
+		x, y = xy
+		if not (0 <= x < self.width) or not (0 <= y < self.height):
+			raise LookupError("Coordinates are outside the map")
+		size = self.CHUNK_SIZE
+		chunk = self._chunks.get((x // size, y // size))
+		if chunk is None:
+			return self.UNKNOWN
+		return chunk[y % size * size + x % size]
+
+	def row(self, x, y, width):
+		'''Return the cells x to x + width - 1 of row y.'''
+		size = self.CHUNK_SIZE
+		cells = []
+		offset = y % size * size
+		while width > 0:
+			count = min(size - x % size, width)
+			chunk = self._chunks.get((x // size, y // size))
+			if chunk is None:
+				cells.extend([self.UNKNOWN] * count)
+			else:
+				start = offset + x % size
+				cells.extend(chunk[start:start + count])
+			x += count
+			width -= count
+		return cells
+
+	def _cell(self, xy):
+		'''Like map[xy], but creates the cell's chunk if needed.'''
+		cell = self[xy]
+		if cell is self.UNKNOWN:
+			size = self.CHUNK_SIZE
+			chunk = self._chunks[xy[0] // size, xy[1] // size] = [Cell(None) for i in range(size * size)]
+			cell = chunk[xy[1] % size * size + xy[0] % size]
+		return cell
+
+	def __iter__(self):
+		'''Yield the known cells with their coordinates.'''
+		size = self.CHUNK_SIZE
+		for (cx, cy), chunk in self._chunks.items():
+			for i, cell in enumerate(chunk):
+				x, y = cx * size + i % size, cy * size + i // size
+				if x < self.width and y < self.height:
+					yield (x, y), cell
+
+	def chunk_known(self, key):
+		'''Whether we know the terrain of every cell of the chunk (cx, cy).'''
+		chunk = self._chunks.get(key)
+		if chunk is None:
+			return False
+		size = self.CHUNK_SIZE
+		width, height = min(size, self.width - key[0] * size), min(size, self.height - key[1] * size)
+		return all(chunk[y * size + x].terrain_type is not None for y in range(height) for x in range(width))
+
+	def set_terrain(self, xy, terrain_type):
+		self._cell(xy).terrain_type = terrain_type
+		self.dirty.add(xy)
+
+	def add_unit(self, unit):
+		self._cell(unit.position).unit = unit
+		self.dirty.add(unit.position)
+
+	def remove_unit(self, unit):
+		cell = self[unit.position]
+		if cell.unit is unit:
+			cell.unit = None
+		self.dirty.add(unit.position)
+
+	def move_unit(self, unit, position):
+		self.remove_unit(unit)
+		unit.position = position
+		self.add_unit(unit)
+
+	def take_dirty(self):
+		'''Return the cells changed since the last call.'''
+		dirty, self.dirty = self.dirty, set()
+		return dirty
+
+
+class GameState:
+	'''Everything the client knows about the game, kept up to date from the
+	server's events by ProtocolUser.
+
+	Units are indexed by id, by player and by position (the map cells), and
+	actions by id and by unit, so questions like "my idle citizens" or "units
+	near (x, y)" don't need to look at every unit.
+
+	Of a huge world map, the client only knows the units in the parts the
+	server sent it, but gets the moves and updates of all units. Those of
+	units it doesn't know are ignored.'''
+	def __init__(self):
+		self.player_id = None  # our player, None while spectating or before joining
+		self.started = False  # whether the game is running, i.e. the map is complete apart from unexplored parts
+		self.players = {}
+		self.resources = {}  # resource type id -> amount, of our player
+		self.map = None
+		self.units = {}
+		self.actions = {}
+		self._player_units = {}  # player id -> {unit id: unit}
+		self._unit_actions = {}  # unit id -> {action id: action}
+
+	def reset_map(self, width, height):
+		'''Start over with an empty map, forgetting all units and actions.'''
+		self.map = Map(width, height)
+		self.started = False
+		self.units.clear()
+		self.actions.clear()
+		self._player_units.clear()
+		self._unit_actions.clear()
+
+	def add_unit(self, unit):
+		old = self.units.get(unit.id)
+		if old is not None:
+			self.remove_unit(old.id)
+		self.units[unit.id] = unit
+		self._player_units.setdefault(unit.player_id, {})[unit.id] = unit
+		self.map.add_unit(unit)
+
+	def move_unit(self, unit_id, position):
+		unit = self.units.get(unit_id)
+		if unit is not None:
+			self.map.move_unit(unit, position)
+
+	def remove_unit(self, unit_id):
+		unit = self.units.pop(unit_id, None)
+		if unit is None:
+			return
+		del self._player_units[unit.player_id][unit_id]
+		for action_id in list(self._unit_actions.get(unit_id, ())):
+			self.remove_action(action_id)
+		self.map.remove_unit(unit)
+
+	def add_action(self, action):
+		self.actions[action.id] = action
+		self._unit_actions.setdefault(action.unit_id, {})[action.id] = action
+
+	def remove_action(self, action_id):
+		action = self.actions.pop(action_id, None)
+		if action is None:
+			return
+		actions = self._unit_actions[action.unit_id]
+		del actions[action_id]
+		if not actions:
+			del self._unit_actions[action.unit_id]
+
+	def unit_at(self, xy):
+		return self.map[xy].unit
+
+	def units_of(self, player_id=None):
+		'''The units of a player, ours by default.'''
+		if player_id is None:
+			player_id = self.player_id
+		return list(self._player_units.get(player_id, {}).values())
+
+	def actions_of(self, unit_id):
+		'''The queued actions of a unit, in the order they were queued.'''
+		return list(self._unit_actions.get(unit_id, {}).values())
+
+	def idle_units(self, unit_type=None, player_id=None):
+		'''The units of a player (ours by default) without queued actions,
+		optionally only those of the unit type with this name.'''
+		return [unit for unit in self.units_of(player_id)
+			if unit.id not in self._unit_actions and (unit_type is None or unit.unit_type.name == unit_type)]
+
+	def units_near(self, xy, radius):
+		'''The units at most radius cells away from xy in both directions.'''
+		x, y = xy
+		if (2 * radius + 1) ** 2 > len(self.units):  # fewer units than cells to look at
+			return [unit for unit in self.units.values()
+				if abs(unit.position[0] - x) <= radius and abs(unit.position[1] - y) <= radius]
+		units = []
+		for cy in range(max(y - radius, 0), min(y + radius + 1, self.map.height)):
+			for cx in range(max(x - radius, 0), min(x + radius + 1, self.map.width)):
+				unit = self.map[cx, cy].unit
+				if unit is not None:
+					units.append(unit)
+		return units
@@ -0,0 +1,56 @@
+import time
+
+import curio
+import termbox
+
+from . import Client
+from .ui import Ui, TermboxAsync
+
+
+class TerminalClient(Client):
+	'''The interactive client, in a terminal using termbox.'''
+	def __init__(self, logger, host, port, rules, protocol, rules_cache=None, max_fps=30):
+		super(TerminalClient, self).__init__(logger, host, port, rules, protocol, rules_cache)
+		self.tb = None
+		self.max_fps = max_fps
+		self.redraw = curio.UniversalEvent()  # set when something needs drawing, also from plain functions like logging handlers
+		self.ui = Ui(self)
+
+	async def _run_input(self):
+		async for event in self.tb:
+			etype, ch, key, mod, w, h, xx, yy = event
+			if etype == termbox.EVENT_KEY:
+				if key == termbox.KEY_CTRL_C:
+					raise KeyboardInterrupt()
+				else:
+					try:
+						await self.ui.on_key(self.tb, key, ch, mod)
+					except:
+						self.logger.exception(f"Error handling terminal event {event!r}")
+					self.request_redraw()
+			elif etype == termbox.EVENT_RESIZE:
+				self.request_redraw()  # we use .width() and .height() anyway
+			else:
+				self.logger.warning(f"Unhandled event {event!r}")
+
+	def request_redraw(self):
+		self.redraw.set()
+
+	async def _run_output(self):
+		self.request_redraw()
+		while True:
+			await self.redraw.wait()
+			self.redraw.clear()  # before drawing, so changes made meanwhile get the next frame
+			start = time.monotonic()
+			if await self.ui.render(self.tb, 0, 0, self.tb.width(), self.tb.height()):
+				self.tb.present()
+			# at most max_fps frames per second, changes made until then are drawn together
+			await curio.sleep(max(1 / self.max_fps - (time.monotonic() - start), 0))
+
+	async def run(self):
+		async with TermboxAsync() as tb:
+			self.tb = tb
+			async with curio.TaskGroup() as g:
+				await g.spawn(self._run_net())
+				await g.spawn(self._run_input())
+				await g.spawn(self._run_output())
@@ -1,10 +1,15 @@
+import collections
+import itertools
 import shlex
 import logging
+import time
 from functools import reduce
 
 import curio
 import termbox
 
+from ..proto import commands_pb2 as commands
+
 
 def clamp(x, mn, mx):
 	return max(mn, min(x, mx))
@@ -59,11 +64,14 @@ class LineEditWidget:
 		self.bg = termbox.WHITE
 		self.prefix = "> "
 		self.suffix = None
+		self.dirty = True
 
 	async def on_key(self, tb, key, ch, mod):
 		line_change = False
 		# nav keys
-		if key == termbox.KEY_HOME:
+		if not self.text and key in (termbox.KEY_HOME, termbox.KEY_END, termbox.KEY_ARROW_LEFT, termbox.KEY_ARROW_RIGHT):
+			return False  # nothing to move around in, leave the keys to the screen
+		elif key == termbox.KEY_HOME:
 			self.cursor = 0
 		elif key == termbox.KEY_END:
 			self.cursor = len(self.text)
@@ -101,46 +109,95 @@ class LineEditWidget:
 			return False
 
 		self.cursor = clamp(self.cursor, 0, len(self.text))
+		self.dirty = True
 		return True
 
-	async def render(self, tb, x, y, w, h):
+	async def render(self, tb, x, y, w, h, full=True):
+		if not (full or self.dirty):
+			return False
+		self.dirty = False
 		prefix = self.prefix or ""
 		suffix = self.suffix or ""
 		content_length = w - len(prefix) - len(suffix)
 		tb.write(x, y, prefix + procrustes(self.text, content_length) + suffix, fg=self.fg, bg=self.bg)
+		return True
 
 
 class Screen:
 	async def on_key(self, tb, key, ch, mod):
 		pass
 
-	async def render(self, tb, x, y, w, h):
-		pass
+	async def render(self, tb, x, y, w, h, full=True):
+		'''Draw the screen, everything if full is set, otherwise only what
+		changed since the last call. Returns whether anything was drawn.'''
+		return False
 
 
 class ScreenLog:
-	def __init__(self):
-		self.lines = []
-		self.cursor = 0
+	'''The latest capacity log records of at least level.
+
+	Records are kept as they are and only formatted while they are on the
+	screen, so a flood of debug messages costs little more than appending
+	to a deque.'''
+	def __init__(self, level=logging.INFO, capacity=10000):
+		self.level = level
+		self.records = collections.deque(maxlen=capacity)
+		self.dropped = 0  # records pushed out of the buffer, record numbers count these too
+		self.cursor = None  # number of the record at the top, None to follow the latest ones
+		self.formatter = logging.Formatter()
+		self.dirty = True
+		self._height = 1
+
+	def append(self, record):
+		'''Keep the record if it's at least level, return whether it was kept.'''
+		if record.levelno < self.level:
+			return False
+		if len(self.records) == self.records.maxlen:
+			self.dropped += 1
+		self.records.append(record)
+		self.dirty = True
+		return True
 
-	def append_message(self, message):
-		self.lines.extend(message.split('\n'))
+	def _lines(self, record):
+		return self.formatter.format(record).split('\n')
 
-	async def render(self, tb, x, y, w, h):
-		for i, line in enumerate(self.lines[self.cursor:self.cursor+h]):
-			tb.write(x, y + i, line[:w])
+	async def render(self, tb, x, y, w, h, full=True):
+		if not (full or self.dirty):
+			return False
+		self.dirty = False
+		self._height = h
+		lines = []
+		if self.cursor is None:
+			for record in reversed(self.records):
+				lines[:0] = self._lines(record)
+				if len(lines) >= h:
+					break
+			lines = lines[-h:]
+		else:
+			for record in itertools.islice(self.records, max(self.cursor - self.dropped, 0), None):
+				lines.extend(self._lines(record))
+				if len(lines) >= h:
+					break
+		for i in range(h):
+			# pad to the full width, the screen isn't cleared in between
+			tb.write(x, y + i, procrustes(lines[i] if i < len(lines) else "", w))
+		return True
 
 	async def on_key(self, tb, key, ch, mod):
+		last = self.dropped + max(len(self.records) - self._height, 0)  # the top record when following
+		top = self.cursor if self.cursor is not None else last
 		if key == termbox.KEY_PGUP:
-			self.cursor = max(self.cursor - 20, 0)
+			top -= 20
 		elif key == termbox.KEY_PGDN:
-			self.cursor = min(self.cursor + 20, len(self.lines))
+			top += 20
 		elif key == termbox.KEY_ARROW_UP:
-			self.cursor = max(self.cursor - 1, 0)
+			top -= 1
 		elif key == termbox.KEY_ARROW_DOWN:
-			self.cursor = min(self.cursor + 1, len(self.lines))
+			top += 1
 		else:
 			return False
+		self.cursor = max(top, self.dropped) if top < last else None
+		self.dirty = True
 		return True
 
 
@@ -163,36 +220,189 @@ class ScreenMap:
 		2: (None, None, termbox.BLUE),
 	}
 	PLAYER_DEFAULT = (None, None, termbox.WHITE)
+	MINIMAP_WIDTH = 24  # columns on the right for the minimap, including a blank one
+	MINIMAP_MIN_WIDTH = 64  # don't show the minimap in narrower terminals
+	MINIMAP_INTERVAL = 0.5  # seconds between minimap updates for moving units
+
 	def __init__(self, client):
 		self.client = client
+		self.camera = (0, 0)  # the map cell in the top left corner
+		self._view = (1, 1)  # width and height of the visible part of the map, as last drawn
+		self._styles = {}  # (terrain type name, unit type name, player id) -> (char code, fg, bg)
+		self._drawn = None  # the map, area and camera drawn last, everything is drawn again when they change
+		self._map = None  # the map the camera belongs to
+		self._requested = set()  # chunks of _map we asked the server for, or didn't need to
+		self._minimap_drawn = 0  # time.monotonic() of the last minimap update
+		self._minimap_stale = False  # an update was put off
+		self._minimap_timer = False  # a redraw is scheduled to catch up on it
+
+	def _layout(self, map, w, h):
+		'''Return the width of the map view and of the minimap.'''
+		minimap = ScreenMap.MINIMAP_WIDTH if w >= ScreenMap.MINIMAP_MIN_WIDTH else 0
+		return min(w - minimap, map.width), minimap
+
+	def look_at(self, xy):
+		'''Center the camera on a map cell.'''
+		w, h = self._view
+		self.camera = (xy[0] - w // 2, xy[1] - h // 2)
+
+	def _clamp_camera(self, map, w, h):
+		x, y = self.camera
+		self.camera = (clamp(x, 0, max(map.width - w, 0)), clamp(y, 0, max(map.height - h, 0)))
+		return self.camera
+
+	def _new_map(self, map):
+		self._map = map
+		self._requested = set()
+		self.camera = (0, 0)
+		units = self.client.state.units_of()
+		if units:
+			self.look_at(units[0].position)
+
+	async def _request_view(self, map, x, y, w, h):
+		'''Ask the server for the chunks in view that we don't know yet, e.g. of a huge map.'''
+		if not self.client.state.started:
+			return  # the map is still coming in
+		size = map.CHUNK_SIZE
+		for cy in range(y // size, (y + h - 1) // size + 1):
+			for cx in range(x // size, (x + w - 1) // size + 1):
+				if (cx, cy) in self._requested:
+					continue
+				self._requested.add((cx, cy))
+				if not map.chunk_known((cx, cy)):
+					await self.client.send(commands.CmdMapRequest(x=cx * size, y=cy * size, width=size, height=size))
 
 	def _resolve(self, profiles):
 		return (reduce(lambda a, b: b[0] if b[0] is not None else a, profiles, ScreenMap.DEFAULT[0]),
 			reduce(lambda a, b: b[1] if b[1] is not None else a, profiles, ScreenMap.DEFAULT[1]),
 			reduce(lambda a, b: b[2] if b[2] is not None else a, profiles, ScreenMap.DEFAULT[2]))
 
-	async def render(self, tb, x, y, w, h):
-		if self.client.map is not None:
-			for my in range(min(self.client.map.height, h)):
-				for mx in range(min(self.client.map.width, w)):
-					c = self.client.map[mx, my]
-					cell_profiles = [
-						ScreenMap.DEFAULT,
-						ScreenMap.TERRAIN_TYPES.get(c.terrain_type.name, ScreenMap.TERRAIN_TYPE_DEFAULT)]
-					if c.unit is not None:
-						cell_profiles.append(ScreenMap.UNIT_TYPES.get(c.unit.unit_type.name, ScreenMap.UNIT_TYPE_DEFAULT))
-						cell_profiles.append(ScreenMap.PLAYERS.get(c.unit.player_id, ScreenMap.PLAYER_DEFAULT))
-					ch, bg, fg = self._resolve(cell_profiles)
-					tb.change_cell(x + mx, y + my, ord(ch), fg, bg)
+	def _style(self, terrain_type, unit):
+		key = (terrain_type.name if terrain_type is not None else None,
+			unit.unit_type.name if unit is not None else None,
+			unit.player_id if unit is not None else None)
+		style = self._styles.get(key)
+		if style is None:
+			cell_profiles = [ScreenMap.DEFAULT]
+			if terrain_type is not None:  # unknown until the server sent it
+				cell_profiles.append(ScreenMap.TERRAIN_TYPES.get(terrain_type.name, ScreenMap.TERRAIN_TYPE_DEFAULT))
+			if unit is not None:
+				cell_profiles.append(ScreenMap.UNIT_TYPES.get(unit.unit_type.name, ScreenMap.UNIT_TYPE_DEFAULT))
+				cell_profiles.append(ScreenMap.PLAYERS.get(unit.player_id, ScreenMap.PLAYER_DEFAULT))
+			ch, bg, fg = self._resolve(cell_profiles)
+			style = self._styles[key] = (ord(ch), fg, bg)
+		return style
+
+	async def render(self, tb, x, y, w, h, full=True):
+		map = self.client.map
+		if map is None:
+			return False
+		view_w, minimap_w = self._layout(map, w, h)
+		view_h = min(map.height, h)
+		self._view = (view_w, view_h)
+		if map is not self._map:
+			self._new_map(map)
+		cx, cy = self._clamp_camera(map, view_w, view_h)
+		dirty = map.take_dirty()
+		now = time.monotonic()
+		if full or self._drawn != (map, x, y, w, h, self.camera):
+			self._drawn = (map, x, y, w, h, self.camera)
+			for my in range(view_h):
+				for mx, cell in enumerate(map.row(cx, cy + my, view_w)):
+					ch, fg, bg = self._style(cell.terrain_type, cell.unit)
+					tb.change_cell(x + mx, y + my, ch, fg, bg)
+			await self._request_view(map, cx, cy, view_w, view_h)
+		elif dirty or self._minimap_stale:
+			for mx, my in dirty:
+				if cx <= mx < cx + view_w and cy <= my < cy + view_h:
+					cell = map[mx, my]
+					ch, fg, bg = self._style(cell.terrain_type, cell.unit)
+					tb.change_cell(x + mx - cx, y + my - cy, ch, fg, bg)
+			wait = ScreenMap.MINIMAP_INTERVAL - (now - self._minimap_drawn)
+			if not minimap_w or wait > 0:
+				if minimap_w:
+					self._minimap_stale = True
+					if not self._minimap_timer:  # catch up on the minimap even if nothing else changes until then
+						self._minimap_timer = True
+						await curio.spawn(self._redraw_later(wait), daemon=True)
+				return bool(dirty)
+		else:
+			return False
+		if minimap_w:
+			self._minimap_drawn = now
+			self._minimap_stale = False
+			self._render_minimap(tb, x + w - minimap_w + 1, y, minimap_w - 1, h)
+		return True
+
+	async def _redraw_later(self, seconds):
+		await curio.sleep(seconds)
+		self._minimap_timer = False
+		self.client.request_redraw()
+
+	def _render_minimap(self, tb, x, y, w, h):
+		'''Draw the whole map scaled down to w x h with a cell for every block
+		of map cells, the terrain of a block's middle cell, the players' units
+		and the area the camera shows.'''
+		map = self.client.map
+		block = max(-(-map.width // w), -(-map.height // h), 1)  # map cells per minimap cell in both directions
+		units = {}
+		for unit in self.client.state.units.values():
+			units[unit.position[0] // block, unit.position[1] // block] = unit
+		cx, cy = self.camera
+		vw, vh = self._view
+		for my in range(-(-map.height // block)):
+			for mx in range(-(-map.width // block)):
+				cell = map[min(mx * block + block // 2, map.width - 1), min(my * block + block // 2, map.height - 1)]
+				ch, fg, bg = self._style(cell.terrain_type, units.get((mx, my)))
+				if cx // block <= mx <= (cx + vw - 1) // block and cy // block <= my <= (cy + vh - 1) // block:
+					fg |= termbox.REVERSE
+				tb.change_cell(x + mx, y + my, ch, fg, bg)
+
+	async def on_key(self, tb, key, ch, mod):
+		if self.client.map is None:
+			return False
+		w, h = self._view
+		x, y = self.camera
+		if key == termbox.KEY_ARROW_LEFT:
+			x -= max(w // 4, 1)
+		elif key == termbox.KEY_ARROW_RIGHT:
+			x += max(w // 4, 1)
+		elif key == termbox.KEY_ARROW_UP:
+			y -= max(h // 4, 1)
+		elif key == termbox.KEY_ARROW_DOWN:
+			y += max(h // 4, 1)
+		elif key == termbox.KEY_PGUP:
+			y -= h
+		elif key == termbox.KEY_PGDN:
+			y += h
+		elif key == termbox.KEY_HOME:  # back to our units
+			units = self.client.state.units_of()
+			if units:
+				self.look_at(units[0].position)
+			return True
+		else:
+			return False
+		self.camera = (x, y)
+		return True
 
 
 class UiLoggingHandler(logging.Handler):
-	def __init__(self, screen):
+	def __init__(self, screens, request_redraw):
 		super(UiLoggingHandler, self).__init__()
-		self.screen = screen
+		self.screens = screens
+		self.request_redraw = request_redraw
 
 	def emit(self, record):
-		self.screen.append_message(self.format(record))
+		if record.exc_info:
+			# keep the formatted traceback instead of the frames of the whole stack
+			record = logging.makeLogRecord(record.__dict__)
+			record.exc_text = logging.Formatter().formatException(record.exc_info)
+			record.exc_info = None
+		kept = False
+		for screen in self.screens:
+			kept |= screen.append(record)
+		if kept:
+			self.request_redraw()
 
 
 class Ui:
@@ -200,9 +410,10 @@ class Ui:
 		self.client = client
 		self.line = LineEditWidget()
 		self.line.on_submit = self._line_submit
-		self.screens = [ScreenLog(), ScreenMap(client)]
+		self.screens = [ScreenLog(logging.INFO), ScreenMap(client), ScreenLog(logging.DEBUG)]
 		self.screen_active = 0
-		logging.getLogger().addHandler(UiLoggingHandler(self.screens[0]))
+		self._drawn = None  # the screen and terminal size drawn last
+		logging.getLogger().addHandler(UiLoggingHandler([self.screens[0], self.screens[2]], client.request_redraw))
 
 	@property
 	def screen(self):
@@ -214,9 +425,18 @@ class Ui:
 		await self.client.run_command(parts[0], parts[1:])
 
 	async def render(self, tb, x, y, w, h):
+		'''Draw what changed since the last call, or everything after
+		switching screens or resizing. Returns whether anything was drawn,
+		i.e. whether the terminal needs updating.'''
+		full = self._drawn != (self.screen_active, w, h)
+		if full:
+			self._drawn = (self.screen_active, w, h)
+			tb.clear()
+		drawn = False
 		if self.screen is not None:
-			await self.screen.render(tb, x, y, w, h - 1)
-		await self.line.render(tb, 0, h - 1, w, 1)
+			drawn = await self.screen.render(tb, x, y, w, h - 1, full)
+		drawn |= await self.line.render(tb, 0, h - 1, w, 1, full)
+		return drawn or full
 
 	async def on_key(self, tb, key, ch, mod):
 		if key == termbox.KEY_TAB:
@@ -0,0 +1,165 @@
+'''Logging for the server and the client: handlers that never make the
+logging thread wait for the disk or the terminal, structured output and
+sampling of repetitive messages.
+
+Loggers are the standard library's. Pass key/value pairs with fields:
+
+	logger.info("Player joined", extra=fields(player=name))
+
+Records are formatted on the writer thread, after emit returned, so
+messages and fields should only hold values that don't change, like
+strings and numbers. Use %-style arguments rather than f-strings: it saves
+formatting records that are filtered out, and SampleFilter tells messages
+apart by their unformatted text.'''
+import json
+import logging
+import queue
+import sys
+import threading
+
+
+def fields(**kwargs):
+	'''Key/value pairs for a log record, as extra=fields(...).'''
+	return {'fields': kwargs}
+
+
+class BatchStreamHandler(logging.Handler):
+	'''A logging handler that writes to a stream from a thread of its own.
+
+	emit only queues the record, so whoever logs never waits for the disk
+	or a terminal or pipe that doesn't keep up. The thread formats the
+	records that queued up meanwhile, up to max_batch of them, and writes
+	them at once.
+
+	At most max_queue records wait to be written. Records that come while
+	the queue is full are dropped, the next one that fits carries the
+	number of dropped records as its dropped attribute.'''
+	def __init__(self, stream=None, max_batch=1024, max_queue=65536):
+		super(BatchStreamHandler, self).__init__()
+		self.stream = stream if stream is not None else sys.stderr
+		self.max_batch = max_batch
+		self.dropped = 0  # in total
+		self._dropped = 0  # since the last record that was queued
+		self._queue = queue.Queue(max_queue)
+		self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+		self._thread.start()
+
+	def emit(self, record):
+		if self._dropped:
+			record.dropped = self._dropped
+		try:
+			self._queue.put_nowait(record)
+		except queue.Full:
+			self._dropped += 1
+			self.dropped += 1
+		else:
+			self._dropped = 0
+
+	def _run(self):
+		while True:
+			records = [self._queue.get()]
+			while len(records) < self.max_batch:
+				try:
+					records.append(self._queue.get_nowait())
+				except queue.Empty:
+					break
+			lines = []
+			for record in records:
+				if record is None:  # closed
+					continue
+				try:
+					lines.append(self.format(record) + '\n')
+				except Exception:
+					self.handleError(record)
+			if lines:
+				self.stream.write(''.join(lines))
+				self.stream.flush()
+			if None in records:
+				return
+
+	def close(self):
+		'''Write what is queued and stop the thread.'''
+		if self._thread.is_alive():
+			self._queue.put(None)
+			self._thread.join()
+		super(BatchStreamHandler, self).close()
+
+
+class BatchFileHandler(BatchStreamHandler):
+	'''A BatchStreamHandler that writes to a file.'''
+	def __init__(self, filename, mode='a', encoding='utf-8', max_batch=1024):
+		super(BatchFileHandler, self).__init__(open(filename, mode, encoding=encoding), max_batch)
+
+	def close(self):
+		super(BatchFileHandler, self).close()
+		self.stream.close()
+
+
+class SampleFilter(logging.Filter):
+	'''Lets the first initial records with the same message from the same
+	logger through per interval seconds, and after that every thereafter-th,
+	so a message that is logged for every client or every unit can't flood
+	the log. The first record let through in the next interval carries the
+	number of records that were dropped as its suppressed attribute.
+
+	Once per interval, the counts of messages whose interval is over are
+	forgotten, unless records of them were dropped that weren't reported
+	yet, so messages that are only logged once in a while don't pile up.'''
+	def __init__(self, initial=50, thereafter=100, interval=1.0):
+		super(SampleFilter, self).__init__()
+		self.initial = initial
+		self.thereafter = thereafter
+		self.interval = interval
+		self._windows = {}  # (logger name, message) -> [start of the interval, records, dropped]
+		self._swept = 0.0  # when windows whose interval is over were last removed
+
+	def filter(self, record):
+		if record.created - self._swept >= self.interval:
+			self._sweep(record.created)
+		key = (record.name, record.msg)
+		window = self._windows.get(key)
+		if window is None or record.created - window[0] >= self.interval:
+			if window is not None and window[2]:
+				record.suppressed = window[2]
+			window = self._windows[key] = [record.created, 0, 0]
+		window[1] += 1
+		if window[1] <= self.initial or (window[1] - self.initial) % self.thereafter == 0:
+			return True
+		window[2] += 1
+		return False
+
+	def _sweep(self, now):
+		self._swept = now
+		self._windows = {key: window for key, window in self._windows.items() if now - window[0] < self.interval or window[2]}
+
+
+class StructuredFormatter(logging.Formatter):
+	'''Formats a record as a line "time level logger: message key=value ...",
+	or with json_lines as a JSON object, with the record's fields.'''
+	def __init__(self, json_lines=False):
+		super(StructuredFormatter, self).__init__()
+		self.json_lines = json_lines
+
+	def format(self, record):
+		values = dict(getattr(record, 'fields', {}))
+		if getattr(record, 'suppressed', 0):
+			values['suppressed'] = record.suppressed
+		if getattr(record, 'dropped', 0):
+			values['dropped'] = record.dropped
+		if record.exc_info and not record.exc_text:
+			record.exc_text = self.formatException(record.exc_info)
+		if self.json_lines:
+			data = {'time': record.created, 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+			data.update(values)
+			if record.exc_text:
+				data['exception'] = record.exc_text
+			return json.dumps(data, default=str)
+		line = f"{self.formatTime(record)} {record.levelname} {record.name}: {record.getMessage()}"
+		for key, value in values.items():
+			value = str(value)
+			if not value or ' ' in value or '"' in value:
+				value = json.dumps(value)
+			line += f" {key}={value}"
+		if record.exc_text:
+			line += '\n' + record.exc_text
+		return line
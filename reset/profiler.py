@@ -0,0 +1,91 @@
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from .log import fields
+
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+	'''Samples the stack of a thread (the main thread by default) from a
+	thread of its own every interval seconds, while the program keeps
+	running. This costs little enough to do it in a live game.
+
+	write saves the samples as folded stacks, one line per distinct stack
+	with its frames separated by ; and the number of samples, which is what
+	flamegraph.pl, inferno and speedscope take.
+
+	annotate(frame) may return a label to append to the frame's name, e.g.
+	to tell calls of the same function apart by their arguments.'''
+	def __init__(self, interval=0.01, thread_id=None, annotate=None):
+		self.interval = interval
+		self.thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+		self.annotate = annotate
+		self.stacks = collections.Counter()  # folded stack -> samples
+		self.samples = 0
+		self.started = None
+		self._stop = threading.Event()
+		self._thread = None
+
+	def start(self):
+		self.started = time.time()
+		self._thread = threading.Thread(target=self._run, name="SamplingProfiler", daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		self._stop.set()
+		self._thread.join()
+
+	def _run(self):
+		while not self._stop.wait(self.interval):
+			frame = sys._current_frames().get(self.thread_id)
+			if frame is not None:
+				self.stacks[self._fold(frame)] += 1
+				self.samples += 1
+
+	def _fold(self, frame):
+		names = []
+		while frame is not None:
+			code = frame.f_code
+			name = f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+			if self.annotate is not None:
+				label = self.annotate(frame)
+				if label is not None:
+					name += f" [{label}]"
+			names.append(name)
+			frame = frame.f_back
+		return ';'.join(reversed(names))
+
+	def write(self, path):
+		with open(path, 'w') as f:
+			for stack, count in self.stacks.most_common():
+				f.write(f"{stack} {count}\n")
+
+
+def install_signal_toggle(directory, annotate=None, signum=signal.SIGUSR1):
+	'''Start a SamplingProfiler when the process gets the signal, and stop it
+	and write its folded stacks to a new file in directory when it gets the
+	signal again, e.g. with kill -USR1 PID. Only the process's owner and
+	root may send it signals.'''
+	profiler = None
+
+	def toggle(signum, frame):
+		nonlocal profiler
+		if profiler is None:
+			profiler = SamplingProfiler(annotate=annotate)
+			profiler.start()
+			logger.info("Profiling, send signal %d again to stop", signum)
+		else:
+			profiler.stop()
+			path = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S.folded", time.localtime(profiler.started)))
+			profiler.write(path)
+			logger.info("Wrote profile", extra=fields(path=path, samples=profiler.samples, seconds=round(time.time() - profiler.started, 1)))
+			profiler = None
+
+	signal.signal(signum, toggle)
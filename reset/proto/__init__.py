@@ -1,22 +1,244 @@
+import logging
+
 import curio
 import google.protobuf.json_format
 
+from . import commands_pb2, events_pb2
+
+
+logger = logging.getLogger(__name__)
+
+
+class FrameTooLarge(ConnectionResetError):
+	'''The peer announced a frame larger than we are willing to buffer; the connection is unusable.'''
+
 
-async def recv_len(socket, length):
-	buf_back = bytearray(length)
-	buf = memoryview(buf_back)
-	have = 0
-	while have < length:
-		got = await socket.recv_into(buf[have:], length - have)
+class FrameReader:
+	'''Reads length-prefixed frames from a stream socket.
+
+	Data is received in large chunks into a reusable buffer, so one recv can
+	yield many frames. Frames are returned as memoryviews into that buffer;
+	they stay valid until the next call to frames(), which moves a trailing
+	partial frame to the front of the buffer (or into a bigger buffer, if it
+	does not fit) before receiving more data.'''
+	def __init__(self, sock, max_frame_size=1 << 20, chunk_size=1 << 16):
+		self.sock = sock
+		self.max_frame_size = max_frame_size
+		self._buffer = bytearray(chunk_size)
+		self._view = memoryview(self._buffer)
+		self._start = 0  # first byte that has not been returned yet
+		self._end = 0  # end of the received data
+
+	async def frames(self):
+		'''Wait until at least one frame is complete and return all complete frames.'''
+		while True:
+			frames = self._parse()
+			if frames:
+				return frames
+			await self._fill()
+
+	def _parse(self):
+		frames = []
+		buf, pos, end = self._buffer, self._start, self._end
+		while end - pos >= 4:
+			length = int.from_bytes(buf[pos:pos + 4], 'big')
+			if length > self.max_frame_size:
+				if frames:
+					break  # hand out the good frames first, the next call raises
+				raise FrameTooLarge(f"Frame of {length} bytes exceeds the limit of {self.max_frame_size} bytes")
+			if end - pos - 4 < length:
+				break
+			frames.append(self._view[pos + 4:pos + 4 + length])
+			pos += 4 + length
+		self._start = pos
+		return frames
+
+	async def _fill(self):
+		pending = self._end - self._start
+		needed = 4
+		if pending >= 4:
+			needed += int.from_bytes(self._buffer[self._start:self._start + 4], 'big')
+		if needed > len(self._buffer):
+			# a new buffer, because the old one may still be referenced by frames we returned
+			buffer = bytearray(max(needed, 2 * len(self._buffer)))
+			buffer[:pending] = self._view[self._start:self._end]
+			self._buffer, self._view = buffer, memoryview(buffer)
+		elif self._start > 0:
+			self._view[:pending] = self._view[self._start:self._end]
+		self._start, self._end = 0, pending
+		got = await self.sock.recv_into(self._view[self._end:], len(self._buffer) - self._end)
 		if got == 0:
 			raise ConnectionResetError("Client Disconnected")
-		have += got
-	return buf_back
+		self._end += got
+
+
+class Envelope:
+	'''Wraps messages into an envelope type like ServerToClient, which holds
+	exactly one of them in its "payload" oneof.
+
+	If batch_field is given, it names a payload with a repeated field
+	"events" of the envelope type, which can carry many envelopes at once.'''
+	def __init__(self, wrapper_type, batch_field=None):
+		self.wrapper_type = wrapper_type
+		self._fields = {fd.message_type: fd.name for fd in wrapper_type.DESCRIPTOR.oneofs_by_name["payload"].fields}
+		self._tags = {fd.message_type: _tag(fd.number) for fd in wrapper_type.DESCRIPTOR.oneofs_by_name["payload"].fields}
+		self.batch_type = None
+		if batch_field is not None:
+			field = wrapper_type.DESCRIPTOR.fields_by_name[batch_field]
+			self.batch_type = field.message_type._concrete_class
+			self._batch_tag = _tag(field.number)
+			self._batch_json = field.json_name
+			self._batch_events_tag = _tag(field.message_type.fields_by_name["events"].number)
+			self._batch_tick_tag = bytes([field.message_type.fields_by_name["tick"].number << 3])  # varint
+
+	def wrap(self, message):
+		wrapper = self.wrapper_type()
+		getattr(wrapper, self._fields[message.DESCRIPTOR]).CopyFrom(message)
+		return wrapper
+
+	def unwrap(self, wrapper):
+		return getattr(wrapper, wrapper.WhichOneof("payload"))
+
+	def unwrap_all(self, wrapper):
+		'''Like unwrap, but returns a list of all messages in a batch.'''
+		message = self.unwrap(wrapper)
+		if self.batch_type is not None and isinstance(message, self.batch_type):
+			return [message for inner in message.events for message in self.unwrap_all(inner)]
+		return [message]
+
+	def packet(self, message):
+		return message if isinstance(message, Packet) else Packet(self, message)
+
+	def batch(self, packets, tick=None):
+		return Batch(self, packets, tick)
+
+	def encoded_packet(self, message_type, data):
+		'''A packet holding a message of message_type that is already
+		serialized, e.g. pieced together from cached parts.'''
+		packet = Packet(self, None)
+		packet._protobuf = self._tags[message_type.DESCRIPTOR] + _varint(len(data)) + data
+		return packet
+
+
+_small_varints = [bytes([n]) for n in range(0x80)]
+
+
+def _varint(n):
+	if n < 0x80:
+		return _small_varints[n]
+	out = bytearray()
+	while n > 0x7f:
+		out.append(n & 0x7f | 0x80)
+		n >>= 7
+	out.append(n)
+	return bytes(out)
+
+
+def _tag(number):
+	'''The key of a length-delimited field.'''
+	return _varint(number << 3 | 2)
+
+
+class Packet:
+	'''A message that is to be sent to one or more clients.
+	It is wrapped and encoded on demand, and at most once per wire format,
+	no matter to how many clients it is sent.'''
+	__slots__ = ('envelope', 'message', '_wrapper', '_protobuf', '_frame', '_json')
+
+	def __init__(self, envelope, message):
+		self.envelope = envelope
+		self.message = message
+		self._wrapper = None
+		self._protobuf = None
+		self._frame = None
+		self._json = None
+
+	@property
+	def wrapper(self):
+		if self._wrapper is None:
+			if self.message is None:  # see Envelope.encoded_packet
+				self._wrapper = self.envelope.wrapper_type()
+				self._wrapper.ParseFromString(self._protobuf)
+			else:
+				self._wrapper = self.envelope.wrap(self.message)
+		return self._wrapper
+
+	def protobuf(self):
+		'''The serialized envelope.'''
+		if self._protobuf is None:
+			self._protobuf = self.wrapper.SerializeToString()
+		return self._protobuf
+
+	def frame(self):
+		'''The serialized envelope with its length in front, as used on stream sockets.'''
+		if self._frame is None:
+			packet = self.protobuf()
+			self._frame = len(packet).to_bytes(4, 'big') + packet
+		return self._frame
+
+	def json(self):
+		if self._json is None:
+			self._json = google.protobuf.json_format.MessageToJson(self.wrapper)
+		return self._json
+
+
+class Batch:
+	'''Several packets sent as one envelope holding a batch. This saves a
+	frame and its header per packet on the wire, and lets the client parse
+	them in one go.
+
+	The batch is encoded by concatenating the encoded packets, which are
+	cached in the packets and shared with other clients, so nothing is
+	encoded twice.'''
+	__slots__ = ('envelope', 'packets', 'tick', '_protobuf', '_frame', '_json')
+
+	def __init__(self, envelope, packets, tick=None):
+		self.envelope = envelope
+		self.packets = packets
+		self.tick = tick
+		self._protobuf = None
+		self._frame = None
+		self._json = None
+
+	def protobuf(self):
+		if self._protobuf is None:
+			envelope = self.envelope
+			parts = []
+			if self.tick is not None:
+				parts += [envelope._batch_tick_tag, _varint(self.tick)]
+			tag = envelope._batch_events_tag
+			for packet in self.packets:
+				data = packet.protobuf()
+				parts.append(tag)
+				parts.append(_varint(len(data)))
+				parts.append(data)
+			batch = b''.join(parts)
+			self._protobuf = envelope._batch_tag + _varint(len(batch)) + batch
+		return self._protobuf
+
+	def frame(self):
+		if self._frame is None:
+			packet = self.protobuf()
+			self._frame = len(packet).to_bytes(4, 'big') + packet
+		return self._frame
+
+	def json(self):
+		if self._json is None:
+			tick = f'"tick": {self.tick}, ' if self.tick is not None else ''
+			events = ', '.join(packet.json() for packet in self.packets)
+			self._json = f'{{"{self.envelope._batch_json}": {{{tick}"events": [{events}]}}}}'
+		return self._json
+
+
+events_envelope = Envelope(events_pb2.ServerToClient, 'event_batch')
+commands_envelope = Envelope(commands_pb2.ClientToServer)
 
 
 class Protocol:
 	def __init__(self):
-		self._handlers = {f.command_type: getattr(self, n) for n, f in self.__class__.__dict__.items() if hasattr(f, 'command_type')}
+		self._handlers = {}
+		for cls in reversed(type(self).__mro__):  # handlers of subclasses win
+			self._handlers.update({f.command_type: getattr(self, n) for n, f in cls.__dict__.items() if hasattr(f, 'command_type')})
 
 	def get_handler(self, key):
 		return self._handlers.get(key, self.on_unhandled)
@@ -30,11 +252,17 @@ class Protocol:
 	async def on_disconnect(self, server, client):
 		pass
 
+	def resync(self, server, client):
+		'''Return the messages that bring a client up to date after messages to it were dropped.'''
+		return []
+
 	async def on_unhandled(self, server, client, message):
+		if not logger.isEnabledFor(logging.DEBUG):
+			return  # don't dump messages no one reads
 		if hasattr(message, 'DESCRIPTOR'):
-			print(message.DESCRIPTOR.name, google.protobuf.json_format.MessageToJson(message))
+			logger.debug("Unhandled %s: %s", message.DESCRIPTOR.name, google.protobuf.json_format.MessageToJson(message, indent=None))
 		else:
-			print("Unhandled:", message)
+			logger.debug("Unhandled: %r", message)
 
 	@staticmethod
 	def handler(command_type):
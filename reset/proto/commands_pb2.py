@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: commands.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+from reset.proto import types_pb2 as types__pb2
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0e\x63ommands.proto\x12\x14reset.proto.commands\x1a\x0btypes.proto\"\xa6\x04\n\x0e\x43lientToServer\x12-\n\x04join\x18\n \x01(\x0b\x32\x1d.reset.proto.commands.CmdJoinH\x00\x12/\n\x05leave\x18\x0b \x01(\x0b\x32\x1e.reset.proto.commands.CmdLeaveH\x00\x12\x37\n\treconnect\x18\x0c \x01(\x0b\x32\".reset.proto.commands.CmdReconnectH\x00\x12\x35\n\x08spectate\x18\r \x01(\x0b\x32!.reset.proto.commands.CmdSpectateH\x00\x12\x38\n\ngame_start\x18\x14 \x01(\x0b\x32\".reset.proto.commands.CmdGameStartH\x00\x12<\n\x0c\x61\x63tion_queue\x18\x1e \x01(\x0b\x32$.reset.proto.commands.CmdActionQueueH\x00\x12>\n\raction_cancel\x18\x1f \x01(\x0b\x32%.reset.proto.commands.CmdActionCancelH\x00\x12\x45\n\x11\x61\x63tion_queue_many\x18  \x01(\x0b\x32(.reset.proto.commands.CmdActionQueueManyH\x00\x12:\n\x0bmap_request\x18( \x01(\x0b\x32#.reset.proto.commands.CmdMapRequestH\x00\x42\t\n\x07payload\"+\n\x07\x43mdJoin\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x12\n\nrules_hash\x18\x02 \x01(\x0c\"\n\n\x08\x43mdLeave\"D\n\x0c\x43mdReconnect\x12\x11\n\tplayer_id\x18\x01 \x02(\r\x12\r\n\x05token\x18\x02 \x02(\x0c\x12\x12\n\nrules_hash\x18\x03 \x01(\x0c\"!\n\x0b\x43mdSpectate\x12\x12\n\nrules_hash\x18\x01 \x01(\x0c\"\x0e\n\x0c\x43mdGameStart\"\xb2\x01\n\x0e\x43mdActionQueue\x12\x16\n\x0e\x61\x63tion_type_id\x18\x01 \x02(\r\x12\x0f\n\x07unit_id\x18\x02 \x02(\r\x12\x31\n\x04mode\x18\x03 \x01(\x0e\x32\x1d.reset.proto.types.ActionMode:\x04ONCE\x12\x16\n\x0etarget_unit_id\x18\x04 \x01(\r\x12,\n\x0btarget_cell\x18\x05 \x01(\x0b\x32\x17.reset.proto.types.vec2\"\xbb\x01\n\x12\x43mdActionQueueMany\x12\x16\n\x0e\x61\x63tion_type_id\x18\x01 \x02(\r\x12\x14\n\x08unit_ids\x18\x02 \x03(\rB\x02\x10\x01\x12\x31\n\x04mode\x18\x03 \x01(\x0e\x32\x1d.reset.proto.types.ActionMode:\x04ONCE\x12\x16\n\x0etarget_unit_id\x18\x04 \x01(\r\x12,\n\x0btarget_cell\x18\x05 \x01(\x0b\x32\x17.reset.proto.types.vec2\"$\n\x0f\x43mdActionCancel\x12\x11\n\taction_id\x18\x01 \x02(\r\"D\n\rCmdMapRequest\x12\t\n\x01x\x18\x01 \x02(\r\x12\t\n\x01y\x18\x02 \x02(\r\x12\r\n\x05width\x18\x03 \x02(\r\x12\x0e\n\x06height\x18\x04 \x02(\r')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'commands_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _CMDACTIONQUEUEMANY.fields_by_name['unit_ids']._options = None
+  _CMDACTIONQUEUEMANY.fields_by_name['unit_ids']._serialized_options = b'\020\001'
+  _CLIENTTOSERVER._serialized_start=54
+  _CLIENTTOSERVER._serialized_end=604
+  _CMDJOIN._serialized_start=606
+  _CMDJOIN._serialized_end=649
+  _CMDLEAVE._serialized_start=651
+  _CMDLEAVE._serialized_end=661
+  _CMDRECONNECT._serialized_start=663
+  _CMDRECONNECT._serialized_end=731
+  _CMDSPECTATE._serialized_start=733
+  _CMDSPECTATE._serialized_end=766
+  _CMDGAMESTART._serialized_start=768
+  _CMDGAMESTART._serialized_end=782
+  _CMDACTIONQUEUE._serialized_start=785
+  _CMDACTIONQUEUE._serialized_end=963
+  _CMDACTIONQUEUEMANY._serialized_start=966
+  _CMDACTIONQUEUEMANY._serialized_end=1153
+  _CMDACTIONCANCEL._serialized_start=1155
+  _CMDACTIONCANCEL._serialized_end=1191
+  _CMDMAPREQUEST._serialized_start=1193
+  _CMDMAPREQUEST._serialized_end=1261
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: events.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+from reset.proto import types_pb2 as types__pb2
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0c\x65vents.proto\x12\x12reset.proto.events\x1a\x0btypes.proto\"\xc1\x0c\n\x0eServerToClient\x12*\n\x05\x65rror\x18\x01 \x01(\x0b\x32\x19.reset.proto.events.ErrorH\x00\x12\x35\n\x0b\x65vent_batch\x18\x02 \x01(\x0b\x32\x1e.reset.proto.events.EventBatchH\x00\x12@\n\x11info_terrain_type\x18\n \x01(\x0b\x32#.reset.proto.events.InfoTerrainTypeH\x00\x12\x42\n\x12info_resource_type\x18\x0b \x01(\x0b\x32$.reset.proto.events.InfoResourceTypeH\x00\x12>\n\x10info_action_type\x18\x0c \x01(\x0b\x32\".reset.proto.events.InfoActionTypeH\x00\x12:\n\x0einfo_unit_type\x18\r \x01(\x0b\x32 .reset.proto.events.InfoUnitTypeH\x00\x12\x33\n\ninfo_rules\x18\x0e \x01(\x0b\x32\x1d.reset.proto.events.InfoRulesH\x00\x12@\n\x11\x65vent_player_join\x18\x14 \x01(\x0b\x32#.reset.proto.events.EventPlayerJoinH\x00\x12\x42\n\x12\x65vent_player_leave\x18\x15 \x01(\x0b\x32$.reset.proto.events.EventPlayerLeaveH\x00\x12H\n\x15\x65vent_reconnect_token\x18\x16 \x01(\x0b\x32\'.reset.proto.events.EventReconnectTokenH\x00\x12\x42\n\x12\x65vent_map_generate\x18\x1e \x01(\x0b\x32$.reset.proto.events.EventMapGenerateH\x00\x12K\n\x17\x65vent_map_generate_cell\x18\x1f \x01(\x0b\x32(.reset.proto.events.EventMapGenerateCellH\x00\x12>\n\x10\x65vent_game_start\x18  \x01(\x0b\x32\".reset.proto.events.EventGameStartH\x00\x12H\n\x15\x65vent_player_resource\x18! \x01(\x0b\x32\'.reset.proto.events.EventPlayerResourceH\x00\x12;\n\x0e\x65vent_snapshot\x18\" \x01(\x0b\x32!.reset.proto.events.EventSnapshotH\x00\x12>\n\x10\x65vent_map_region\x18# \x01(\x0b\x32\".reset.proto.events.EventMapRegionH\x00\x12@\n\x11\x65vent_unit_create\x18( \x01(\x0b\x32#.reset.proto.events.EventUnitCreateH\x00\x12@\n\x11\x65vent_unit_update\x18) \x01(\x0b\x32#.reset.proto.events.EventUnitUpdateH\x00\x12\x42\n\x12\x65vent_unit_destroy\x18* \x01(\x0b\x32$.reset.proto.events.EventUnitDestroyH\x00\x12<\n\x0f\x65vent_unit_move\x18+ \x01(\x0b\x32!.reset.proto.events.EventUnitMoveH\x00\x12\x44\n\x13\x65vent_action_queued\x18\x32 \x01(\x0b\x32%.reset.proto.events.EventActionQueuedH\x00\x12\x44\n\x13\x65vent_action_update\x18\x33 \x01(\x0b\x32%.reset.proto.events.EventActionUpdateH\x00\x12H\n\x15\x65vent_action_dequeued\x18\x34 \x01(\x0b\x32\'.reset.proto.events.EventActionDequeuedH\x00\x12\x46\n\x14\x65vent_actions_queued\x18\x35 \x01(\x0b\x32&.reset.proto.events.EventActionsQueuedH\x00\x42\t\n\x07payload\"\'\n\x05\x45rror\x12\r\n\x05\x65rror\x18\x01 \x02(\t\x12\x0f\n\x07\x63ommand\x18\x02 \x01(\t\"N\n\nEventBatch\x12\x0c\n\x04tick\x18\x01 \x01(\r\x12\x32\n\x06\x65vents\x18\x02 \x03(\x0b\x32\".reset.proto.events.ServerToClient\"`\n\x0fInfoTerrainType\x12\x17\n\x0fterrain_type_id\x18\x01 \x02(\r\x12\x34\n\x0cterrain_type\x18\x02 \x02(\x0b\x32\x1e.reset.proto.types.TerrainType\"d\n\x10InfoResourceType\x12\x18\n\x10resource_type_id\x18\x01 \x02(\r\x12\x36\n\rresource_type\x18\x02 \x02(\x0b\x32\x1f.reset.proto.types.ResourceType\"\\\n\x0eInfoActionType\x12\x16\n\x0e\x61\x63tion_type_id\x18\x01 \x02(\r\x12\x32\n\x0b\x61\x63tion_type\x18\x02 \x02(\x0b\x32\x1d.reset.proto.types.ActionType\"T\n\x0cInfoUnitType\x12\x14\n\x0cunit_type_id\x18\x01 \x02(\r\x12.\n\tunit_type\x18\x02 \x02(\x0b\x32\x1b.reset.proto.types.UnitType\"J\n\tInfoRules\x12\x0c\n\x04hash\x18\x01 \x02(\x0c\x12/\n\x06\x62undle\x18\x02 \x01(\x0b\x32\x1f.reset.proto.events.RulesBundle\"\xf7\x01\n\x0bRulesBundle\x12:\n\rterrain_types\x18\x01 \x03(\x0b\x32#.reset.proto.events.InfoTerrainType\x12<\n\x0eresource_types\x18\x02 \x03(\x0b\x32$.reset.proto.events.InfoResourceType\x12\x34\n\nunit_types\x18\x03 \x03(\x0b\x32 .reset.proto.events.InfoUnitType\x12\x38\n\x0c\x61\x63tion_types\x18\x04 \x03(\x0b\x32\".reset.proto.events.InfoActionType\"2\n\x0f\x45ventPlayerJoin\x12\x11\n\tplayer_id\x18\x01 \x02(\r\x12\x0c\n\x04name\x18\x02 \x02(\t\"%\n\x10\x45ventPlayerLeave\x12\x11\n\tplayer_id\x18\x01 \x02(\r\"7\n\x13\x45ventReconnectToken\x12\x11\n\tplayer_id\x18\x01 \x02(\r\x12\r\n\x05token\x18\x02 \x02(\x0c\"1\n\x10\x45ventMapGenerate\x12\r\n\x05width\x18\x01 \x02(\r\x12\x0e\n\x06height\x18\x02 \x02(\r\"Z\n\x14\x45ventMapGenerateCell\x12)\n\x08position\x18\x01 \x02(\x0b\x32\x17.reset.proto.types.vec2\x12\x17\n\x0fterrain_type_id\x18\x02 \x02(\r\"\x10\n\x0e\x45ventGameStart\"?\n\x13\x45ventPlayerResource\x12\x18\n\x10resource_type_id\x18\x01 \x02(\r\x12\x0e\n\x06\x61mount\x18\x02 \x02(\r\"\xcf\x02\n\rEventSnapshot\x12\r\n\x05width\x18\x01 \x02(\r\x12\x0e\n\x06height\x18\x02 \x02(\r\x12\x11\n\tplayer_id\x18\x03 \x01(\r\x12\x34\n\x07players\x18\x04 \x03(\x0b\x32#.reset.proto.events.EventPlayerJoin\x12\x31\n\x06\x63hunks\x18\x05 \x03(\x0b\x32!.reset.proto.events.SnapshotChunk\x12\x32\n\x05units\x18\x06 \x03(\x0b\x32#.reset.proto.events.EventUnitCreate\x12:\n\tresources\x18\x07 \x03(\x0b\x32\'.reset.proto.events.EventPlayerResource\x12\x33\n\x07\x61\x63tions\x18\x08 \x03(\x0b\x32\".reset.proto.events.SnapshotAction\"w\n\rSnapshotChunk\x12)\n\x08position\x18\x01 \x02(\x0b\x32\x17.reset.proto.types.vec2\x12\r\n\x05width\x18\x02 \x02(\r\x12\x0e\n\x06height\x18\x03 \x02(\r\x12\x1c\n\x10terrain_type_ids\x18\x04 \x03(\rB\x02\x10\x01\"v\n\x0e\x45ventMapRegion\x12\x30\n\x05\x63hunk\x18\x01 \x02(\x0b\x32!.reset.proto.events.SnapshotChunk\x12\x32\n\x05units\x18\x02 \x03(\x0b\x32#.reset.proto.events.EventUnitCreate\"|\n\x0eSnapshotAction\x12\x11\n\taction_id\x18\x01 \x02(\r\x12\x0f\n\x07unit_id\x18\x02 \x02(\r\x12\x16\n\x0e\x61\x63tion_type_id\x18\x03 \x02(\r\x12.\n\x05state\x18\x04 \x02(\x0e\x32\x1f.reset.proto.events.ActionState\"v\n\x0f\x45ventUnitCreate\x12\x0f\n\x07unit_id\x18\x01 \x02(\r\x12\x11\n\tplayer_id\x18\x02 \x02(\r\x12\x14\n\x0cunit_type_id\x18\x03 \x02(\r\x12)\n\x08position\x18\x04 \x02(\x0b\x32\x17.reset.proto.types.vec2\"0\n\x0f\x45ventUnitUpdate\x12\x0f\n\x07unit_id\x18\x01 \x02(\r\x12\x0c\n\x04tags\x18\x02 \x03(\t\"K\n\rEventUnitMove\x12\x0f\n\x07unit_id\x18\x01 \x02(\r\x12)\n\x08position\x18\x02 \x02(\x0b\x32\x17.reset.proto.types.vec2\"#\n\x10\x45ventUnitDestroy\x12\x0f\n\x07unit_id\x18\x01 \x02(\r\"7\n\x11\x45ventActionQueued\x12\x11\n\taction_id\x18\x01 \x02(\r\x12\x0f\n\x07unit_id\x18\x02 \x02(\r\"p\n\x12\x45ventActionsQueued\x12\x16\n\naction_ids\x18\x01 \x03(\rB\x02\x10\x01\x12\x14\n\x08unit_ids\x18\x02 \x03(\rB\x02\x10\x01\x12\x1d\n\x11rejected_unit_ids\x18\x03 \x03(\rB\x02\x10\x01\x12\r\n\x05\x65rror\x18\x04 \x01(\t\"\xa6\x01\n\x11\x45ventActionUpdate\x12\x11\n\taction_id\x18\x01 \x02(\r\x12.\n\x05state\x18\x02 \x02(\x0e\x32\x1f.reset.proto.events.ActionState\x12+\n\x04mode\x18\x03 \x01(\x0e\x32\x1d.reset.proto.types.ActionMode\x12\x10\n\x08\x64uration\x18\x04 \x01(\r\x12\x0f\n\x07message\x18\x05 \x01(\t\"(\n\x13\x45ventActionDequeued\x12\x11\n\taction_id\x18\x01 \x02(\r*Y\n\x0b\x41\x63tionState\x12\n\n\x06QUEUED\x10\x00\x12\x0b\n\x07WORKING\x10\x01\x12\x0c\n\x08\x43OMPLETE\x10\x02\x12\x08\n\x04WAIT\x10\x03\x12\r\n\tCANCELLED\x10\x04\x12\n\n\x06\x46\x41ILED\x10\x05')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'events_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _SNAPSHOTCHUNK.fields_by_name['terrain_type_ids']._options = None
+  _SNAPSHOTCHUNK.fields_by_name['terrain_type_ids']._serialized_options = b'\020\001'
+  _EVENTACTIONSQUEUED.fields_by_name['action_ids']._options = None
+  _EVENTACTIONSQUEUED.fields_by_name['action_ids']._serialized_options = b'\020\001'
+  _EVENTACTIONSQUEUED.fields_by_name['unit_ids']._options = None
+  _EVENTACTIONSQUEUED.fields_by_name['unit_ids']._serialized_options = b'\020\001'
+  _EVENTACTIONSQUEUED.fields_by_name['rejected_unit_ids']._options = None
+  _EVENTACTIONSQUEUED.fields_by_name['rejected_unit_ids']._serialized_options = b'\020\001'
+  _ACTIONSTATE._serialized_start=4225
+  _ACTIONSTATE._serialized_end=4314
+  _SERVERTOCLIENT._serialized_start=50
+  _SERVERTOCLIENT._serialized_end=1651
+  _ERROR._serialized_start=1653
+  _ERROR._serialized_end=1692
+  _EVENTBATCH._serialized_start=1694
+  _EVENTBATCH._serialized_end=1772
+  _INFOTERRAINTYPE._serialized_start=1774
+  _INFOTERRAINTYPE._serialized_end=1870
+  _INFORESOURCETYPE._serialized_start=1872
+  _INFORESOURCETYPE._serialized_end=1972
+  _INFOACTIONTYPE._serialized_start=1974
+  _INFOACTIONTYPE._serialized_end=2066
+  _INFOUNITTYPE._serialized_start=2068
+  _INFOUNITTYPE._serialized_end=2152
+  _INFORULES._serialized_start=2154
+  _INFORULES._serialized_end=2228
+  _RULESBUNDLE._serialized_start=2231
+  _RULESBUNDLE._serialized_end=2478
+  _EVENTPLAYERJOIN._serialized_start=2480
+  _EVENTPLAYERJOIN._serialized_end=2530
+  _EVENTPLAYERLEAVE._serialized_start=2532
+  _EVENTPLAYERLEAVE._serialized_end=2569
+  _EVENTRECONNECTTOKEN._serialized_start=2571
+  _EVENTRECONNECTTOKEN._serialized_end=2626
+  _EVENTMAPGENERATE._serialized_start=2628
+  _EVENTMAPGENERATE._serialized_end=2677
+  _EVENTMAPGENERATECELL._serialized_start=2679
+  _EVENTMAPGENERATECELL._serialized_end=2769
+  _EVENTGAMESTART._serialized_start=2771
+  _EVENTGAMESTART._serialized_end=2787
+  _EVENTPLAYERRESOURCE._serialized_start=2789
+  _EVENTPLAYERRESOURCE._serialized_end=2852
+  _EVENTSNAPSHOT._serialized_start=2855
+  _EVENTSNAPSHOT._serialized_end=3190
+  _SNAPSHOTCHUNK._serialized_start=3192
+  _SNAPSHOTCHUNK._serialized_end=3311
+  _EVENTMAPREGION._serialized_start=3313
+  _EVENTMAPREGION._serialized_end=3431
+  _SNAPSHOTACTION._serialized_start=3433
+  _SNAPSHOTACTION._serialized_end=3557
+  _EVENTUNITCREATE._serialized_start=3559
+  _EVENTUNITCREATE._serialized_end=3677
+  _EVENTUNITUPDATE._serialized_start=3679
+  _EVENTUNITUPDATE._serialized_end=3727
+  _EVENTUNITMOVE._serialized_start=3729
+  _EVENTUNITMOVE._serialized_end=3804
+  _EVENTUNITDESTROY._serialized_start=3806
+  _EVENTUNITDESTROY._serialized_end=3841
+  _EVENTACTIONQUEUED._serialized_start=3843
+  _EVENTACTIONQUEUED._serialized_end=3898
+  _EVENTACTIONSQUEUED._serialized_start=3900
+  _EVENTACTIONSQUEUED._serialized_end=4012
+  _EVENTACTIONUPDATE._serialized_start=4015
+  _EVENTACTIONUPDATE._serialized_end=4181
+  _EVENTACTIONDEQUEUED._serialized_start=4183
+  _EVENTACTIONDEQUEUED._serialized_end=4223
+# @@protoc_insertion_point(module_scope)
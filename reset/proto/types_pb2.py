@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: types.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0btypes.proto\x12\x11reset.proto.types\"\x1c\n\x04vec2\x12\t\n\x01x\x18\x01 \x02(\r\x12\t\n\x01y\x18\x02 \x02(\r\">\n\x0bTerrainType\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x13\n\x0b\x64\x65scription\x18\x02 \x01(\t\x12\x0c\n\x04tags\x18\x03 \x03(\t\"1\n\x0cResourceType\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x13\n\x0b\x64\x65scription\x18\x02 \x01(\t\"[\n\x08UnitType\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x13\n\x0b\x64\x65scription\x18\x02 \x01(\t\x12\x1e\n\x16\x64\x65\x66\x61ult_action_type_id\x18\x03 \x01(\r\x12\x0c\n\x04tags\x18\x04 \x03(\t\"\xdb\x02\n\nActionType\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\x13\n\x0b\x64\x65scription\x18\x02 \x01(\t\x12\x14\n\x0cunit_type_id\x18\x03 \x02(\r\x12\x38\n\x04\x63ost\x18\x04 \x03(\x0b\x32*.reset.proto.types.ActionType.ResourceCost\x12\x10\n\x08\x64uration\x18\x05 \x02(\x01\x12\x39\n\x0c\x64\x65\x66\x61ult_mode\x18\x06 \x02(\x0e\x32\x1d.reset.proto.types.ActionMode:\x04ONCE\x12>\n\x0btarget_type\x18\x07 \x02(\x0e\x32#.reset.proto.types.ActionTargetType:\x04NONE\x12\x13\n\x0btarget_tags\x18\x08 \x03(\t\x1a\x38\n\x0cResourceCost\x12\x18\n\x10resource_type_id\x18\x01 \x02(\r\x12\x0e\n\x06\x61mount\x18\x02 \x02(\r*0\n\x10\x41\x63tionTargetType\x12\x08\n\x04NONE\x10\x00\x12\x08\n\x04\x43\x45LL\x10\x01\x12\x08\n\x04UNIT\x10\x02*\"\n\nActionMode\x12\x08\n\x04ONCE\x10\x00\x12\n\n\x06REPEAT\x10\x01')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'types_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _ACTIONTARGETTYPE._serialized_start=622
+  _ACTIONTARGETTYPE._serialized_end=670
+  _ACTIONMODE._serialized_start=672
+  _ACTIONMODE._serialized_end=706
+  _VEC2._serialized_start=34
+  _VEC2._serialized_end=62
+  _TERRAINTYPE._serialized_start=64
+  _TERRAINTYPE._serialized_end=126
+  _RESOURCETYPE._serialized_start=128
+  _RESOURCETYPE._serialized_end=177
+  _UNITTYPE._serialized_start=179
+  _UNITTYPE._serialized_end=270
+  _ACTIONTYPE._serialized_start=273
+  _ACTIONTYPE._serialized_end=620
+  _ACTIONTYPE_RESOURCECOST._serialized_start=564
+  _ACTIONTYPE_RESOURCECOST._serialized_end=620
+# @@protoc_insertion_point(module_scope)
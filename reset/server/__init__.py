@@ -1,25 +1,63 @@
+import collections
+import hashlib
+import hmac
+import logging
 import math
 import random
-import traceback
+import secrets
+import time
 
 import curio
 from curio import socket
 
-from ..proto import commands_pb2 as commands, events_pb2 as events, types_pb2 as types, Protocol
+from ..proto import commands_pb2 as commands, events_pb2 as events, types_pb2 as types, Protocol, events_envelope
 from .. import util
+from ..log import fields
 from . import game
+from .outbox import Outbox
+from .rules import ActionGroup, ActionTargetType
+from .snapshot import Snapshots
+
+
+logger = logging.getLogger(__name__)
 
 
 class Client:
-	def __init__(self):
+	transport = 'other'  # name of the transport in the metrics
+
+	def __init__(self, outbox=None):
 		self.player = None
+		self.server = None  # set by run
+		self.rules_hash = None  # of the RulesBundle the client got
+		self._queue = outbox if outbox is not None else Outbox()
 		self._task_group = curio.TaskGroup()
 
 	async def close(self):
-		raise NotImplementedError()
-
-	async def send(self, packet):
-		raise NotImplementedError()
+		await self._task_group.cancel_remaining()
+
+	async def send(self, message):
+		'''Send a message or a reset.proto.Packet to the client. Never blocks,
+		see Outbox for what happens if the client doesn't keep up.'''
+		await self._queue.put(events_envelope.packet(message))
+
+	async def _next_packets(self, max_count=1, max_latency=0.0):
+		'''Wait for packets to send. If the outbox overflowed, this returns the
+		current state instead of the dropped packets, or raises
+		ConnectionResetError if the client is to be disconnected.'''
+		packets = []
+		for item in await util.get_batch(self._queue, max_count, max_latency):
+			if item is Outbox.DISCONNECT:
+				logger.warning("Client can't keep up, disconnecting", extra=fields(client=str(self)))
+				raise ConnectionResetError()
+			elif item is Outbox.RESYNC:
+				logger.warning("Client can't keep up, resyncing", extra=fields(client=str(self)))
+				packets.extend(events_envelope.packet(message) for message in self.server.protocol.resync(self.server, self))
+			else:
+				packets.append(item)
+		return packets
+
+	def outbox_stats(self):
+		return self._queue.stats()
 
 	async def watch_player(self, player):
 		for resource_type, resource_value in player.resources.items():
@@ -31,11 +69,18 @@ class Client:
 
 
 class Server:
-	def __init__(self, protocol):
+	def __init__(self, protocol, outbox_size=4096, outbox_policy='coalesce'):
 		self.protocol = protocol
 		self.clients = set()
+		self.outbox_size = outbox_size
+		self.outbox_policy = outbox_policy
+		self.metrics = None  # a metrics.Metrics, if they are collected
 		self._protocol_task = None
 
+	def outbox(self):
+		'''Create the outbound queue for a new client.'''
+		return Outbox(self.outbox_size, self.outbox_policy)
+
 	async def add_client(self, client):
 		self.clients.add(client)
 
@@ -56,17 +101,97 @@ class Server:
 			self._protocol_task = await curio.spawn(self.protocol.run(self))
 
 	async def handle(self, client, message):
-		await self.protocol.handle(self, client, message)
+		'''Handle a message from a client with the current protocol.'''
+		if self.metrics is None:
+			return await self.protocol.handle(self, client, message)
+		start = time.perf_counter()
+		try:
+			return await self.protocol.handle(self, client, message)
+		finally:
+			self.metrics.command_handled(type(message).__name__, time.perf_counter() - start)
 
 	async def broadcast(self, message):
+		packet = events_envelope.packet(message)  # shared by all clients, so it is only encoded once
 		for client in self.clients:
-			await client.send(message)
+			await client.send(packet)
+
+	def outbox_stats(self):
+		return {str(client): client.outbox_stats() for client in self.clients}
+
+
+def rules_events(rules):
+	'''Yield the Info* messages describing the rules.'''
+	for terrain_type in rules.terrain_types:
+		info = events.InfoTerrainType()
+		info.terrain_type_id = terrain_type.id
+		info.terrain_type.name = terrain_type.name
+		info.terrain_type.description = terrain_type.description
+		info.terrain_type.tags[:] = terrain_type.tags
+		yield info
+	for resource_type in rules.resource_types:
+		info = events.InfoResourceType()
+		info.resource_type_id = resource_type.id
+		info.resource_type.name = resource_type.name
+		info.resource_type.description = resource_type.description
+		yield info
+	for unit_type in rules.unit_types:
+		info = events.InfoUnitType()
+		info.unit_type_id = unit_type.id
+		info.unit_type.name = unit_type.name
+		info.unit_type.description = unit_type.description
+		info.unit_type.default_action_type_id = unit_type.default_action_type.id if unit_type.default_action_type is not None else 0
+		info.unit_type.tags[:] = unit_type.tags
+		yield info
+	for action_type in rules.action_types:
+		info = events.InfoActionType()
+		info.action_type_id = action_type.id
+		info.action_type.name = action_type.name
+		info.action_type.description = action_type.description
+		info.action_type.unit_type_id = action_type.unit_type.id
+		for res, value in action_type.cost.items():
+			res_cost = info.action_type.cost.add()
+			res_cost.resource_type_id = res.id
+			res_cost.amount = value
+		info.action_type.duration = action_type.duration
+		info.action_type.default_mode = action_type.default_mode.value
+		info.action_type.target_type = action_type.target_type.value
+		info.action_type.target_tags[:] = action_type.target_tags
+		yield info
+
+
+class RulesBundle:
+	'''The rules as a single InfoRules message, which is built and encoded
+	only once. Clients that already have rules with the same hash (from an
+	earlier game, say) get just the hash.'''
+	def __init__(self, rules):
+		bundle = events.RulesBundle()
+		for info in rules_events(rules):
+			if isinstance(info, events.InfoTerrainType):
+				bundle.terrain_types.add().CopyFrom(info)
+			elif isinstance(info, events.InfoResourceType):
+				bundle.resource_types.add().CopyFrom(info)
+			elif isinstance(info, events.InfoUnitType):
+				bundle.unit_types.add().CopyFrom(info)
+			else:
+				bundle.action_types.add().CopyFrom(info)
+		self.hash = hashlib.sha256(bundle.SerializeToString(deterministic=True)).digest()
+		self.full = events_envelope.packet(events.InfoRules(hash=self.hash, bundle=bundle))
+		self.unchanged = events_envelope.packet(events.InfoRules(hash=self.hash))
+
+	async def send(self, client, rules_hash=None):
+		'''Send the rules to a client unless it got them already.
+		rules_hash is the hash of the rules the client says it has.'''
+		if client.rules_hash == self.hash:
+			return
+		await client.send(self.unchanged if rules_hash == self.hash else self.full)
+		client.rules_hash = self.hash
 
 
 class ProtocolPreGame(Protocol):
 	def __init__(self, rules, generator):
 		super(ProtocolPreGame, self).__init__()
 		self.rules = rules
+		self.rules_bundle = RulesBundle(rules)
 		self.generator = generator
 		self.players = util.IdList(game.Player)
 
@@ -77,93 +202,78 @@ class ProtocolPreGame(Protocol):
 		try:
 			return await super(ProtocolPreGame, self).handle(server, client, message)
 		except game.GameError as e:
-			await client.send(events.Error(error=e.message))
+			await client.send(events.Error(error=e.message, command=message.DESCRIPTOR.name))
 
 	@Protocol.handler(commands.CmdJoin)
 	async def on_command_join(self, server, client, message):
 		if client.player is None:
 			client.player = self.players.create(message.name, client)
 			client.player.resources = {resource_type: game.Value(resource_type.start_value) for resource_type in self.rules.resource_types}
+			client.player.token = secrets.token_bytes(16)
+			await self.rules_bundle.send(client, message.rules_hash)
 			await server.broadcast(events.EventPlayerJoin(player_id=client.player.id, name=client.player.name))
-			print(f"Player joined: {client.player.name!r}")
+			await client.send(events.EventReconnectToken(player_id=client.player.id, token=client.player.token))
+			logger.info("Player joined", extra=fields(player=client.player.name, client=str(client)))
 		else:
-			await client.send(events.Error(error="You already joined; I'm ignoring this second CmdJoin."))
+			await client.send(events.Error(error="You already joined; I'm ignoring this second CmdJoin.", command="CmdJoin"))
 
 	@Protocol.handler(commands.CmdLeave)
 	async def on_command_leave(self, server, client, message):
 		if client.player is not None:
 			self.players.destroy(client.player)
-			print(f"Player left: {client.player.name!r}")
+			logger.info("Player left", extra=fields(player=client.player.name))
 			client.player = None
 		else:
-			await client.send(events.Error(error="You haven't joined; I'm ignoring this CmdLeave."))
+			await client.send(events.Error(error="You haven't joined; I'm ignoring this CmdLeave.", command="CmdLeave"))
+
+	async def on_disconnect(self, server, client):
+		if client.player is not None:  # nothing to reconnect to yet
+			await self.on_command_leave(server, client, None)
 
 	@Protocol.handler(commands.CmdGameStart)
 	async def on_command_game_start(self, server, client, message):
-		await self._send_rules(server, self.rules)
+		for other in server.clients:  # the ones that didn't join
+			await self.rules_bundle.send(other)
 		map = await self.generator.generate(self.players)
-		await server.set_protocol(ProtocolGame(self.rules, map))
-		print("Starting game")
+		await server.set_protocol(ProtocolGame(self.rules, map, self.rules_bundle))
+		logger.info("Starting game", extra=fields(players=len(map.players)))
 		for player in map.players:
 			await player.client.watch_player(player)
+			if isinstance(map, game.ChunkedMap):
+				await server.protocol.send_surroundings(player)
 		await server.broadcast(events.EventGameStart())
 
-	async def _send_rules(self, server, rules):
-		for terrain_type in rules.terrain_types:
-			info = events.InfoTerrainType()
-			info.terrain_type_id = terrain_type.id
-			info.terrain_type.name = terrain_type.name
-			info.terrain_type.description = terrain_type.description
-			info.terrain_type.tags[:] = terrain_type.tags
-			await server.broadcast(info)
-		for resource_type in rules.resource_types:
-			info = events.InfoResourceType()
-			info.resource_type_id = resource_type.id
-			info.resource_type.name = resource_type.name
-			info.resource_type.description = resource_type.description
-			await server.broadcast(info)
-		for unit_type in rules.unit_types:
-			info = events.InfoUnitType()
-			info.unit_type_id = unit_type.id
-			info.unit_type.name = unit_type.name
-			info.unit_type.description = unit_type.description
-			info.unit_type.default_action_type_id = unit_type.default_action_type.id if unit_type.default_action_type is not None else 0
-			info.unit_type.tags[:] = unit_type.tags
-			await server.broadcast(info)
-		for action_type in rules.action_types:
-			info = events.InfoActionType()
-			info.action_type_id = action_type.id
-			info.action_type.name = action_type.name
-			info.action_type.description = action_type.description
-			info.action_type.unit_type_id = action_type.unit_type.id
-			for res, value in action_type.cost.items():
-				res_cost = info.action_type.cost.add()
-				res_cost.resource_type_id = res.id
-				res_cost.amount = value
-			info.action_type.duration = action_type.duration
-			info.action_type.default_mode = action_type.default_mode.value
-			info.action_type.target_type = action_type.target_type.value
-			info.action_type.target_tags[:] = action_type.target_tags
-			await server.broadcast(info)
+	def resync(self, server, client):
+		return [events.EventPlayerJoin(player_id=player.id, name=player.name) for player in self.players]
 
 
 class ProtocolGame(Protocol):
-	def __init__(self, rules, map):
+	MAX_REGION_AREA = 128 * 128  # largest map region a client may request at once
+	SURROUNDINGS = 32  # how far around its units a player gets to see the map at game start
+
+	def __init__(self, rules, map, rules_bundle=None):
 		super(ProtocolGame, self).__init__()
 		self.rules = rules
+		self.rules_bundle = rules_bundle if rules_bundle is not None else RulesBundle(rules)
 		self.map = map
+		self.snapshots = Snapshots(map, surroundings=self.SURROUNDINGS)
 
 	async def run(self, server):
 		while True:
 			event = await self.map.events.get()
 			handler = self.get_handler(event[0])
-			await handler(server, None, event[1:])
+			if server.metrics is None:
+				await handler(server, None, event[1:])
+			else:
+				start = time.perf_counter()
+				await handler(server, None, event[1:])
+				server.metrics.map_event_handled(event[0], time.perf_counter() - start, self.map.events.qsize())
 
 	async def handle(self, server, client, message):
 		try:
 			return await super(ProtocolGame, self).handle(server, client, message)
 		except game.GameError as e:
-			await client.send(events.Error(error=e.message))
+			await client.send(events.Error(error=e.message, command=message.DESCRIPTOR.name))
 
 	@Protocol.handler('MAP')
 	async def on_event_map(self, server, client, event):
@@ -174,6 +284,7 @@ class ProtocolGame(Protocol):
 	@Protocol.handler('MAP_CELL')
 	async def on_event_map_cell(self, server, client, event):
 		xy, terrain_type = event
+		self.snapshots.invalidate(xy)
 		event = events.EventMapGenerateCell(terrain_type_id=terrain_type.id)
 		event.position.x, event.position.y = xy
 		await server.broadcast(event)
@@ -181,12 +292,122 @@ class ProtocolGame(Protocol):
 	@Protocol.handler('UNIT_CREATE')
 	async def on_event_unit_create(self, server, client, event):
 		xy, unit = event
+		await server.broadcast(self._unit_create_event(xy, unit))
+
+	def _unit_create_event(self, xy, unit):
 		event = events.EventUnitCreate()
 		event.unit_id = unit.id
 		event.player_id = unit.player.id if unit.player else 0
 		event.unit_type_id = unit.unit_type.id
 		event.position.x, event.position.y = xy
-		await server.broadcast(event)
+		return event
+
+	def region_events(self, x, y, width, height):
+		'''Yield the terrain and units of a rectangular region of the map.'''
+		x0, y0 = max(x, 0), max(y, 0)
+		x1, y1 = min(x + width, self.map.width), min(y + height, self.map.height)
+		for cy in range(y0, y1):
+			for cx in range(x0, x1):
+				cell = self.map[cx, cy]
+				event = events.EventMapGenerateCell(terrain_type_id=cell.terrain_type.id if cell.terrain_type is not None else 0)
+				event.position.x, event.position.y = cx, cy
+				yield event
+				if cell.unit is not None:
+					yield self._unit_create_event((cx, cy), cell.unit)
+
+	def region_event(self, x, y, width, height):
+		'''Return an EventMapRegion with the terrain and units of a rectangular region of the map.'''
+		x0, y0 = max(x, 0), max(y, 0)
+		x1, y1 = min(x + width, self.map.width), min(y + height, self.map.height)
+		event = events.EventMapRegion()
+		event.chunk.position.x, event.chunk.position.y = x0, y0
+		event.chunk.width, event.chunk.height = max(x1 - x0, 0), max(y1 - y0, 0)
+		ids = []
+		for cy in range(y0, y1):
+			for cx in range(x0, x1):
+				cell = self.map[cx, cy]
+				ids.append(cell.terrain_type.id if cell.terrain_type is not None else 0)
+				if cell.unit is not None:
+					event.units.append(self._unit_create_event((cx, cy), cell.unit))
+		event.chunk.terrain_type_ids[:] = ids
+		return event
+
+	async def send_region(self, client, x, y, width, height):
+		'''Send the terrain and units of a rectangular region of the map to a client.'''
+		clipped_width = max(0, min(x + width, self.map.width) - max(x, 0))
+		clipped_height = max(0, min(y + height, self.map.height) - max(y, 0))
+		if clipped_width == 0 or clipped_height == 0:
+			raise game.GameError("The map region is empty or outside the map")
+		if clipped_width * clipped_height > self.MAX_REGION_AREA:
+			raise game.GameError(f"Map regions can be at most {self.MAX_REGION_AREA} cells large")
+		await client.send(self.region_event(x, y, width, height))
+
+	def surroundings_events(self, player):
+		'''Yield the terrain and units within SURROUNDINGS cells of the
+		player's units. Where the surroundings of units overlap, e.g. of a
+		city and its citizens, the cells are only sent once.'''
+		r = self.SURROUNDINGS
+		rows = collections.defaultdict(list)  # y -> [(x0, x1)], the surroundings of each unit
+		for unit in list(self.map.units):
+			if unit.player is player:
+				x, y = self.map.get_location(unit)
+				for cy in range(max(y - r, 0), min(y + r + 1, self.map.height)):
+					rows[cy].append((max(x - r, 0), min(x + r + 1, self.map.width)))
+		for cy in sorted(rows):
+			start = end = None
+			for x0, x1 in sorted(rows[cy]):
+				if end is not None and x0 <= end:
+					end = max(end, x1)
+					continue
+				if end is not None:
+					yield from self.region_events(start, cy, end - start, 1)
+				start, end = x0, x1
+			yield from self.region_events(start, cy, end - start, 1)
+
+	async def send_surroundings(self, player):
+		for event in self.surroundings_events(player):
+			await player.client.send(event)
+
+	def resync(self, server, client):
+		'''The rules (they may have been dropped too) and a snapshot of the game.'''
+		return [self.rules_bundle.full, self.snapshots.build(client.player)]
+
+	async def on_disconnect(self, server, client):
+		'''The player stays in the game and can come back with CmdReconnect.'''
+		player = client.player
+		if player is not None and player.client is client:
+			player.client = None
+			logger.info("Player disconnected", extra=fields(player=player.name))
+
+	async def send_snapshot(self, client, rules_hash=None):
+		await self.rules_bundle.send(client, rules_hash)
+		await client.send(self.snapshots.build(client.player))
+
+	@Protocol.handler(commands.CmdReconnect)
+	async def on_command_reconnect(self, server, client, message):
+		try:
+			player = self.map.players.get(message.player_id)
+		except KeyError:
+			player = None
+		if player is None or player.token is None or not hmac.compare_digest(player.token, message.token):
+			raise game.GameError("Unknown player or wrong token")
+		if client.player is not None:
+			raise game.GameError("You already are a player")
+		old = player.client
+		player.client = client
+		client.player = player
+		if old is not None:  # the old connection may be half-open
+			old.player = None
+			await old.close()
+		await client.watch_player(player)
+		await self.send_snapshot(client, message.rules_hash)
+		logger.info("Player reconnected", extra=fields(player=player.name, client=str(client)))
+
+	@Protocol.handler(commands.CmdSpectate)
+	async def on_command_spectate(self, server, client, message):
+		if client.player is not None:
+			raise game.GameError("Players can't spectate")
+		await self.send_snapshot(client, message.rules_hash)
 
 	@Protocol.handler('UNIT_MOVE')
 	async def on_event_unit_move(self, server, client, event):
@@ -201,12 +422,14 @@ class ProtocolGame(Protocol):
 		event = events.EventActionUpdate(action_id=action.id, state=state.value)
 		if msg is not None:
 			event.message = msg
-		await action.unit.player.client.send(event)
+		if action.unit.player.client is not None:
+			await action.unit.player.client.send(event)
 
 	@Protocol.handler('ACTION_DEQUEUE')
 	async def on_action_dequeue(self, server, client, event):
 		action, = event
-		await action.unit.player.client.send(events.EventActionDequeued(action_id=action.id))
+		if action.unit.player.client is not None:
+			await action.unit.player.client.send(events.EventActionDequeued(action_id=action.id))
 
 	@Protocol.handler(commands.CmdLeave)
 	async def on_command_leave(self, server, client, message):
@@ -215,33 +438,77 @@ class ProtocolGame(Protocol):
 		for unit in self.map.units:
 			self.map.reposess(unit, 0)
 
-	@Protocol.handler(commands.CmdActionQueue)
-	async def on_command_action_queue(self, server, client, message):
-		action_type = self.rules.action_types.get(message.action_type_id)
-		unit = self.map.units.get(message.unit_id)
-		target_unit = None if not message.HasField("target_unit_id") else self.map.units.get(message.target_unit_id)
-		target_cell = None if not message.HasField("target_cell") else (message.target_cell.x, message.target_cell.y)
+	def _get_unit(self, unit_id):
+		try:
+			return self.map.units.get(unit_id)
+		except KeyError:
+			raise game.GameError(f"There is no unit {unit_id}")
 
-		if unit.player != client.player:
-			raise game.GameError("You're not allowed to manage that unit")
-		if action_type.unit_type != unit.unit_type:
-			raise game.GameError("This action type cannot be performed by this unit.")
+	def _check_target(self, action_type, message):
+		'''Resolve and check the target of a CmdActionQueue(Many), which is the same for all units.'''
+		target_unit = None if not message.HasField("target_unit_id") else self._get_unit(message.target_unit_id)
+		target_cell = None if not message.HasField("target_cell") else (message.target_cell.x, message.target_cell.y)
 		if target_unit is not None:
-			if action_type.target_type != rules.ActionTargetType.UNIT:
+			if action_type.target_type != ActionTargetType.UNIT:
 				raise game.GameError("This action does not work on units")
-			if not action_type.target_tags <= target_unit.tags:
+			if not action_type.target_tags <= target_unit.unit_type.tags:
 				raise game.GameError("Target unit does not have the necessary tags")
 		if target_cell is not None:
-			if action_type.target_type != rules.ActionTargetType.CELL:
+			if action_type.target_type != ActionTargetType.CELL:
 				raise game.GameError("This action does not work on cells")
 			if not (0 <= target_cell[0] < self.map.width and 0 <= target_cell[1] < self.map.height):
 				raise game.GameError("Target cell is not inside the map")
 			if not action_type.target_tags <= self.map[target_cell].terrain_type.tags:
 				raise game.GameError("Target cell does not have the necessary tags")
+		return target_unit, target_cell
+
+	def _check_unit(self, client, action_type, unit):
+		if unit.player != client.player:
+			raise game.GameError("You're not allowed to manage that unit")
+		if action_type.unit_type != unit.unit_type:
+			raise game.GameError("This action type cannot be performed by this unit.")
+
+	def _get_action_type(self, action_type_id):
+		try:
+			return self.rules.action_types.get(action_type_id)
+		except KeyError:
+			raise game.GameError(f"There is no action type {action_type_id}")
+
+	@Protocol.handler(commands.CmdActionQueue)
+	async def on_command_action_queue(self, server, client, message):
+		action_type = self._get_action_type(message.action_type_id)
+		unit = self._get_unit(message.unit_id)
+		self._check_unit(client, action_type, unit)
+		target_unit, target_cell = self._check_target(action_type, message)
 
 		action = await self.map.action_queue(action_type, unit, message.mode, target_unit, target_cell)
 		await client.send(events.EventActionQueued(action_id=action.id, unit_id=action.unit.id))
 
+	@Protocol.handler(commands.CmdActionQueueMany)
+	async def on_command_action_queue_many(self, server, client, message):
+		action_type = self._get_action_type(message.action_type_id)
+		target_unit, target_cell = self._check_target(action_type, message)
+
+		reply = events.EventActionsQueued()
+		group = ActionGroup()
+		for unit_id in dict.fromkeys(message.unit_ids):  # without duplicates, in order
+			try:
+				unit = self._get_unit(unit_id)
+				self._check_unit(client, action_type, unit)
+			except game.GameError as e:
+				reply.rejected_unit_ids.append(unit_id)
+				if not reply.HasField("error"):
+					reply.error = e.message
+				continue
+			action = await self.map.action_queue(action_type, unit, message.mode, target_unit, target_cell, group)
+			reply.action_ids.append(action.id)
+			reply.unit_ids.append(unit.id)
+		await client.send(reply)
+
+	@Protocol.handler(commands.CmdMapRequest)
+	async def on_command_map_request(self, server, client, message):
+		await self.send_region(client, message.x, message.y, message.width, message.height)
+
 	@Protocol.handler(commands.CmdActionCancel)
 	async def on_command_action_cancel(self, server, client, message):
 		pass 
@@ -1,15 +1,27 @@
 #!/usr/bin/python3
 
+import argparse
+import logging
+import os
+import sys
+
 import curio
 
-from . import ProtocolPreGame, Server
+from . import ProtocolPreGame, Server, outbox
 from .rules import *
 from .generator import *
-from .game import Payment
+from .game import Payment, profile_label
+from .mapcache import MapCache
+from .metrics import Metrics, metrics_server
+from . import trace
+from ..log import BatchFileHandler, BatchStreamHandler, SampleFilter, StructuredFormatter, fields
+from ..profiler import install_signal_toggle
 from .pathfinder import PathFinder
-from .tcp_server import tcp_server
+from .tcp_server import tcp_server, unix_server
 from .ws_server import ws_server
 
+logger = logging.getLogger("reset.server.__main__")  # not __main__, so --log-level applies the same way
+
 rules = Rules()
 
 terrain_grass = rules.terrain_types.create("grass", "Grass", {"walk", "build"})
@@ -36,7 +48,13 @@ def action_farm(farm_resources):
 async def execute_move_towards(map, action):
 	pathfinder = PathFinder(map)
 	start_pos = map.get_location(action.unit)
-	steps = pathfinder.plan(start_pos, action.target_cell)
+	steps = None
+	if action.group is not None and len(action.group.actions) > 1:  # units moving together share one search
+		flow_field = await action.group.shared_async('flow_field', lambda: pathfinder.flow_field_async(
+			action.target_cell, [map.get_location(a.unit) for a in action.group.actions]))
+		steps = flow_field.path(start_pos)
+	if steps is None:
+		steps = await pathfinder.plan_async(start_pos, action.target_cell)
 	for step in steps:
 		await curio.sleep(action.action_type.duration)
 		timeout = 3
@@ -45,7 +63,7 @@ async def execute_move_towards(map, action):
 			timeout -= 1
 		if timeout == 0:
 			# give up on finding a path
-			print(map)
+			logger.debug("Move blocked", extra=fields(unit=action.unit.id, cell=str(step), target=str(action.target_cell)))
 			return
 		await map.move_unit(action.unit, step)
 
@@ -74,11 +92,75 @@ player_bases = gen.add_pass(PlayerBasePass())
 player_bases.add_hook(hook_player_unit(unit_city))
 
 async def main():
+	ap = argparse.ArgumentParser()
+	ap.add_argument("--seed", type=int, default=None, help="generate the same map every game")
+	ap.add_argument("--map-cache", default=None, help="directory for caching generated maps (requires --seed)")
+	ap.add_argument("--map-cache-size", type=int, default=32, help="maximum size of the map cache in MiB")
+	ap.add_argument("--chunk-size", type=int, default=None, help="generate the map in tiles of this size using all cores")
+	ap.add_argument("--generator-workers", type=int, default=None, help="with --chunk-size, use this many processes instead of one per core")
+	ap.add_argument("--world-size", type=int, default=None, help="play on a huge map of this size that is generated lazily as it is explored")
+	ap.add_argument("--world-chunk-size", type=int, default=64)
+	ap.add_argument("--world-resident-chunks", type=int, default=256, help="how many chunks to keep unpacked in memory")
+	ap.add_argument("--tcp-max-batch", type=int, default=64, help="maximum number of messages written to a TCP client at once")
+	ap.add_argument("--tcp-max-latency", type=float, default=0.0, help="seconds to wait for more messages before writing to a TCP client")
+	ap.add_argument("--send-queue-size", type=int, default=4096, help="maximum number of messages queued for a client")
+	ap.add_argument("--send-queue-policy", choices=outbox.POLICIES, default=outbox.COALESCE, help="what to do when a client's queue is full")
+	ap.add_argument("--unix-socket", default=None, help="also accept clients on a Unix domain socket at this path")
+	ap.add_argument("--tcp-no-batch", action='store_true', help="send every message to TCP clients in its own frame")
+	ap.add_argument("--ws-batch", action='store_true', help="send messages that are queued at the same time to WebSocket clients as one EventBatch")
+	ap.add_argument("--ws-deflate", action='store_true', help="compress WebSocket messages if the client supports it")
+	ap.add_argument("--ws-deflate-level", type=int, default=6)
+	ap.add_argument("--ws-deflate-threshold", type=int, default=64, help="send smaller messages uncompressed")
+	ap.add_argument("--ws-deflate-no-context-takeover", action='store_true', help="compress every message on its own, using less memory per client")
+	ap.add_argument("--metrics-port", type=int, default=None, help="collect metrics and serve them as plain text on http://127.0.0.1:PORT/")
+	ap.add_argument("--trace", action='store_true', help="record how long actions and path finding take, by action type, in the metrics")
+	ap.add_argument("--profile-dir", default=".", help="where to write the profiles started and stopped with kill -USR1")
+	ap.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO")
+	ap.add_argument("--log-file", default=None, help="log to this file instead of stdout")
+	ap.add_argument("--log-json", action='store_true', help="log one JSON object per line")
+	ap.add_argument("--log-sample", type=int, nargs=2, metavar=("INITIAL", "THEREAFTER"), default=(50, 100), help="per second, log the first INITIAL records with the same message and then every THEREAFTER-th")
+	args = ap.parse_args()
+	if args.trace and args.metrics_port is None:
+		ap.error("--trace needs --metrics-port")
+	if args.map_cache is not None and args.seed is None:
+		ap.error("--map-cache needs --seed")
+	if args.map_cache is not None and args.world_size is not None:
+		ap.error("--map-cache doesn't work with --world-size, worlds are generated as they are explored")
+
+	handler = BatchFileHandler(args.log_file) if args.log_file is not None else BatchStreamHandler(sys.stdout)
+	handler.setFormatter(StructuredFormatter(args.log_json))
+	handler.addFilter(SampleFilter(*args.log_sample))
+	logging.basicConfig(level=args.log_level, handlers=[handler])
+
+	gen.seed = args.seed
+	gen.chunk_size = args.chunk_size
+	gen.workers = args.generator_workers
+	gen.world_size = args.world_size
+	gen.world_chunk_size = args.world_chunk_size
+	gen.world_resident_chunks = args.world_resident_chunks
+	if args.map_cache is not None:
+		gen.cache = MapCache(args.map_cache, rules, args.map_cache_size * 1024 * 1024)
+
+	install_signal_toggle(args.profile_dir, profile_label)
+	logger.info("Send SIGUSR1 to start and stop profiling", extra=fields(pid=os.getpid()))
+
 	protocol = ProtocolPreGame(rules, gen)
-	server = Server(protocol)
+	server = Server(protocol, args.send_queue_size, args.send_queue_policy)
 	async with curio.TaskGroup() as g:
-		await g.spawn(tcp_server(server, '0.0.0.0', 1337))
-		await g.spawn(ws_server(server, '0.0.0.0', 8080))
+		if args.metrics_port is not None:
+			server.metrics = Metrics()
+			if args.trace:
+				trace.enable()
+				server.metrics.sources.append(trace.lines)
+			await g.spawn(server.metrics.heartbeat())
+			await g.spawn(metrics_server(server, '127.0.0.1', args.metrics_port))
+		await g.spawn(tcp_server(server, '0.0.0.0', 1337, args.tcp_max_batch, args.tcp_max_latency, not args.tcp_no_batch))
+		if args.unix_socket is not None:
+			await g.spawn(unix_server(server, args.unix_socket, args.tcp_max_batch, args.tcp_max_latency, not args.tcp_no_batch))
+		deflate = None
+		if args.ws_deflate:
+			deflate = {'level': args.ws_deflate_level, 'threshold': args.ws_deflate_threshold, 'context_takeover': not args.ws_deflate_no_context_takeover}
+		await g.spawn(ws_server(server, '0.0.0.0', 8080, deflate, args.ws_batch))
 		await g.spawn(server.run())
 
 
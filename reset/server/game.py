@@ -1,13 +1,21 @@
+import array
+import collections
+import contextlib
 import enum
 import itertools
-import traceback
+import logging
+import zlib
 
 import curio
 
-from . import util
+from ..log import fields
+from . import trace, util
 from .rules import *
 
 
+logger = logging.getLogger(__name__)
+
+
 class GameError(Exception):
 	def __init__(self, message):
 		self.message = message
@@ -51,7 +59,8 @@ class Player:
 	def __init__(self, id, name, client):
 		self.id = id
 		self.name = name
-		self.client = client
+		self.client = client  # None while the player is disconnected
+		self.token = None  # to reconnect as this player
 		self.resources = {}
 
 	async def wait_resources(self, resources):
@@ -123,43 +132,51 @@ class Unit:
 		self._action_tasks = {}
 
 	async def _process(self, action):
-		try:
-			state = ActionState.QUEUED
-			async def put_state(st, msg=None):
-				nonlocal state
-				state = st
-				await self.map.events.put(('ACTION_UPDATE', action, st, msg))
-			while True:
-				async with self._semaphore:  # Wait for our turn...
-					try:
-						await put_state(ActionState.WORKING)
-						await action.action_type.executor(self.map, action)  # Do the work (e.g. deduct resources, delay for duration)
-						await put_state(ActionState.COMPLETE)
-					except ResourceError as err:
-						await put_state(ActionState.WAIT, f"Action {action.id} ({action.action_type.name}) is waiting: {err.message}")
-					except ActionError as err:
-						await put_state(err.state, err.message)
-					except curio.TaskCancelled:
-						await put_state(ActionState.CANCELLED)
-					except:
-						traceback.print_exc()
-						await put_state(ActionState.FAILED, "Unknown error, check the server logs")
-						return
-				if state == ActionState.WAIT:
-					await action.unit.player.wait_resources(action.action_type.cost) # Wait for resources
-				elif state == ActionState.FAILED:
-					return # It's a permanent fail, so it's over
-				elif state == ActionState.COMPLETE:
-					if action.mode == ActionMode.REPEAT:
-						await put_state(ActionState.QUEUED)
-					else:
-						return
-		finally:
-			await self.map.events.put(('ACTION_DEQUEUE', action))
+		with trace.span('process', action.action_type.name):  # from queueing to dequeueing
+			try:
+				state = ActionState.QUEUED
+				async def put_state(st, msg=None):
+					nonlocal state
+					state = st
+					action.state = st
+					await self.map.events.put(('ACTION_UPDATE', action, st, msg))
+				while True:
+					async with self._semaphore:  # Wait for our turn...
+						try:
+							await put_state(ActionState.WORKING)
+							with trace.span('execute', action.action_type.name):
+								await action.action_type.executor(self.map, action)  # Do the work (e.g. deduct resources, delay for duration)
+							await put_state(ActionState.COMPLETE)
+						except ResourceError as err:
+							await put_state(ActionState.WAIT, f"Action {action.id} ({action.action_type.name}) is waiting: {err.message}")
+						except ActionError as err:
+							await put_state(err.state, err.message)
+						except curio.TaskCancelled:
+							await put_state(ActionState.CANCELLED)
+						except:
+							logger.exception("Action failed", extra=fields(action=action.id, action_type=action.action_type.name, unit=self.id))
+							await put_state(ActionState.FAILED, "Unknown error, check the server logs")
+							return
+					if state == ActionState.WAIT:
+						await action.unit.player.wait_resources(action.action_type.cost) # Wait for resources
+					elif state == ActionState.FAILED:
+						return # It's a permanent fail, so it's over
+					elif state == ActionState.COMPLETE:
+						if action.mode == ActionMode.REPEAT:
+							await put_state(ActionState.QUEUED)
+						else:
+							return
+			finally:
+				self._action_tasks.pop(action.id, None)
+				await self.map.events.put(('ACTION_DEQUEUE', action))
 
 	async def queue_action(self, action):
 		self._action_tasks[action.id] = await self._task_group.spawn(self._process(action))
 
+	@property
+	def queued_actions(self):
+		return [self.map.actions.get(action_id) for action_id in self._action_tasks]
+
 	async def cancel_action(self, action_or_id):
 		action = self.map.actions.resolve(action_or_id)
 		task = self._action_tasks.pop(action.id)
@@ -173,6 +190,15 @@ class Unit:
 		return str(self.unit_type)
 
 
+def profile_label(frame):
+	'''For a SamplingProfiler: label the frames of action tasks with their action type.'''
+	if frame.f_code is Unit._process.__code__:
+		action = frame.f_locals.get('action')
+		if action is not None:
+			return action.action_type.name
+	return None
+
+
 class Cell:
 	def __init__(self, terrain_type, unit=None):
 		self.terrain_type = terrain_type
@@ -183,17 +209,28 @@ class Cell:
 
 
 class Map:
+	path_search_limit = None  # maximum number of cells a PathFinder may visit, None means no limit
+
 	def __init__(self, players, width, height):
 		self.width = width
 		self.height = height
-		self.cells = [Cell(None) for i in range(width * height)]
+		self.cells = self._create_cells()
 
 		self.players = players  # already a util.IdList(Player)
 		self.units = util.IdList(Unit)
 		self.actions = util.IdList(Action)
+		self._locations = {}  # unit -> xy
 
 		self.events = curio.Queue()
 
+	def _create_cells(self):
+		return [Cell(None) for i in range(self.width * self.height)]
+
+	@contextlib.contextmanager
+	def pinned(self):
+		'''Keep the cells that are accessed in the with block in memory until it ends, see ChunkedMap.'''
+		yield
+
 	def __getitem__(self, xy):
 		x, y = xy
 		if not (0 <= x < self.width) or not (0 <= y < self.height):
@@ -213,18 +250,25 @@ class Map:
 		) + "}"
 
 	def get_location(self, unit):
-		for i, c in enumerate(self.cells):
-			if c.unit == unit:
-				return i % self.width, i // self.width
+		return self._locations.get(unit)
+
+	def action_task_count(self):
+		'''The number of queued actions, i.e. of running action tasks.'''
+		return sum(len(unit._action_tasks) for unit in self.units)
 
 	async def set_terrain(self, xy, terrain_type):
 		self[xy].terrain_type = terrain_type
 		await self.events.put(('MAP_CELL', xy, terrain_type))
 
-	async def create_unit(self, xy, unit_type, player):
+	def spawn_unit(self, xy, unit_type, player):
+		'''Create a unit without telling anyone, e.g. while generating a chunk of the map.'''
 		unit = self.units.create(unit_type, self, player)
-		cell = self[xy]
-		cell.unit = unit
+		self[xy].unit = unit
+		self._locations[unit] = xy
+		return unit
+
+	async def create_unit(self, xy, unit_type, player):
+		unit = self.spawn_unit(xy, unit_type, player)
 		await self.events.put(('UNIT_CREATE', xy, unit))
 		return unit
 
@@ -233,8 +277,10 @@ class Map:
 			if self[pos].unit is None:
 				return await self.create_unit(pos, unit_type, player)
 
-	async def action_queue(self, action_type, unit, mode, target_unit, target_cell):
-		action = self.actions.create(action_type, unit, mode, target_unit, target_cell)
+	async def action_queue(self, action_type, unit, mode, target_unit, target_cell, group=None):
+		action = self.actions.create(action_type, unit, mode, target_unit, target_cell, group)
+		if group is not None:
+			group.actions.append(action)
 		await unit.queue_action(action)
 		return action
 
@@ -249,9 +295,123 @@ class Map:
 			raise GameError("cells can only hold one unit")
 		cell.unit = unit
 		self[unit_pos].unit = None
+		self._locations[unit] = destination
 		await self.events.put(('UNIT_MOVE', unit, destination))
 
 
+class ChunkedMap(Map):
+	'''A map whose cells are generated chunk by chunk when they are first
+	accessed, e.g. by path finding, a moving unit or a client asking for a
+	region of the map.
+
+	Only the max_resident most recently used chunks are kept as Cell objects.
+	Colder chunks are packed into a compact byte string and unpacked when they
+	are accessed again. Units stay in the unit list as usual, so memory grows
+	with the explored area instead of the size of the map.
+
+	While the map is pinned, e.g. during a path search, chunks are not packed,
+	so that a search that touches more than max_resident chunks doesn't keep
+	packing and unpacking the chunks it walks through. They are packed when
+	the last pin is released.
+
+	generate(map, x0, y0, width, height) must fill in the given region using
+	map[xy] and map.spawn_unit; it must not touch cells outside the region.'''
+	path_search_limit = 64 * 64 * 4
+
+	def __init__(self, players, width, height, chunk_size, max_resident, generate):
+		self.chunk_size = chunk_size
+		self.max_resident = max(max_resident, 4)  # callers may hold on to cells of the last few chunks they touched
+		self._generate = generate
+		self._resident = collections.OrderedDict()  # (cx, cy) -> [Cell], least recently used first
+		self._cold = {}  # (cx, cy) -> packed chunk
+		self._terrain_types = {}  # id -> TerrainType, to unpack cold chunks
+		self._pins = 0
+		super(ChunkedMap, self).__init__(players, width, height)
+
+	def _create_cells(self):
+		return None
+
+	def __getitem__(self, xy):
+		x, y = xy
+		if not (0 <= x < self.width) or not (0 <= y < self.height):
+			raise LookupError("Coordinates are outside the map")
+		key = (x // self.chunk_size, y // self.chunk_size)
+		chunk = self._resident.get(key)
+		if chunk is None:
+			chunk = self._load_chunk(key)
+		else:
+			self._resident.move_to_end(key)
+		x0, y0, width, height = self._chunk_rect(key)
+		return chunk[(y - y0) * width + (x - x0)]
+
+	def __iter__(self):
+		for key, chunk in list(self._resident.items()):
+			x0, y0, width, height = self._chunk_rect(key)
+			for i, cell in enumerate(chunk):
+				yield (x0 + i % width, y0 + i // width), cell
+
+	def __str__(self):
+		return f"ChunkedMap({self.width}x{self.height}, {len(self._resident)} resident and {len(self._cold)} cold chunks)"
+
+	@property
+	def resident_chunks(self):
+		return len(self._resident)
+
+	@property
+	def cold_chunks(self):
+		return len(self._cold)
+
+	def _chunk_rect(self, key):
+		x0, y0 = key[0] * self.chunk_size, key[1] * self.chunk_size
+		return x0, y0, min(self.chunk_size, self.width - x0), min(self.chunk_size, self.height - y0)
+
+	def _load_chunk(self, key):
+		x0, y0, width, height = self._chunk_rect(key)
+		packed = self._cold.pop(key, None)
+		if packed is not None:
+			chunk = self._unpack(packed, width * height)
+		else:
+			chunk = [Cell(None) for i in range(width * height)]
+		self._resident[key] = chunk
+		if packed is None:
+			self._generate(self, x0, y0, width, height)
+		if not self._pins:
+			self._evict()
+		return chunk
+
+	def _evict(self):
+		while len(self._resident) > self.max_resident:
+			cold_key, cold_chunk = self._resident.popitem(last=False)
+			self._cold[cold_key] = self._pack(cold_chunk)
+
+	@contextlib.contextmanager
+	def pinned(self):
+		self._pins += 1
+		try:
+			yield
+		finally:
+			self._pins -= 1
+			if not self._pins:
+				self._evict()
+
+	def _pack(self, chunk):
+		terrain = array.array('H', [0]) * len(chunk)
+		units = array.array('L', [0]) * len(chunk)
+		for i, cell in enumerate(chunk):
+			if cell.terrain_type is not None:
+				self._terrain_types[cell.terrain_type.id] = cell.terrain_type
+				terrain[i] = cell.terrain_type.id
+			if cell.unit is not None:
+				units[i] = cell.unit.id
+		return zlib.compress(terrain.tobytes() + units.tobytes(), 1)
+
+	def _unpack(self, packed, size):
+		data = zlib.decompress(packed)
+		terrain = array.array('H', data[:2 * size])
+		units = array.array('L', data[2 * size:])  # native byte order, this never leaves the process
+		return [Cell(self._terrain_types[t] if t else None, self.units.get(u) if u else None) for t, u in zip(terrain, units)]
+
+
 
 def vicinity(xy, width, height):
 	'''Generate coordinates starting at xy and gradually moving further away
@@ -1,9 +1,24 @@
+import array
+import collections
+import functools
+import hashlib
+import itertools
+import logging
 import math
+import os
 import random
+import time
+import zlib
 
+import curio
 import noise
 
 from . import game
+from ..log import fields
+from .mapcache import MapLayers
+
+
+logger = logging.getLogger(__name__)
 
 
 MAP_AREA_PER_PLAYER = 20*20-1  # rounding will give us 21x21 otherwise
@@ -19,7 +34,55 @@ def gaussian_cdf(mu, sigma):
 	return f
 
 
+def noise_converter(distribution, period=None):
+	if distribution == 'uniform':
+		# mean and standard deviation of the noise; this is experimentally determined
+		# (the repeating noise of worlds has a narrower spread)
+		return gaussian_cdf(0.0, 0.4433703902714217 if period is None else 0.2970711246469040)
+	return lambda x: x
+
+
+NOISE_PERIOD = float(1 << 18)  # noise computes in single precision, so coordinates of worlds are folded into a range where it stays accurate
+
+
+def noise_at(x, y, noise_params, scalex, scaley, seed, period=None):
+	if period is None:
+		return noise.snoise2(x * scalex, y * scaley, base=seed, **noise_params)
+	# The noise repeats with the same period as the folding, so there is no seam where the coordinates wrap around.
+	return noise.snoise2(math.fmod(x * scalex, period), math.fmod(y * scaley, period),
+		repeatx=period, repeaty=period, base=seed, **noise_params)
+
+
+def noise_tile(noise_params, scale, distribution, seed, period, ranges, x0, y0, width, height):
+	'''Evaluate the noise for a rectangular tile of the map and decide which hooks fire.
+	Returns one bitmask per cell (column by column), bit i is set if v is in ranges[i].
+	period is None for regular maps and NOISE_PERIOD for worlds, see noise_at.
+	This only uses picklable arguments so it can run in a worker process.'''
+	convert = noise_converter(distribution, period)
+	scalex, scaley = scale
+	masks = array.array('Q', bytes(8 * width * height))
+	i = 0
+	for x in range(x0, x0 + width):
+		for y in range(y0, y0 + height):
+			v = convert(noise_at(x, y, noise_params, scalex, scaley, seed, period))
+			mask = 0
+			for bit, (min, max) in enumerate(ranges):
+				if min <= v < max:
+					mask |= 1 << bit
+			masks[i] = mask
+			i += 1
+	return masks
+
+
+def tiles(width, height, size):
+	for x0 in range(0, width, size):
+		for y0 in range(0, height, size):
+			yield x0, y0, min(size, width - x0), min(size, height - y0)
+
+
 class NoisePass:
+	cacheable = True
+
 	def __init__(self, params):
 		self._noise_params = {
 			'octaves': params.get('octaves', 1),
@@ -28,87 +91,400 @@ class NoisePass:
 		}
 		self._scalex = params.get('scale_x', 1.0)
 		self._scaley = params.get('scale_y', 1.0)
-		self._convert = lambda x: x
-		if params.get('distribution', None) == 'uniform':
-			self._convert = gaussian_cdf(0.0, 0.4433703902714217)  # mean and standard deviation of the noise; this is experimentally determined
+		self._distribution = params.get('distribution', None)
+		self._convert = noise_converter(self._distribution)
 		self._hooks = []
 
+	@property
+	def key(self):
+		return ('noise', sorted(self._noise_params.items()), self._scalex, self._scaley, self._distribution, [hook.key for hook in self._hooks])
+
 	def add_hook(self, hook):
 		self._hooks.append(hook)
 		return hook
 
-	async def generate(self, map):
+	async def generate(self, map, seed):
 		for x in range(map.width):
 			for y in range(map.height):
-				v = self._convert(noise.snoise2(x * self._scalex, y * self._scaley, **self._noise_params))
+				v = self._convert(noise_at(x, y, self._noise_params, self._scalex, self._scaley, seed))
 				for hook in self._hooks:
 					await hook(map, (x, y), v)
 
+	async def generate_chunked(self, map, seed, chunk_size, workers=None):
+		'''Same result as generate, but the noise and the hook decisions are
+		computed tile by tile in up to workers (by default one per core)
+		worker processes at a time. Only the hooks that fire are applied to
+		the map, here in the event loop, in tile order.'''
+		if len(self._hooks) > 64:
+			raise ValueError("chunked generation supports at most 64 hooks per pass")
+		workers = workers or os.cpu_count() or 1
+		ranges = [(hook.min, hook.max) for hook in self._hooks]
+		running = collections.deque()  # (tile, task), at most workers of them
+
+		async def apply_oldest():
+			(x0, y0, width, height), task = running.popleft()
+			masks = await task.join()
+			for xy, hook in self._fired_hooks(masks, x0, y0, height):
+				await hook.apply(map, xy)
+			await curio.sleep(0)  # let other tasks run between tiles
+
+		async with curio.TaskGroup() as g:
+			for tile in tiles(map.width, map.height, chunk_size):
+				if len(running) >= workers:
+					await apply_oldest()
+				running.append((tile, await g.spawn(curio.run_in_process, noise_tile,
+					self._noise_params, (self._scalex, self._scaley), self._distribution, seed, None, ranges, *tile)))
+			while running:
+				await apply_oldest()
+
+	def generate_region(self, map, seed, x0, y0, width, height):
+		'''Generate a region of a ChunkedMap synchronously and without sending events.'''
+		ranges = [(hook.min, hook.max) for hook in self._hooks]
+		masks = noise_tile(self._noise_params, (self._scalex, self._scaley), self._distribution, seed, NOISE_PERIOD, ranges, x0, y0, width, height)
+		for xy, hook in self._fired_hooks(masks, x0, y0, height):
+			hook.place(map, xy)
+
+	def _fired_hooks(self, masks, x0, y0, height):
+		for i, mask in enumerate(masks):
+			if not mask:
+				continue
+			xy = (x0 + i // height, y0 + i % height)
+			for bit, hook in enumerate(self._hooks):
+				if mask & (1 << bit):
+					yield xy, hook
+
 
 class PlayerBasePass:
-	def __init__(self):
+	'''Picks one base location per player and calls the hooks with it.
+
+	All the information needed for the placement is computed in a few linear
+	passes over the map (or, for a ChunkedMap, over a square in its center
+	that gives every player MAP_AREA_PER_PLAYER cells):
+	 - which cells are free and buildable,
+	 - which walkable area is the largest, so that all bases can reach each other,
+	 - how far each buildable cell is from anything unbuildable (clearance),
+	 - the nearest good candidate cell for every cell.
+	Every player gets a target point on an evenly spaced lattice; the base goes
+	to the candidate nearest to it, unless that is closer than `spacing` to an
+	earlier base, in which case we look further around the target point.'''
+	cacheable = False  # depends on the players, not just on the seed
+
+	def __init__(self, clearance=2):
+		self.clearance = clearance  # preferred distance of a base to the nearest unbuildable cell
+		self.timings = {}
 		self._hooks = []
 
+	@property
+	def key(self):
+		return ('player_base', self.clearance, [hook.key for hook in self._hooks])
+
 	def add_hook(self, hook):
 		self._hooks.append(hook)
 		return hook
 
-	async def generate(self, map):
-		for player in map.players:
-			center_x = map.width / 2
-			center_y = map.height / 2
-			phi = 2 * math.pi / len(map.players)
-			radius_x = center_x / math.sqrt(2)  # just so they don't end up right against the edge of the map
-			radius_y = center_y / math.sqrt(2)
-			for i, player in enumerate(map.players):
-				base_x = int(center_x + radius_x * math.cos(phi * i))
-				base_y = int(center_y + radius_y * math.sin(phi * i))
+	async def generate(self, map, seed):
+		start = time.perf_counter()
+		bases = self.place(map, len(map.players))
+		self.timings['placement'] = time.perf_counter() - start
+		for player, base in zip(map.players, bases):
 			for hook in self._hooks:
-				await hook(map, player, (base_x, base_y))
+				await hook(map, player, base)
+		self.timings['hooks'] = time.perf_counter() - start - self.timings['placement']
+
+	def place(self, map, count):
+		'''Return a list of count well separated base locations.'''
+		if count == 0:
+			return []
+		x0, y0, w, h = self._region(map, count)
+		# The fields are flat lists with a one cell wide border around the region,
+		# so that neighbours can be found by adding an offset without any bounds checks.
+		stride = w + 2
+		n = stride * (h + 2)
+		offsets = (-stride - 1, -stride, -stride + 1, -1, 1, stride - 1, stride, stride + 1)
+		buildable = [False] * n
+		walkable = [False] * n
+		for y in range(h):
+			for x in range(w):
+				cell = map[x0 + x, y0 + y]
+				tags = cell.terrain_type.tags if cell.terrain_type is not None else ()
+				unit_tags = cell.unit.unit_type.tags if cell.unit is not None else ()
+				i = (y + 1) * stride + x + 1
+				buildable[i] = 'build' in tags and cell.unit is None
+				walkable[i] = 'walk' in tags and 'resource' not in unit_tags and 'building' not in unit_tags
+
+		reachable = self._largest_component(walkable, offsets)
+		clearance = self._clearance(buildable, stride)
+		for good in (lambda i: reachable[i] and clearance[i] >= self.clearance, lambda i: reachable[i] and buildable[i], buildable.__getitem__):
+			candidates = [i for i in range(n) if good(i)]
+			if len(candidates) >= count:
+				break
+		else:
+			raise ValueError("No space to place player bases")
+		nearest = self._nearest(candidates, n, stride, offsets)
+		is_candidate = [False] * n
+		for i in candidates:
+			is_candidate[i] = True
+
+		cols = max(1, round(math.sqrt(count * w / h)))
+		rows = math.ceil(count / cols)
+		spacing = max(1, min(w / cols, h / rows) / 2)
+		bucket_size = math.ceil(spacing)
+		buckets = {}  # (bx, by) -> bases, to check the spacing without looking at all other bases
+
+		def far_enough(x, y):
+			bx, by = x // bucket_size, y // bucket_size
+			for nb in itertools.product((bx - 1, bx, bx + 1), (by - 1, by, by + 1)):
+				for ox, oy in buckets.get(nb, ()):
+					if math.hypot(ox - x, oy - y) < spacing:
+						return False
+			return True
+
+		def free(xy):
+			return is_candidate[(xy[1] + 1) * stride + xy[0] + 1] and xy not in taken
+
+		bases = []
+		taken = set()
+		for k in range(count):
+			tx = min(int((k % cols + 0.5) * w / cols), w - 1)
+			ty = min(int((k // cols + 0.5) * h / rows), h - 1)
+			i = nearest[(ty + 1) * stride + tx + 1]
+			base = (i % stride - 1, i // stride - 1)
+			if not far_enough(*base) or base in taken:
+				base = next((xy for xy in game.vicinity((tx, ty), w, h) if free(xy) and far_enough(*xy)), None)
+				if base is None:  # too crowded to keep the spacing, settle for any free candidate
+					base = next(xy for xy in game.vicinity((tx, ty), w, h) if free(xy))
+			taken.add(base)
+			buckets.setdefault((base[0] // bucket_size, base[1] // bucket_size), []).append(base)
+			bases.append(base)
+		return [(x0 + x, y0 + y) for x, y in bases]
+
+	def _region(self, map, count):
+		if not isinstance(map, game.ChunkedMap):
+			return 0, 0, map.width, map.height
+		size = int(math.sqrt(count * MAP_AREA_PER_PLAYER) + 1)
+		w, h = min(size, map.width), min(size, map.height)
+		return (map.width - w) // 2, (map.height - h) // 2, w, h
+
+	def _largest_component(self, walkable, offsets):
+		'''Mark the cells of the largest 8-connected walkable area.'''
+		component = [0] * len(walkable)
+		sizes = [0]
+		for start in range(len(walkable)):
+			if not walkable[start] or component[start]:
+				continue
+			label = len(sizes)
+			component[start] = label
+			queue = collections.deque([start])
+			size = 0
+			while queue:
+				i = queue.popleft()
+				size += 1
+				for o in offsets:
+					j = i + o
+					if walkable[j] and not component[j]:
+						component[j] = label
+						queue.append(j)
+			sizes.append(size)
+		largest = max(range(len(sizes)), key=sizes.__getitem__)
+		return [largest != 0 and c == largest for c in component]
+
+	def _clearance(self, buildable, stride):
+		'''Chebyshev distance of every cell to the nearest unbuildable cell, using two raster scans.
+		The border is unbuildable, so the distance to the edge of the region is included.'''
+		n = len(buildable)
+		d = [n if b else 0 for b in buildable]
+		for i in range(stride + 1, n - stride - 1):
+			if d[i]:
+				d[i] = min(d[i], d[i - 1] + 1, d[i - stride - 1] + 1, d[i - stride] + 1, d[i - stride + 1] + 1)
+		for i in range(n - stride - 2, stride, -1):
+			if d[i]:
+				d[i] = min(d[i], d[i + 1] + 1, d[i + stride - 1] + 1, d[i + stride] + 1, d[i + stride + 1] + 1)
+		return d
+
+	def _nearest(self, candidates, n, stride, offsets):
+		'''For every cell, find a candidate that is closest to it (breadth first search from all candidates at once).'''
+		nearest = [-1] * n
+		for i in range(stride):  # the border needs no answer
+			nearest[i] = nearest[n - 1 - i] = -2
+		for i in range(0, n, stride):
+			nearest[i] = nearest[i + stride - 1] = -2
+		queue = collections.deque(candidates)
+		for i in candidates:
+			nearest[i] = i
+		while queue:
+			i = queue.popleft()
+			for o in offsets:
+				j = i + o
+				if nearest[j] == -1:
+					nearest[j] = nearest[i]
+					queue.append(j)
+		return nearest
 
 
 class Generator:
-	def __init__(self):
+	'''Runs the generator passes to build a new map.
+
+	Cacheable passes only depend on the seed and the position of a cell. With
+	world_size set, they are not run up front: instead, each chunk of the
+	resulting ChunkedMap is generated by their generate_region method when it
+	is first accessed.
+
+	Passes that implement generate_chunked (e.g. NoisePass) can split the map
+	into tiles that are computed in a process pool; passes that need to see
+	the whole map (e.g. PlayerBasePass) simply run afterwards.
+
+	If a seed is given, the map only depends on the seed, the passes and the
+	number of players. The output of the cacheable passes (terrain and resource
+	layers) can then be stored in a MapCache and is loaded from there the next
+	time the same map is requested. Cacheable passes must come before all other
+	passes.'''
+	def __init__(self, seed=None, cache=None, chunk_size=None, workers=None, world_size=None, world_chunk_size=64, world_resident_chunks=256):
+		self.seed = seed
+		self.cache = cache
+		self.chunk_size = chunk_size  # if set, passes that support it generate the map in tiles of this size in parallel
+		self.workers = workers  # processes generating tiles at once, by default one per core
+		self.world_size = world_size  # if set, create a ChunkedMap of that size whose chunks are generated on demand
+		self.world_chunk_size = world_chunk_size
+		self.world_resident_chunks = world_resident_chunks
+		self.timings = {}  # pass name -> seconds it took during the last generate()
 		self._passes = []
 
 	def add_pass(self, pass_):
 		self._passes.append(pass_)
 		return pass_
 
+	def key(self, seed, player_count):
+		'''Stable identifier of the layers generated by the cacheable passes.'''
+		config = (seed, player_count, [pass_.key for pass_ in self._passes if pass_.cacheable])
+		return hashlib.sha1(repr(config).encode()).hexdigest()
+
+	def _generate_region(self, seed, map, x0, y0, width, height):
+		for i, pass_ in enumerate(self._passes):
+			if pass_.cacheable:
+				pass_.generate_region(map, self._pass_seed(seed, i), x0, y0, width, height)
+
+	def _pass_seed(self, seed, index):
+		# every pass gets a different offset, otherwise all noise passes would produce the same values
+		return zlib.crc32(f"{seed}/{index}".encode()) & 0xffff
+
 	async def generate(self, players):
 		width = height = int(math.sqrt(len(players) * MAP_AREA_PER_PLAYER) + 1)  # this gives each player roughly that much space
-		print(f"Generating map with dimensions {width}x{height}")
-		map = game.Map(players, width, height)
+		seed = self.seed if self.seed is not None else random.randrange(1 << 32)
+		lazy = self.world_size is not None
+		if lazy:
+			width = height = self.world_size
+			logger.info("Creating world", extra=fields(width=width, height=height, seed=seed))
+			map = game.ChunkedMap(players, width, height, self.world_chunk_size, self.world_resident_chunks, functools.partial(self._generate_region, seed))
+		else:
+			logger.info("Generating map", extra=fields(width=width, height=height, seed=seed))
+			map = game.Map(players, width, height)
 		await map.events.put(('MAP', map))
-		for pass_ in self._passes:
-			await pass_.generate(map)
+
+		key = None
+		layers = None
+		if self.cache is not None and self.seed is not None and not lazy:
+			key = self.key(seed, len(players))
+			layers = self.cache.load(key)
+		if layers is not None:
+			logger.info("Loaded map from cache", extra=fields(key=key))
+			await layers.apply(map, self.cache.rules)
+
+		self.timings = {}
+		for i, pass_ in enumerate(self._passes):
+			if (layers is not None or lazy) and pass_.cacheable:
+				continue  # already loaded from the cache, or generated chunk by chunk on demand
+			start = time.perf_counter()
+			if self.chunk_size is not None and hasattr(pass_, 'generate_chunked'):
+				await pass_.generate_chunked(map, self._pass_seed(seed, i), self.chunk_size, self.workers)
+			else:
+				await pass_.generate(map, self._pass_seed(seed, i))
+			name = f"{i}:{type(pass_).__name__}"
+			self.timings[name] = time.perf_counter() - start
+			for part, seconds in getattr(pass_, 'timings', {}).items():
+				self.timings[f"{name}.{part}"] = seconds
+
+		if key is not None and layers is None:
+			self.cache.store(key, MapLayers.capture(map))
+		logger.info("Generator timings in ms", extra=fields(**{name: round(seconds * 1000, 1) for name, seconds in self.timings.items()}))
 		return map
 
 
+class RangeHook:
+	'''A NoisePass hook that fires for noise values in [min, max).
+	Deciding whether the hook fires does not touch the map, which is what
+	allows NoisePass.generate_chunked to do it in another process.'''
+	def __init__(self, min, max):
+		self.min = min
+		self.max = max
+
+	@property
+	def key(self):
+		return (self.min, self.max)
+
+	async def __call__(self, map, xy, v):
+		if self.min <= v < self.max:
+			await self.apply(map, xy)
+
+	async def apply(self, map, xy):
+		raise NotImplementedError()
+
+	def place(self, map, xy):
+		'''Like apply, but without sending events (used for lazily generated chunks).'''
+		raise NotImplementedError()
+
+
+class TerrainHook(RangeHook):
+	def __init__(self, terrain_type, min, max):
+		super(TerrainHook, self).__init__(min, max)
+		self.terrain_type = terrain_type
+
+	@property
+	def key(self):
+		return ('terrain', self.terrain_type.id, self.terrain_type.name, self.min, self.max)
+
+	async def apply(self, map, xy):
+		await map.set_terrain(xy, self.terrain_type)
+
+	def place(self, map, xy):
+		map[xy].terrain_type = self.terrain_type
+
+
+class ResourceHook(RangeHook):
+	def __init__(self, unit_type, min, max, tags):
+		super(ResourceHook, self).__init__(min, max)
+		self.unit_type = unit_type
+		self.tags = tags
+
+	@property
+	def key(self):
+		return ('resource', self.unit_type.id, self.unit_type.name, self.min, self.max, sorted(self.tags))
+
+	async def apply(self, map, xy):
+		await map.create_unit(xy, self.unit_type, None)
+
+	def place(self, map, xy):
+		map.spawn_unit(xy, self.unit_type, None)
+
+
 def hook_terrain(terrain_type, min, max):
-	async def hook(map, xy, v):
-		if min <= v < max:
-			await map.set_terrain(xy, terrain_type)
-	return hook
+	return TerrainHook(terrain_type, min, max)
 
 
 def hook_resource(unit_type, min, max, tags):
-	async def hook(map, xy, v):
-		if min <= v < max:
-			await map.create_unit(xy, unit_type, None)
-	return hook
+	return ResourceHook(unit_type, min, max, tags)
 
 
 def hook_player_unit(unit_type, count=1):
 	async def hook(map, player, xy):
 		await map.create_unit(find_spot(map, xy, {"build"}), unit_type, player)
+	hook.key = ('player_unit', unit_type.id, unit_type.name, count)
 	return hook
 
 
 def find_spot(map, xy, tags):
 	for pos in game.vicinity(xy, map.width, map.height):
 		cell = map[pos]
-		if not tags <= cell.terrain_type.tags:
+		if cell.terrain_type is None or not tags <= cell.terrain_type.tags or cell.unit is not None:
 			continue
 		return pos
 	raise ValueError("No space to place unit")
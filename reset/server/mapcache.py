@@ -0,0 +1,110 @@
+import array
+import os
+import struct
+import sys
+import zlib
+
+
+class MapLayers:
+	'''The terrain and resource layers of a map, i.e. everything the cacheable
+	generator passes produce. Both layers store one type id per cell, 0 means
+	no terrain/no resource.'''
+	_HEADER = struct.Struct('<4sBHH')  # magic, version, width, height
+	_MAGIC = b'RMAP'
+	_VERSION = 1
+
+	def __init__(self, width, height, terrain, resources):
+		self.width = width
+		self.height = height
+		self.terrain = terrain  # array('H')
+		self.resources = resources  # array('H')
+
+	@classmethod
+	def capture(cls, map):
+		terrain = array.array('H', bytes(2 * map.width * map.height))
+		resources = array.array('H', terrain)
+		for i, cell in enumerate(map.cells):
+			if cell.terrain_type is not None:
+				terrain[i] = cell.terrain_type.id
+			if cell.unit is not None and cell.unit.player is None:
+				resources[i] = cell.unit.unit_type.id
+		return cls(map.width, map.height, terrain, resources)
+
+	async def apply(self, map, rules):
+		terrain_types = {terrain_type.id: terrain_type for terrain_type in rules.terrain_types}
+		unit_types = {unit_type.id: unit_type for unit_type in rules.unit_types}
+		for i in range(self.width * self.height):
+			xy = (i % self.width, i // self.width)
+			if self.terrain[i]:
+				await map.set_terrain(xy, terrain_types[self.terrain[i]])
+			if self.resources[i]:
+				await map.create_unit(xy, unit_types[self.resources[i]], None)
+
+	def pack(self):
+		terrain, resources = array.array('H', self.terrain), array.array('H', self.resources)
+		if sys.byteorder != 'little':
+			terrain.byteswap()
+			resources.byteswap()
+		header = self._HEADER.pack(self._MAGIC, self._VERSION, self.width, self.height)
+		return header + zlib.compress(terrain.tobytes() + resources.tobytes(), 9)
+
+	@classmethod
+	def unpack(cls, data):
+		magic, version, width, height = cls._HEADER.unpack_from(data)
+		if magic != cls._MAGIC or version != cls._VERSION:
+			raise ValueError("Not a map cache file")
+		body = zlib.decompress(data[cls._HEADER.size:])
+		size = width * height
+		if len(body) != 4 * size:
+			raise ValueError("Map cache file is truncated")
+		terrain, resources = array.array('H', body[:2 * size]), array.array('H', body[2 * size:])
+		if sys.byteorder != 'little':
+			terrain.byteswap()
+			resources.byteswap()
+		return cls(width, height, terrain, resources)
+
+
+class MapCache:
+	'''Stores MapLayers in a directory, one file per generator key.
+	If the files take up more than max_bytes, the least recently used ones are deleted.'''
+	def __init__(self, directory, rules, max_bytes=32 * 1024 * 1024):
+		self.directory = directory
+		self.rules = rules  # needed to turn the stored type ids back into types
+		self.max_bytes = max_bytes
+		os.makedirs(directory, exist_ok=True)
+
+	def _path(self, key):
+		return os.path.join(self.directory, f"{key}.rmap")
+
+	def load(self, key):
+		path = self._path(key)
+		try:
+			with open(path, 'rb') as f:
+				layers = MapLayers.unpack(f.read())
+		except FileNotFoundError:
+			return None
+		except (ValueError, zlib.error, struct.error):
+			os.remove(path)
+			return None
+		os.utime(path)  # mark as recently used
+		return layers
+
+	def store(self, key, layers):
+		path = self._path(key)
+		with open(path + '.tmp', 'wb') as f:
+			f.write(layers.pack())
+		os.replace(path + '.tmp', path)
+		self._evict()
+
+	def _evict(self):
+		entries = []
+		for entry in os.scandir(self.directory):
+			if entry.name.endswith('.rmap'):
+				stat = entry.stat()
+				entries.append((stat.st_mtime, stat.st_size, entry.path))
+		total = sum(size for _, size, _ in entries)
+		for _, size, path in sorted(entries):
+			if total <= self.max_bytes:
+				break
+			os.remove(path)
+			total -= size
@@ -0,0 +1,135 @@
+import bisect
+import collections
+import logging
+import time
+
+import curio
+
+from ..log import fields
+
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+	'''Counts of observed durations in buckets of at most BOUNDS[i] seconds, like a Prometheus histogram.'''
+	BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+	def __init__(self):
+		self.counts = [0] * (len(self.BOUNDS) + 1)  # the last bucket is for everything above the bounds
+		self.sum = 0.0
+		self.max = 0.0
+
+	def observe(self, seconds):
+		self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+		self.sum += seconds
+		if seconds > self.max:
+			self.max = seconds
+
+	def lines(self, name, labels=''):
+		'''Yield the histogram in the Prometheus text format, without the maximum, see histogram_lines.'''
+		label_prefix = labels + ',' if labels else ''
+		labels = '{' + labels + '}' if labels else ''
+		total = 0
+		for bound, count in zip(self.BOUNDS + ('+Inf',), self.counts):
+			total += count
+			yield f'{name}_bucket{{{label_prefix}le="{bound}"}} {total}'
+		yield f'{name}_sum{labels} {self.sum}'
+		yield f'{name}_count{labels} {total}'
+
+
+def label(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def histogram_lines(name, histograms):
+	'''Yield the histograms of a metric, as (labels, Histogram), in the
+	Prometheus text format. Their maxima are a gauge of their own, name_max,
+	since a histogram family may only have buckets, a sum and a count.'''
+	yield f'# TYPE {name} histogram'
+	for labels, histogram in histograms:
+		yield from histogram.lines(name, labels)
+	yield f'# TYPE {name}_max gauge'
+	for labels, histogram in histograms:
+		yield f'{name}_max{{{labels}}} {histogram.max}' if labels else f'{name}_max {histogram.max}'
+
+
+class Metrics:
+	'''What the server is busy with, for finding out why a game stutters.
+
+	The server only collects metrics if its metrics attribute is set to one
+	of these, otherwise all it costs is checking for None. Durations are
+	wall clock time, i.e. they include waiting for other tasks.'''
+	def __init__(self):
+		self.commands = collections.defaultdict(Histogram)  # message type name -> time Server.handle took
+		self.map_events = collections.defaultdict(Histogram)  # map event name -> time ProtocolGame.run took to handle it
+		self.loop_lag = Histogram()  # how much later than asked for the heartbeat woke up
+		self.messages_sent = collections.Counter()  # transport -> count
+		self.bytes_sent = collections.Counter()  # transport -> count
+		self.map_events_peak = 0  # longest Map.events backlog seen
+		self.started = time.time()
+		self.sources = []  # functions yielding more lines for render, e.g. trace.lines
+
+	def command_handled(self, name, seconds):
+		self.commands[name].observe(seconds)
+
+	def map_event_handled(self, name, seconds, backlog):
+		self.map_events[name].observe(seconds)
+		if backlog > self.map_events_peak:
+			self.map_events_peak = backlog
+
+	def sent(self, transport, messages, data_bytes):
+		self.messages_sent[transport] += messages
+		self.bytes_sent[transport] += data_bytes
+
+	async def heartbeat(self, interval=0.05):
+		'''Measure the event loop lag: a busy loop wakes us up late.'''
+		while True:
+			start = time.monotonic()
+			await curio.sleep(interval)
+			self.loop_lag.observe(max(time.monotonic() - start - interval, 0.0))
+
+	def render(self, server):
+		'''Return the metrics in the Prometheus text format.'''
+		lines = [f'reset_uptime_seconds {time.time() - self.started:.1f}']
+		lines.extend(histogram_lines('reset_command_seconds', [(f'command="{label(name)}"', histogram) for name, histogram in sorted(self.commands.items())]))
+		lines.extend(histogram_lines('reset_map_event_seconds', [(f'event="{label(name)}"', histogram) for name, histogram in sorted(self.map_events.items())]))
+		lines.extend(histogram_lines('reset_loop_lag_seconds', [('', self.loop_lag)]))
+
+		lines.append('# TYPE reset_messages_sent_total counter')
+		lines.extend(f'reset_messages_sent_total{{transport="{transport}"}} {count}' for transport, count in sorted(self.messages_sent.items()))
+		lines.append('# TYPE reset_bytes_sent_total counter')
+		lines.extend(f'reset_bytes_sent_total{{transport="{transport}"}} {count}' for transport, count in sorted(self.bytes_sent.items()))
+
+		clients = collections.Counter(client.transport for client in server.clients)
+		lines.append('# TYPE reset_clients gauge')
+		lines.extend(f'reset_clients{{transport="{transport}"}} {count}' for transport, count in sorted(clients.items()))
+		for key, stats in sorted(server.outbox_stats().items()):
+			for stat, value in stats.items():
+				lines.append(f'reset_outbox_{stat}{{client="{label(key)}"}} {value}')
+
+		map = getattr(server.protocol, 'map', None)  # only while a game is running
+		if map is not None:
+			lines.append(f'reset_map_events_backlog {map.events.qsize()}')
+			lines.append(f'reset_map_events_backlog_peak {self.map_events_peak}')
+			lines.append(f'reset_units {len(map.units)}')
+			lines.append(f'reset_action_tasks {map.action_task_count()}')
+		for source in self.sources:
+			lines.extend(source())
+		return '\n'.join(lines) + '\n'
+
+
+async def metrics_server(server, host, port):
+	'''Serve the server's metrics over HTTP as plain text, whatever the path.'''
+	async def metrics_client(sock, addr):
+		async with sock:
+			request = b''
+			while b'\r\n\r\n' not in request:
+				data = await sock.recv(4096)
+				if not data or len(request) > 65536:
+					return
+				request += data
+			body = server.metrics.render(server).encode()
+			await sock.sendall(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+	logger.info("Serving metrics", extra=fields(url=f"http://{host}:{port}/"))
+	await curio.tcp_server(host, port, metrics_client)
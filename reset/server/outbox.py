@@ -0,0 +1,111 @@
+import collections
+
+import curio
+
+from ..proto import events_pb2 as events
+
+
+COALESCE = 'coalesce'
+RESYNC = 'resync'
+DISCONNECT = 'disconnect'
+POLICIES = (COALESCE, RESYNC, DISCONNECT)
+
+
+def state_key(message):
+	'''Return a key for messages that only carry the latest value of some
+	state, so that a newer message with the same key makes an older one
+	obsolete. Returns None for all other messages.'''
+	if isinstance(message, events.EventUnitMove):
+		return (events.EventUnitMove, message.unit_id)
+	if isinstance(message, events.EventPlayerResource):
+		return (events.EventPlayerResource, message.resource_type_id)
+	return None
+
+
+class Outbox:
+	'''A bounded queue of reset.proto.Packets waiting to be sent to one client.
+
+	put never blocks, so a slow client cannot hold up a broadcast. What
+	happens if the client doesn't keep up depends on the policy:
+	 - coalesce: a packet replaces a queued packet with the same state_key,
+	   e.g. only the latest position of a unit is kept. If the queue is
+	   full nevertheless, resync.
+	 - resync: throw away everything queued. get returns Outbox.RESYNC, and
+	   the client should be sent the current state instead.
+	 - disconnect: throw away everything queued. get returns
+	   Outbox.DISCONNECT, and the client should be disconnected.
+
+	Can be used with util.get_batch like a curio.Queue.'''
+	RESYNC = object()
+	DISCONNECT = object()
+
+	def __init__(self, max_size=4096, policy=COALESCE):
+		if policy not in POLICIES:
+			raise ValueError(f"Unknown outbox policy {policy!r}")
+		self.max_size = max_size
+		self.policy = policy
+		self._items = collections.deque()  # [packet or marker, state key] slots, so coalescing can replace a packet in place
+		self._slots = {}  # state key -> queued slot
+		self._nonempty = curio.Event()
+		self._overflowed = False  # a marker is queued, nothing else will be until it is taken
+
+		self.max_depth = 0
+		self.coalesced = 0  # packets replaced by newer ones
+		self.dropped = 0  # packets thrown away on overflow
+		self.overflows = 0
+
+	def __len__(self):
+		return len(self._items)
+
+	def empty(self):
+		return not self._items
+
+	async def put(self, packet):
+		if self._overflowed:
+			self.dropped += 1
+			return
+		key = state_key(packet.message) if self.policy == COALESCE else None
+		if key is not None:
+			slot = self._slots.get(key)
+			if slot is not None:
+				slot[0] = packet
+				self.coalesced += 1
+				return
+		if len(self._items) >= self.max_size:
+			await self._overflow(self.DISCONNECT if self.policy == DISCONNECT else self.RESYNC)
+			return
+		slot = [packet, key]
+		self._items.append(slot)
+		if key is not None:
+			self._slots[key] = slot
+		self.max_depth = max(self.max_depth, len(self._items))
+		await self._nonempty.set()
+
+	async def _overflow(self, marker):
+		self.dropped += len(self._items) + 1
+		self.overflows += 1
+		self._items.clear()
+		self._slots.clear()
+		self._items.append([marker, None])
+		self._overflowed = True
+		await self._nonempty.set()
+
+	async def get(self):
+		while not self._items:
+			self._nonempty.clear()
+			await self._nonempty.wait()
+		item, key = self._items.popleft()
+		if key is not None:
+			del self._slots[key]
+		if item is self.RESYNC or item is self.DISCONNECT:
+			self._overflowed = False
+		return item
+
+	def stats(self):
+		return {
+			'depth': len(self._items),
+			'max_depth': self.max_depth,
+			'coalesced': self.coalesced,
+			'dropped': self.dropped,
+			'overflows': self.overflows,
+		}
@@ -1,19 +1,38 @@
+import collections
 import math
 from heapdict import heapdict
-from .game import vicinity
+
+import curio
+
+from . import trace
+
+YIELD_NODES = 256  # the async searches let other tasks run after visiting this many cells
 
 
 class PathFinder:
 	"""
 	Implement path finding using A*.
+
+	The searches are generators that yield every YIELD_NODES cells and
+	return their result. plan and flow_field run them to the end at once,
+	plan_async and flow_field_async let other tasks run in between. While
+	a search runs, the chunks of a ChunkedMap it touched stay unpacked.
 	"""
 
-	def __init__(self, map):
+	def __init__(self, map, max_nodes=None):
 		self.map = map
+		self.max_nodes = max_nodes if max_nodes is not None else map.path_search_limit
 
-	def _idx(self, pos):
-		x, y = pos
-		return y * self.map.width + x
+	def node_limit(self, distance):
+		"""
+		Return how many cells a search for a cell distance away may visit:
+		twice the square of cells around the start that are at most that
+		far away, to allow for detours, but not more than max_nodes. None
+		if there is no limit.
+		"""
+		if self.max_nodes is None:
+			return None
+		return min(self.max_nodes, 2 * (2 * distance + 1) ** 2)
 
 	def plan(self, start_pos, dest_pos):
 		"""
@@ -23,45 +42,104 @@ class PathFinder:
 		start_pos to dest_pos. Ignores whether any units are in the
 		way. If no path to dest_pos can be found, returns a path to a
 		nearby reachable position.
+
+		Only the cells the search actually reaches are looked at, so
+		this also works on a ChunkedMap without generating all of it.
+		If max_nodes is set, the search gives up after visiting
+		node_limit cells and heads for the closest cell it found.
 		"""
+		with trace.span('plan'), self.map.pinned():
+			return run(self._plan(start_pos, dest_pos))
 
-		map_size = self.map.width * self.map.height
-		dist = [float('inf') for i in range(map_size)]
-		prev = [None for i in range(map_size)]
+	async def plan_async(self, start_pos, dest_pos):
+		"""
+		Like plan, but lets other tasks run during a long search.
+		"""
+		with trace.span('plan'), self.map.pinned():
+			return await run_async(self._plan(start_pos, dest_pos))
 
-		dist[self._idx(start_pos)] = 0
+	def _plan(self, start_pos, dest_pos):
+		max_nodes = self.node_limit(chebyshev_distance(start_pos, dest_pos))
+		dist = {start_pos: 0}
+		prev = {}
+		done = set()
 
 		pq = heapdict()
-		for y in range(self.map.height):
-			for x in range(self.map.width):
-				pq[x, y] = dist[self._idx((x, y))]
+		pq[start_pos] = chebyshev_distance(start_pos, dest_pos)
 
 		while pq:
 			pos, _ = pq.popitem()
+			if pos == dest_pos:
+				break
+			done.add(pos)
+			if max_nodes is not None and len(done) >= max_nodes:
+				break
+			if len(done) % YIELD_NODES == 0:
+				yield
 			x, y = pos
 
-			for nx, ny in self._neighbors(x, y):
-				new_dist = dist[self._idx(pos)] + 1
-				if new_dist < dist[self._idx((nx, ny))]:
-					dist[self._idx((nx, ny))] = new_dist
+			new_dist = dist[pos] + 1
+			for npos in self._neighbors(x, y):
+				if npos in done:
+					continue
+				if new_dist < dist.get(npos, math.inf):
+					dist[npos] = new_dist
 					# Heuristic function is only admissible if it never
 					# overestimates true costs. Because diagonals only
 					# have costs of 1, we cannot use the euclidian
 					# distance as heuristic. Instead, we use the chebyshev
 					# distance.
-					pq[nx, ny] = new_dist + chebyshev_distance((nx, ny), dest_pos)
-					prev[self._idx((nx, ny))] = x, y
+					pq[npos] = new_dist + chebyshev_distance(npos, dest_pos)
+					prev[npos] = pos
 
-		if math.isinf(dist[self._idx(dest_pos)]):
-			for point in vicinity(dest_pos, self.map.width, self.map.height):
-				if not math.isinf(dist[self._idx(point)]):
-					dest_pos = point
-					break
-			else:
-				raise ValueError("cannot find a path")
+		if dest_pos not in dist:
+			# head for the reachable cell closest to the destination, like game.vicinity would find it
+			dest_pos = min(dist, key=lambda p: (manhattan_distance(p, dest_pos), dist[p]))
 
 		return self._reconstruct_path(start_pos, dest_pos, prev)
 
+	def flow_field(self, dest_pos, start_positions):
+		"""
+		Search paths from all of start_positions to dest_pos at once.
+
+		A single breadth-first search from dest_pos, which is a lot
+		cheaper than a search per unit when many units head for the
+		same cell. It stops once all start positions are reached, or
+		after visiting max_nodes cells.
+
+		Returns a FlowField, which can give a path from any cell the
+		search reached, not only from the start positions.
+		"""
+		with trace.span('flow_field'), self.map.pinned():
+			return run(self._flow_field(dest_pos, start_positions))
+
+	async def flow_field_async(self, dest_pos, start_positions):
+		"""
+		Like flow_field, but lets other tasks run during a long search.
+		"""
+		with trace.span('flow_field'), self.map.pinned():
+			return await run_async(self._flow_field(dest_pos, start_positions))
+
+	def _flow_field(self, dest_pos, start_positions):
+		max_nodes = self.node_limit(max((chebyshev_distance(pos, dest_pos) for pos in start_positions), default=0))
+		next_pos = {dest_pos: None}
+		missing = set(start_positions) - {dest_pos}
+		queue = collections.deque([dest_pos])
+		visited = 0
+		while queue and missing:
+			if max_nodes is not None and len(next_pos) >= max_nodes:
+				break
+			visited += 1
+			if visited % YIELD_NODES == 0:
+				yield
+			pos = queue.popleft()
+			for npos in self._neighbors(*pos):
+				if npos not in next_pos:
+					next_pos[npos] = pos
+					missing.discard(npos)
+					queue.append(npos)
+		return FlowField(dest_pos, next_pos)
+
 	def _neighbors(self, x, y):
 		offsets = [
 			(-1, -1), (-1, 0), (-1, 1),
@@ -85,13 +163,68 @@ class PathFinder:
 		path = []
 		while next_pos != start_pos:
 			path.append(next_pos)
-			next_pos = prev[self._idx(next_pos)]
+			next_pos = prev[next_pos]
 		path.reverse()
 		return path
 
 
+class FlowField:
+	"""
+	Paths to a destination from every cell a PathFinder.flow_field
+	search reached. Like the paths of PathFinder.plan, they ignore
+	units in the way.
+	"""
+
+	def __init__(self, dest_pos, next_pos):
+		self.dest_pos = dest_pos
+		self._next = next_pos  # cell -> next cell on the way to dest_pos
+
+	def __contains__(self, pos):
+		return pos in self._next
+
+	def path(self, start_pos):
+		"""
+		Return the path from start_pos like PathFinder.plan, or None if
+		the search didn't reach start_pos.
+		"""
+		if start_pos not in self._next:
+			return None
+		path = []
+		pos = self._next[start_pos]
+		while pos is not None:
+			path.append(pos)
+			pos = self._next[pos]
+		return path
+
+
+def run(search):
+	"""Run a search generator to the end and return its result."""
+	try:
+		while True:
+			next(search)
+	except StopIteration as stop:
+		return stop.value
+
+
+async def run_async(search):
+	"""Run a search generator, letting other tasks run whenever it yields, and return its result."""
+	try:
+		while True:
+			next(search)
+			await curio.sleep(0)
+	except StopIteration as stop:
+		return stop.value
+
+
 def chebyshev_distance(a, b):
 	"""Compute the chebyshev distance, or maximum metric, between a and b."""
 	ax, ay = a
 	bx, by = b
 	return max(abs(ax - bx), abs(ay - by))
+
+
+def manhattan_distance(a, b):
+	"""Compute the manhattan distance between a and b."""
+	ax, ay = a
+	bx, by = b
+	return abs(ax - bx) + abs(ay - by)
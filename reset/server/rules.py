@@ -48,19 +48,44 @@ class ActionState(enum.Enum):
 
 
 class Action:
-	def __init__(self, id, action_type, unit, mode, target_unit=None, target_cell=None):
+	def __init__(self, id, action_type, unit, mode, target_unit=None, target_cell=None, group=None):
 		self.id = id
 		self.action_type = action_type
 		self.unit = unit
 		self.mode = mode
 		self.target_unit = target_unit
 		self.target_cell = target_cell
+		self.state = ActionState.QUEUED
+		self.group = group
 
 	@property
 	def player(self):
 		return self.unit.player
 
 
+class ActionGroup:
+	'''Actions of the same type and target that were queued together for
+	many units. Executors can use it to share work between them, e.g. a
+	single path search for all units moving to the same cell.'''
+	def __init__(self):
+		self.actions = []
+		self._shared = {}
+
+	def shared(self, key, compute):
+		'''Return the value stored under key, calling compute to create it on first use.'''
+		if key not in self._shared:
+			self._shared[key] = compute()
+		return self._shared[key]
+
+	async def shared_async(self, key, compute):
+		'''Like shared, but compute returns a coroutine. It runs in a task of
+		its own, so that actions that ask while it runs wait for the same
+		result, even if the one that started it is cancelled.'''
+		if key not in self._shared:
+			self._shared[key] = await curio.spawn(compute(), daemon=True)
+		return await self._shared[key].join()
+
+
 class ActionType:
 	def __init__(self, id, executor, name, description, unit_type, cost=None, duration=0.0, default_mode=ActionMode.ONCE, target_type=ActionTargetType.NONE, target_tags=None):
 		self.id = id
@@ -0,0 +1,95 @@
+from ..proto import events_pb2 as events, events_envelope
+from . import game
+
+
+class Snapshots:
+	'''Builds EventSnapshots of a map for clients that join a running game.
+
+	The terrain barely changes during a game, so it is kept encoded in
+	chunks of chunk_size x chunk_size cells. A snapshot is put together
+	from these encoded chunks and the current units, resources and actions,
+	which are small in comparison. A chunk is encoded again only after one
+	of its cells changed, see invalidate.
+
+	Of a ChunkedMap, only the chunks within surroundings cells of the
+	player's units are included, and only the units in those chunks.'''
+	def __init__(self, map, chunk_size=32, surroundings=32):
+		self.map = map
+		self.chunk_size = chunk_size
+		self.surroundings = surroundings
+		self._chunks = {}  # (cx, cy) -> serialized EventSnapshot holding only that chunk
+		self.hits = 0
+		self.misses = 0
+
+	def invalidate(self, xy):
+		x, y = xy
+		self._chunks.pop((x // self.chunk_size, y // self.chunk_size), None)
+
+	def _chunk(self, key):
+		data = self._chunks.get(key)
+		if data is not None:
+			self.hits += 1
+			return data
+		self.misses += 1
+		cx, cy = key
+		x0, y0 = cx * self.chunk_size, cy * self.chunk_size
+		x1, y1 = min(x0 + self.chunk_size, self.map.width), min(y0 + self.chunk_size, self.map.height)
+		message = events.EventSnapshot()
+		chunk = message.chunks.add(width=x1 - x0, height=y1 - y0)
+		chunk.position.x, chunk.position.y = x0, y0
+		ids = []
+		for y in range(y0, y1):
+			for x in range(x0, x1):
+				terrain_type = self.map[x, y].terrain_type
+				ids.append(terrain_type.id if terrain_type is not None else 0)
+		chunk.terrain_type_ids[:] = ids
+		# Serialized messages can be concatenated to merge them, so this is
+		# exactly the bytes this chunk adds to a snapshot.
+		data = message.SerializePartialToString()
+		self._chunks[key] = data
+		return data
+
+	def _chunk_keys(self, player):
+		size = self.chunk_size
+		if not isinstance(self.map, game.ChunkedMap):
+			return [(cx, cy) for cy in range(-(-self.map.height // size)) for cx in range(-(-self.map.width // size))]
+		# Sending all of a huge map is out of the question, and most of it
+		# isn't even generated. Send the surroundings of the player's units,
+		# like at game start.
+		if player is None:
+			return []
+		keys = set()
+		r = self.surroundings
+		for unit in list(self.map.units):
+			if unit.player is player:
+				x, y = self.map.get_location(unit)
+				for cy in range(max(y - r, 0) // size, min(y + r, self.map.height - 1) // size + 1):
+					for cx in range(max(x - r, 0) // size, min(x + r, self.map.width - 1) // size + 1):
+						keys.add((cx, cy))
+		return sorted(keys)
+
+	def build(self, player=None):
+		'''Return a reset.proto.Packet with an EventSnapshot for player, or for a spectator if player is None.'''
+		keys = self._chunk_keys(player)
+		included = set(keys) if isinstance(self.map, game.ChunkedMap) else None
+		message = events.EventSnapshot(width=self.map.width, height=self.map.height)
+		for other in self.map.players:
+			message.players.add(player_id=other.id, name=other.name)
+		for unit in self.map.units:
+			xy = self.map.get_location(unit)
+			if xy is None:
+				continue
+			if included is not None and (xy[0] // self.chunk_size, xy[1] // self.chunk_size) not in included:
+				continue  # the client gets it with the region it is in
+			event = message.units.add(unit_id=unit.id, player_id=unit.player.id if unit.player else 0, unit_type_id=unit.unit_type.id)
+			event.position.x, event.position.y = xy
+		if player is not None:
+			message.player_id = player.id
+			for resource_type, resource_value in player.resources.items():
+				message.resources.add(resource_type_id=resource_type.id, amount=resource_value.value)
+			for unit in self.map.units:
+				if unit.player is player:
+					for action in unit.queued_actions:
+						message.actions.add(action_id=action.id, unit_id=unit.id, action_type_id=action.action_type.id, state=action.state.value)
+		data = message.SerializeToString() + b''.join(self._chunk(key) for key in keys)
+		return events_envelope.encoded_packet(events.EventSnapshot, data)
@@ -1,71 +1,120 @@
-import traceback
+import logging
+import os
 
 import curio
+from curio import socket
 
-from ..proto import events_pb2 as events, commands_pb2 as commands, recv_len
+from ..proto import commands_pb2 as commands, FrameReader, events_envelope, commands_envelope
+from ..log import fields
 from . import Client
 
 
+logger = logging.getLogger(__name__)
+
+
 class TcpClient(Client):
-	def __init__(self, sock, addr):
-		super(TcpClient, self).__init__()
+	'''A client speaking length-prefixed protobuf over a stream socket,
+	i.e. TCP or a Unix domain socket. addr is a (host, port) tuple for TCP
+	and the socket's path for Unix domain sockets.
+
+	The send loop writes all packets that are queued at the same time (up to
+	max_batch) with a single sendall. With max_latency, it waits up to that
+	many seconds for more packets before writing, trading latency for fewer
+	syscalls and TCP segments. With batch, these packets go out as a single
+	EventBatch frame instead of one frame each.'''
+	def __init__(self, sock, addr, max_batch=64, max_latency=0.0, outbox=None, batch=True):
+		super(TcpClient, self).__init__(outbox)
 		self.sock = sock
 		self.addr = addr
-		self._queue = curio.Queue()  # binary packets
+		self.max_batch = max_batch
+		self.max_latency = max_latency
+		self.batch = batch
+		self.transport = 'unix' if isinstance(addr, str) else 'tcp'
+		self.max_frame_size = 1 << 16  # commands are tiny, anything bigger is garbage
+
+		self.messages_sent = 0
+		self.bytes_sent = 0
+		self.sends = 0  # sendall calls
 
 	async def close(self):
-		self.sock.shutdown(socket.SHUT_RDWR)
-		self.sock.close()
+		try:
+			await self.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass  # already disconnected
+		await self.sock.close()
 		await super(TcpClient, self).close()
 
 	async def _run_recv(self, server):
 		await server.protocol.on_connect(server, self)
+		reader = FrameReader(self.sock, self.max_frame_size)
 		try:
 			while True:
-				packet_length = int.from_bytes(await recv_len(self.sock, 4), 'big')
-				packet = await recv_len(self.sock, packet_length)
-				try:
-					wrapper = commands.ClientToServer()
-					wrapper.ParseFromString(packet)
-					message = getattr(wrapper, wrapper.WhichOneof("payload"))
-					await server.protocol.handle(server, self, message)
-				except:
-					traceback.print_exc()
+				for packet in await reader.frames():
+					try:
+						wrapper = commands.ClientToServer()
+						wrapper.ParseFromString(packet)
+						message = commands_envelope.unwrap(wrapper)
+						await server.handle(self, message)
+					except:
+						logger.exception("Failed to handle message", extra=fields(client=str(self)))
 		except ConnectionResetError:
 			await server.protocol.on_disconnect(server, self)
 
 	async def _run_send(self):
 		while True:
-			message = await self._queue.get()
-			wrapper = events.ServerToClient()
-			for fd in wrapper.DESCRIPTOR.oneofs_by_name["payload"].fields:
-				if message.DESCRIPTOR == fd.message_type:
-					getattr(wrapper, fd.name).CopyFrom(message)
-					break
-			packet = wrapper.SerializeToString()
-			#print(self, "<", packet)
-			await self.sock.sendall(len(packet).to_bytes(4, 'big'))
-			await self.sock.sendall(packet)
+			try:
+				packets = await self._next_packets(self.max_batch, self.max_latency)
+			except ConnectionResetError:
+				await self.close()
+				return
+			if self.batch and len(packets) > 1:
+				data = events_envelope.batch(packets).frame()
+			else:
+				data = b''.join(packet.frame() for packet in packets)
+			try:
+				await self.sock.sendall(data)
+			except OSError:
+				return  # disconnected, _run_recv takes care of it
+			self.messages_sent += len(packets)
+			self.bytes_sent += len(data)
+			self.sends += 1
+			if self.server.metrics is not None:
+				self.server.metrics.sent(self.transport, len(packets), len(data))
 
 	async def run(self, server):
-		async with curio.TaskGroup() as g:
+		self.server = server
+		async with curio.TaskGroup(wait=any) as g:
 			await g.spawn(self._run_recv(server))
 			await g.spawn(self._run_send())
 
-	async def send(self, message):
-		await self._queue.put(message)
-
 	def __str__(self):
-		return f"TcpClient{{{self._addr[0]}:{self._addr[1]}}}"
+		if isinstance(self.addr, str):
+			return f"TcpClient{{unix:{self.addr}}}"
+		return f"TcpClient{{{self.addr[0]}:{self.addr[1]}}}"
 
 
-async def tcp_server(server, host, port):
+async def _serve(server, client):
+	await server.add_client(client)
+	try:
+		await client.run(server)
+	finally:
+		await server.remove_client(client)
+		await client.close()
+
+
+async def tcp_server(server, host, port, max_batch=64, max_latency=0.0, batch=True):
 	async def tcp_client(sock, addr):
-		client = TcpClient(sock, addr)
-		await server.add_client(client)
-		try:
-			await client.run(server)
-		finally:
-			await server.remove_client(client)
-	print(f"TCP Server listening on {host}:{port}")
+		await _serve(server, TcpClient(sock, addr, max_batch, max_latency, server.outbox(), batch))
+	logger.info("TCP Server listening", extra=fields(host=host, port=port))
 	await curio.tcp_server(host, port, tcp_client)
+
+
+async def unix_server(server, path, max_batch=64, max_latency=0.0, batch=True):
+	'''The same as tcp_server, but on a Unix domain socket, for bots and
+	tests running on the same host. This skips the TCP/IP stack.'''
+	async def unix_client(sock, addr):
+		await _serve(server, TcpClient(sock, path, max_batch, max_latency, server.outbox(), batch))
+	if os.path.exists(path):
+		os.unlink(path)  # left over from an earlier run
+	logger.info("Unix socket Server listening", extra=fields(path=path))
+	await curio.unix_server(path, unix_client)
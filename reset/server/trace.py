@@ -0,0 +1,56 @@
+'''Optional tracing spans: how long parts of the game logic take, by action type.
+
+	with trace.span('execute', action.action_type.name):
+		await action.action_type.executor(map, action)
+
+Spans are only recorded after enable(), e.g. with the server's --trace, and
+show up in its metrics. Otherwise span returns a shared object that does
+nothing.'''
+import collections
+import time
+
+from .metrics import Histogram, histogram_lines, label
+
+spans = None  # (span name, action type name) -> Histogram, while tracing
+
+
+def enable():
+	global spans
+	if spans is None:
+		spans = collections.defaultdict(Histogram)
+
+
+class Span:
+	__slots__ = ('key', 'start')
+
+	def __init__(self, name, detail):
+		self.key = (name, detail)
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+
+	def __exit__(self, exc_type, exc_value, exc_traceback):
+		spans[self.key].observe(time.perf_counter() - self.start)
+
+
+class NoSpan:
+	def __enter__(self):
+		pass
+
+	def __exit__(self, exc_type, exc_value, exc_traceback):
+		pass
+
+
+NO_SPAN = NoSpan()
+
+
+def span(name, detail=''):
+	'''Time the with block as the span name, e.g. of an action type name as detail.'''
+	return NO_SPAN if spans is None else Span(name, detail)
+
+
+def lines():
+	'''Yield the spans in the Prometheus text format.'''
+	if spans is None:
+		return
+	yield from histogram_lines('reset_span_seconds', [(f'span="{label(name)}",action_type="{label(detail)}"', histogram) for (name, detail), histogram in sorted(spans.items())])
@@ -1,25 +1,85 @@
-import traceback
+import logging
+import time
+import zlib
 
 from wsproto.connection import ConnectionType, WSConnection
-from wsproto.events import ConnectionClosed, ConnectionRequested, PingReceived, TextReceived
+from wsproto.events import BytesReceived, ConnectionClosed, ConnectionRequested, PingReceived, TextReceived
+from wsproto.extensions import PerMessageDeflate
+from wsproto.frame_protocol import Opcode
 import curio
 from curio import socket
 import google.protobuf.json_format
 
-from ..proto import events_pb2 as events, commands_pb2 as commands
+from ..proto import events_pb2 as events, commands_pb2 as commands, events_envelope, commands_envelope
+from ..log import fields
 from . import Client
 
 
+logger = logging.getLogger(__name__)
+
+
+SUBPROTOCOL_PROTOBUF = 'reset.protobuf'  # binary frames holding the same serialized envelopes as the TCP transport
+SUBPROTOCOL_JSON = 'reset.json'  # text frames with JSON encoded envelopes, also used if the client asks for no subprotocol
+
+
+class Deflate(PerMessageDeflate):
+	'''The permessage-deflate extension with a configurable compression level.
+	Messages shorter than threshold bytes are sent uncompressed, which the
+	extension allows per message. Counts the bytes before and after
+	compression and the time spent compressing.
+
+	Without context takeover, every message is compressed on its own. This
+	saves the ~300KiB of compressor state per client between messages, but
+	compresses small repetitive messages a lot worse.
+
+	This overrides frame_outbound and uses its private _compressor and
+	_compressible_opcode, which is why requirements.txt pins wsproto 0.12.'''
+	def __init__(self, level=6, threshold=64, context_takeover=True):
+		super(Deflate, self).__init__(server_no_context_takeover=not context_takeover)
+		self.level = level
+		self.threshold = threshold
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self.seconds = 0.0
+
+	def frame_outbound(self, proto, opcode, rsv, data, fin):
+		if opcode is Opcode.CONTINUATION or not self._compressible_opcode(opcode):
+			return super(Deflate, self).frame_outbound(proto, opcode, rsv, data, fin)
+		self.bytes_in += len(data)
+		if fin and len(data) < self.threshold:
+			self.bytes_out += len(data)
+			return (rsv, data)
+		if self._compressor is None:
+			self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, -int(self.server_max_window_bits))
+		start = time.perf_counter()
+		rsv, data = super(Deflate, self).frame_outbound(proto, opcode, rsv, data, fin)
+		self.seconds += time.perf_counter() - start
+		self.bytes_out += len(data)
+		return (rsv, data)
+
+
 class WebsocketClient(Client):
-	def __init__(self, sock, addr):
-		super(WebsocketClient, self).__init__()
+	'''With batch, packets that are queued at the same time are sent as one
+	EventBatch message. This is off by default, since WebSocket clients
+	that don't know EventBatch would miss those packets.'''
+	transport = 'ws'
+
+	def __init__(self, sock, addr, deflate=None, outbox=None, batch=False):
+		super(WebsocketClient, self).__init__(outbox)
 		self.sock = sock
 		self.addr = addr
-		self._queue = curio.Queue()
+		self.deflate = Deflate(**deflate) if deflate is not None else None  # offered to the client, used if it accepts
+		self.subprotocol = None
+		self.batch = batch
+		self._accepted = curio.Event()
+		self._message = []  # fragments of a message that is still being received
 
 	async def close(self):
-		self.sock.shutdown(socket.SHUT_RDWR)
-		self.sock.close()
+		try:
+			await self.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass  # already disconnected
+		await self.sock.close()
 		await super(WebsocketClient, self).close()
 
 	async def _run_recv(self, server, ws):
@@ -27,66 +87,87 @@ class WebsocketClient(Client):
 		try:
 			while True:
 				segment = await self.sock.recv(0xffff)
-				#print(">", self, segment)
+				if not segment:
+					raise ConnectionResetError()
 				ws.receive_bytes(segment)
 				for event in ws.events():
 					if isinstance(event, ConnectionRequested):
-						print('Accepting WebSocket upgrade')
-						ws.accept(event)
+						self.subprotocol = SUBPROTOCOL_PROTOBUF if SUBPROTOCOL_PROTOBUF in event.proposed_subprotocols else SUBPROTOCOL_JSON
+						logger.debug("Accepting WebSocket upgrade", extra=fields(client=str(self), subprotocol=self.subprotocol))
+						ws.accept(event, self.subprotocol if self.subprotocol in event.proposed_subprotocols else None)
+						await self._accepted.set()
 					elif isinstance(event, ConnectionClosed):
-						print('Connection closed: code={}/{} reason={}'.format(
-							event.code.value, event.code.name, event.reason))
+						logger.info("Connection closed", extra=fields(client=str(self), code=event.code.value, code_name=event.code.name, reason=event.reason))
 						raise ConnectionResetError()
-					elif isinstance(event, TextReceived):
-						try:
-							wrapper = commands.ClientToServer()
-							google.protobuf.json_format.Parse(event.data, wrapper)
-							message = getattr(wrapper, wrapper.WhichOneof("payload"))
-							await server.protocol.handle(server, self, message)
-						except:
-							traceback.print_exc()
+					elif isinstance(event, (TextReceived, BytesReceived)):
+						self._message.append(event.data)
+						if event.message_finished:
+							data = (''.join if isinstance(event, TextReceived) else b''.join)(self._message)
+							self._message = []
+							await self._handle_message(server, data)
 					elif isinstance(event, PingReceived):
 						pass
 					else:
-						print('Unknown event: {!r}'.format(event))
+						logger.warning("Unknown WebSocket event %r", type(event).__name__, extra=fields(client=str(self)))
 				await self.sock.sendall(ws.bytes_to_send())
 		except ConnectionResetError:
 			await server.protocol.on_disconnect(server, self)
 
+	async def _handle_message(self, server, data):
+		try:
+			wrapper = commands.ClientToServer()
+			if isinstance(data, str):
+				google.protobuf.json_format.Parse(data, wrapper)
+			else:
+				wrapper.ParseFromString(data)
+			message = commands_envelope.unwrap(wrapper)
+			await server.handle(self, message)
+		except Exception:
+			logger.exception("Failed to handle message", extra=fields(client=str(self)))
+
 	async def _run_send(self, ws):
+		await self._accepted.wait()
+		binary = self.subprotocol == SUBPROTOCOL_PROTOBUF
 		while True:
-			message = await self._queue.get()
-			wrapper = events.ServerToClient()
-			for fd in wrapper.DESCRIPTOR.oneofs_by_name["payload"].fields:
-				if message.DESCRIPTOR == fd.message_type:
-					getattr(wrapper, fd.name).CopyFrom(message)
-					break
-			packet = google.protobuf.json_format.MessageToJson(wrapper)
-			ws.send_data(packet)
-			#print("<", self, packet)
-			await self.sock.sendall(ws.bytes_to_send())
+			try:
+				packets = await self._next_packets(64)
+			except ConnectionResetError:
+				await self.close()
+				return
+			count = len(packets)
+			if self.batch and len(packets) > 1:
+				packets = [events_envelope.batch(packets)]
+			for packet in packets:
+				ws.send_data(packet.protobuf() if binary else packet.json())
+			data = ws.bytes_to_send()
+			try:
+				await self.sock.sendall(data)
+			except OSError:
+				return  # disconnected, _run_recv takes care of it
+			if self.server.metrics is not None:
+				self.server.metrics.sent(self.transport, count, len(data))
 
 	async def run(self, server):
 		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-		ws = WSConnection(ConnectionType.SERVER)
-		async with curio.TaskGroup() as g:
+		self.server = server
+		ws = WSConnection(ConnectionType.SERVER, extensions=[self.deflate] if self.deflate is not None else None)
+		async with curio.TaskGroup(wait=any) as g:
 			await g.spawn(self._run_recv(server, ws))
 			await g.spawn(self._run_send(ws))
 
-	async def send(self, message):
-		await self._queue.put(message)
-
 	def __str__(self):
 		return f"WebsocketClient{{{self.addr[0]}:{self.addr[1]}}}"
 
 
-async def ws_server(server, host, port):
+async def ws_server(server, host, port, deflate=None, batch=False):
+	'''deflate is None to disable compression, or a dict of arguments for Deflate.'''
 	async def ws_client(sock, addr):
-		client = WebsocketClient(sock, addr)
+		client = WebsocketClient(sock, addr, deflate, server.outbox(), batch)
 		await server.add_client(client)
 		try:
 			await client.run(server)
 		finally:
 			await server.remove_client(client)
-	print(f"Websocket Server listening on {host}:{port}")
+			await client.close()
+	logger.info("Websocket Server listening", extra=fields(host=host, port=port))
 	await curio.tcp_server(host, port, ws_client)
\ No newline at end of file
@@ -1,3 +1,5 @@
+import time
+
 import curio
 
 
@@ -105,3 +107,22 @@ class ScopeTask:
 		await self.task.cancel()
 		self.task = None
 
+
+async def get_batch(queue, max_count, max_latency=0.0):
+	'''Wait for an item from the queue and return a list with it and up to
+	max_count - 1 items queued behind it. If max_latency is not zero, wait up
+	to that many seconds after the first item for more items to arrive.'''
+	items = [await queue.get()]
+	deadline = time.monotonic() + max_latency
+	while len(items) < max_count:
+		if not queue.empty():
+			items.append(await queue.get())
+			continue
+		remaining = deadline - time.monotonic()
+		if remaining <= 0:
+			break
+		item = await curio.ignore_after(remaining, queue.get())
+		if item is None:
+			break
+		items.append(item)
+	return items
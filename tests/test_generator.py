@@ -0,0 +1,44 @@
+'''Seeded regular maps stay the same. MAP_SHA1 is the map generated with
+seed 1 for 4 players before huge worlds changed how the noise is sampled;
+changes to the generator that only concern worlds must not change it.'''
+import hashlib
+
+import curio
+
+from reset import util
+from reset.server.__main__ import gen
+from reset.server.game import Player
+
+PLAYERS = 4
+MAP_SHA1 = "57982beae2cf32680127bcf04ea18f5fec898187"
+
+
+def generate(chunk_size=None):
+	gen.seed = 1
+	gen.chunk_size = chunk_size
+	gen.workers = None
+	gen.world_size = None
+	gen.cache = None
+	players = util.IdList(Player)
+	for i in range(PLAYERS):
+		players.create(f"player{i}", None)
+	return curio.run(gen.generate(players))
+
+
+def fingerprint(map):
+	'''A hash of the terrain and the units of every cell.'''
+	h = hashlib.sha1(f"{map.width}x{map.height}".encode())
+	for y in range(map.height):
+		for x in range(map.width):
+			cell = map[x, y]
+			unit = cell.unit
+			h.update(f"{cell.terrain_type.name},{unit.unit_type.name if unit else ''},{unit.player.id if unit and unit.player else ''};".encode())
+	return h.hexdigest()
+
+
+def test_seeded_map():
+	assert fingerprint(generate()) == MAP_SHA1
+
+
+def test_seeded_map_in_tiles():
+	assert fingerprint(generate(chunk_size=16)) == MAP_SHA1
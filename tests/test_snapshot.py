@@ -0,0 +1,86 @@
+'''Reconnecting to a game on a huge world map, where the snapshot only holds
+the units near the player's own.'''
+import logging
+import types
+
+import curio
+
+from reset import util
+from reset.client import GameState, ProtocolUser, Rules
+from reset.proto import events_pb2 as events, events_envelope
+from reset.server import game
+from reset.server.snapshot import Snapshots
+
+SIZE = 1024
+CHUNK_SIZE = 32
+
+GRASS = types.SimpleNamespace(id=1, name="grass", tags={"walk"})
+CITIZEN = types.SimpleNamespace(id=1, name="citizen")
+
+
+def fill(map, x0, y0, width, height):
+	for y in range(y0, y0 + height):
+		for x in range(x0, x0 + width):
+			map[x, y].terrain_type = GRASS
+
+
+def make_world():
+	players = util.IdList(game.Player)
+	alice = players.create("alice", None)
+	bob = players.create("bob", None)
+	map = game.ChunkedMap(players, SIZE, SIZE, CHUNK_SIZE, 16, fill)
+	near = map.spawn_unit((10, 10), CITIZEN, alice)
+	far = map.spawn_unit((900, 900), CITIZEN, bob)
+	return map, alice, near, far
+
+
+def make_client():
+	rules = Rules()
+	rules.terrain_types[GRASS.id] = GRASS
+	rules.unit_types[CITIZEN.id] = CITIZEN
+	return types.SimpleNamespace(state=GameState(), rules=rules)
+
+
+def receive(client, packet):
+	'''Handle a packet the server sent like Client._run_net does, without catching errors.'''
+	message = events.ServerToClient()
+	message.ParseFromString(packet.protobuf())
+	protocol = ProtocolUser(logging.getLogger(__name__))
+
+	async def handle():
+		for payload in events_envelope.unwrap_all(message):
+			await protocol.handle(None, client, payload)
+	curio.run(handle)
+
+
+def test_world_snapshot_only_has_nearby_units():
+	map, alice, near, far = make_world()
+	client = make_client()
+	receive(client, Snapshots(map, CHUNK_SIZE).build(alice))
+	assert set(client.state.units) == {near.id}
+	assert client.state.map[10, 10].unit.id == near.id
+
+
+def test_reconnect_in_world_ignores_unknown_units():
+	map, alice, near, far = make_world()
+	client = make_client()
+	receive(client, Snapshots(map, CHUNK_SIZE).build(alice))
+	# The server broadcasts the events of all units, also of those the client doesn't know.
+	receive(client, events_envelope.batch([
+		events_envelope.packet(events.EventUnitMove(unit_id=far.id, position=dict(x=901, y=900))),
+		events_envelope.packet(events.EventUnitUpdate(unit_id=far.id, tags=["busy"])),
+		events_envelope.packet(events.EventUnitMove(unit_id=near.id, position=dict(x=11, y=10))),
+		events_envelope.packet(events.EventUnitDestroy(unit_id=far.id)),
+	]))
+	assert set(client.state.units) == {near.id}
+	assert client.state.units[near.id].position == (11, 10)
+	assert client.state.map[11, 10].unit.id == near.id
+
+
+def test_spectator_world_snapshot():
+	map, alice, near, far = make_world()
+	client = make_client()
+	receive(client, Snapshots(map, CHUNK_SIZE).build(None))
+	assert client.state.units == {}
+	receive(client, events_envelope.packet(events.EventUnitMove(unit_id=near.id, position=dict(x=11, y=10))))
+	assert client.state.units == {}